@@ -0,0 +1,87 @@
+"""Benchmark of the CAMELS US file parsers in `functions.camelsfiles` against the previous string-date parser.
+
+Checks that both parsers return identical values, then parses the forcing and discharge files of all basins (531 in
+the CAMELS US basin list) of a CAMELS US directory with the previous parser, the new parser and the new parser with a
+warm binary cache. Run from the repository root with
+``python -m benchmarks.camels_parser <CAMELS US directory> [forcing product]``.
+"""
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+from functions.camelsfiles import (get_camels_us_manifest, read_camels_us_discharge_file,
+                                   read_camels_us_forcing_file)
+
+
+def _read_forcing_file_reference(file_path: Path):
+    # the parser used by the loaders before `read_camels_us_forcing_file`
+    with open(file_path, 'r') as fp:
+        fp.readline()
+        fp.readline()
+        area = int(fp.readline())
+        df = pd.read_csv(fp, sep=r'\s+')
+        df["date"] = pd.to_datetime(df.Year.map(str) + "/" + df.Mnth.map(str) + "/" + df.Day.map(str),
+                                    format="%Y/%m/%d")
+        df = df.set_index("date")
+    return df, area
+
+
+def _read_discharge_file_reference(file_path: Path):
+    # the parser used by the loaders before `read_camels_us_discharge_file`
+    col_names = ['basin', 'Year', 'Mnth', 'Day', 'QObs', 'flag']
+    df = pd.read_csv(file_path, sep=r'\s+', header=None, names=col_names)
+    df["date"] = pd.to_datetime(df.Year.map(str) + "/" + df.Mnth.map(str) + "/" + df.Day.map(str), format="%Y/%m/%d")
+    df = df.set_index("date")
+    return df.QObs
+
+
+def _time(fn, files) -> float:
+    start = time.perf_counter()
+    for file in files:
+        fn(file)
+    return time.perf_counter() - start
+
+
+def main():
+    data_dir = Path(sys.argv[1])
+    forcings = sys.argv[2] if len(sys.argv) > 2 else 'daymet'
+
+    manifest = get_camels_us_manifest(data_dir)
+    forcing_files = [data_dir / entry['file'] for _, entry in sorted(manifest['forcings'][forcings].items())]
+    discharge_files = [data_dir / entry['file'] for _, entry in sorted(manifest['discharge'].items())]
+
+    # read all files once, so both parsers run on the page cache
+    for file in forcing_files + discharge_files:
+        file.read_bytes()
+
+    # the default float64 parser has to return exactly the values of the previous parser
+    for file in forcing_files[:10]:
+        expected, expected_area = _read_forcing_file_reference(file)
+        result, area = read_camels_us_forcing_file(file)
+        pd.testing.assert_frame_equal(result, expected, check_exact=True, check_freq=False)
+        assert area == expected_area
+    for file in discharge_files[:10]:
+        pd.testing.assert_series_equal(read_camels_us_discharge_file(file), _read_discharge_file_reference(file),
+                                       check_exact=True, check_freq=False)
+
+    print(f"{len(forcing_files)} {forcings} forcing files, {len(discharge_files)} discharge files, identical values")
+    print(f"{'files':>10} {'reference [s]':>14} {'new [s]':>8} {'speed-up':>9} {'cached [s]':>11} {'speed-up':>9}")
+    with tempfile.TemporaryDirectory() as cache_dir:
+        for name, files, reference, parser in [('forcing', forcing_files, _read_forcing_file_reference,
+                                                read_camels_us_forcing_file),
+                                               ('discharge', discharge_files, _read_discharge_file_reference,
+                                                read_camels_us_discharge_file)]:
+            t_reference = _time(reference, files)
+            t_new = _time(parser, files)
+            _time(lambda file: parser(file, cache_dir=cache_dir), files)  # fills the cache
+            t_cached = _time(lambda file: parser(file, cache_dir=cache_dir), files)
+            print(f"{name:>10} {t_reference:>14.2f} {t_new:>8.2f} {t_reference / t_new:>9.1f} {t_cached:>11.2f} "
+                  f"{t_reference / t_cached:>9.1f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,51 @@
+"""Benchmark of the fused and table-based Priestley-Taylor PET kernels in `functions.pet` against
+`get_priestley_taylor_pet`.
+
+Run from the repository root with ``python -m benchmarks.pet``.
+"""
+import time
+
+import numpy as np
+import pandas as pd
+
+from functions import pet
+
+
+def _time(fn, n_repeats: int = 50) -> float:
+    # best of `n_repeats`, the kernels run for about a millisecond and the mean is dominated by noise
+    fn()  # warm-up, includes the numba compilation
+    times = []
+    for _ in range(n_repeats):
+        start = time.perf_counter()
+        fn()
+        times.append(time.perf_counter() - start)
+    return min(times)
+
+
+def main():
+    rng = np.random.default_rng(0)
+    dates = pd.date_range('1980-01-01', '2014-12-31')
+    t_max = 15 + 12 * np.sin(2 * np.pi * dates.dayofyear.values / 365.25) + rng.normal(0, 3, len(dates))
+    t_min = t_max - rng.uniform(2, 15, len(dates))
+    s_rad = rng.uniform(50, 350, len(dates))
+    doy = dates.dayofyear.values
+    lat, elev = 45.2, 750.0
+
+    expected = pet.get_priestley_taylor_pet(t_min, t_max, s_rad, lat, elev, doy)
+    kernels = {
+        'reference': pet.get_priestley_taylor_pet,
+        'fused': pet.get_priestley_taylor_pet_fused,
+        'parallel': pet.get_priestley_taylor_pet_parallel,
+        'cached': pet.get_priestley_taylor_pet_cached
+    }
+
+    print(f"{len(dates)} daily time steps (35 years)")
+    print(f"{'kernel':>10} {'time [us]':>10} {'speed-up':>9} {'max abs diff':>13}")
+    times = {name: _time(lambda: kernel(t_min, t_max, s_rad, lat, elev, doy)) for name, kernel in kernels.items()}
+    for name, kernel in kernels.items():
+        max_diff = np.max(np.abs(kernel(t_min, t_max, s_rad, lat, elev, doy) - expected))
+        print(f"{name:>10} {1e6 * times[name]:>10.1f} {times['reference'] / times[name]:>9.1f} {max_diff:>13.2e}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,42 @@
+"""Benchmark of the rolling quantiles in `functions.climateindices` against pandas ``rolling().quantile()``.
+
+Run from the repository root with ``python -m benchmarks.rolling_quantiles``.
+"""
+import time
+
+import numpy as np
+import pandas as pd
+
+from functions.climateindices import calculate_rolling_quantiles
+
+
+def _time(fn, n_repeats: int = 5) -> float:
+    fn()  # warm-up, includes the numba compilation
+    start = time.perf_counter()
+    for _ in range(n_repeats):
+        fn()
+    return (time.perf_counter() - start) / n_repeats
+
+
+def main():
+    rng = np.random.default_rng(0)
+    n_samples = 40 * 365
+    series = pd.Series(rng.gamma(0.5, 6, n_samples) * (rng.random(n_samples) > 0.4),
+                       index=pd.date_range('1980-01-01', periods=n_samples))
+    quantiles = [0.05, 0.5, 0.95]
+
+    print(f"{n_samples} daily time steps, quantiles {quantiles}")
+    print(f"{'window':>8} {'pandas [ms]':>12} {'numba [ms]':>12} {'speed-up':>9} {'max abs diff':>13}")
+    for window_length in [30, 90, 365, 1095]:
+        expected = pd.concat([series.rolling(window_length).quantile(q) for q in quantiles], axis=1)
+        result = calculate_rolling_quantiles(series, window_length, quantiles)
+        max_diff = np.nanmax(np.abs(result.values - expected.values))
+
+        t_pandas = _time(lambda: [series.rolling(window_length).quantile(q) for q in quantiles])
+        t_numba = _time(lambda: calculate_rolling_quantiles(series, window_length, quantiles))
+        print(f"{window_length:>8} {1000 * t_pandas:>12.2f} {1000 * t_numba:>12.2f} {t_pandas / t_numba:>9.1f} "
+              f"{max_diff:>13.2e}")
+
+
+if __name__ == '__main__':
+    main()
@@ -3,7 +3,7 @@ import pickle
 import sys
 import warnings
 from collections import defaultdict
-from typing import List, Dict, Union
+from typing import List, Dict, Set, Tuple, Union
 
 import numpy as np
 import pandas as pd
@@ -230,8 +230,59 @@ class BaseDataset(Dataset):
 
     def _load_additional_features(self):
         for file in self.cfg.additional_feature_files:
-            with open(file, "rb") as fp:
-                self.additional_features.append(pickle.load(fp))
+            if file.is_dir() and utils.is_feature_cube(file):
+                # columnar feature cube, only read the basins, columns and dates that are used in this run
+                used_columns = self._get_used_columns()
+                columns = [c for c in utils.get_feature_cube_columns(file) if c in used_columns]
+                start_date, end_date = self._get_used_date_range(utils.get_feature_cube_dates(file))
+                self.additional_features.append(
+                    utils.load_feature_cube(file,
+                                            basins=self.basins,
+                                            columns=columns,
+                                            start_date=start_date,
+                                            end_date=end_date))
+            elif file.is_dir():
+                # one pickle dump per basin, only read the basins of this run
+                features = utils.load_features_per_basin(file, basins=self.basins)
+                self.additional_features.append({basin: utils.flatten_columns(df) for basin, df in features.items()})
+            else:
+                with open(file, "rb") as fp:
+                    features = pickle.load(fp)
+                self.additional_features.append({basin: utils.flatten_columns(df) for basin, df in features.items()})
+
+    def _get_used_date_range(self, dates: pd.DatetimeIndex) -> Tuple[pd.Timestamp, pd.Timestamp]:
+        # first and last date needed by any period of this run, including the warmup and the largest feature lag
+        try:
+            native_frequency = utils.infer_frequency(dates)
+        except ValueError:
+            return None, None
+        frequencies = self.frequencies if self.frequencies else [native_frequency]
+        offsets = [(self.seq_len[i] - self._predict_last_n[i]) * to_offset(freq) for i, freq in enumerate(frequencies)]
+        periods = [self.dates[basin] for basin in self.basins]
+        start_date = min(date - offset for period in periods for date in period["start_dates"] for offset in offsets)
+        end_date = max(date for period in periods for date in period["end_dates"]) + pd.Timedelta(days=1, seconds=-1)
+
+        shifts = [shift if isinstance(shift, list) else [shift] for shift in self.cfg.lagged_features.values()]
+        max_shift = max([abs(s) for shift in shifts for s in shift], default=0) * to_offset(native_frequency)
+        return start_date - max_shift, end_date + max_shift
+
+    def _get_keep_columns(self) -> List[str]:
+        # list of columns to keep, everything else will be removed to reduce memory footprint
+        keep_cols = self.cfg.target_variables + self.cfg.evolving_attributes + self.cfg.mass_inputs
+
+        if isinstance(self.cfg.dynamic_inputs, list):
+            keep_cols += self.cfg.dynamic_inputs
+        else:
+            # keep all frequencies' dynamic inputs
+            keep_cols += [i for inputs in self.cfg.dynamic_inputs.values() for i in inputs]
+
+        # make sure that even inputs that are used in multiple frequencies occur only once in the df
+        return list(sorted(set(keep_cols)))
+
+    def _get_used_columns(self) -> Set[str]:
+        # columns that are kept or needed to create duplicated or lagged features
+        return set(self._get_keep_columns()) | set(self.cfg.duplicate_features.keys()) | set(
+            self.cfg.lagged_features.keys())
 
     def _duplicate_features(self, df: pd.DataFrame) -> pd.DataFrame:
         for feature, n_duplicates in self.cfg.duplicate_features.items():
@@ -256,18 +307,7 @@ class BaseDataset(Dataset):
         # if no netCDF file is passed, data set is created from raw basin files
         if (self.cfg.train_data_file is None) or (not self.is_train):
             data_list = []
-
-            # list of columns to keep, everything else will be removed to reduce memory footprint
-            keep_cols = self.cfg.target_variables + self.cfg.evolving_attributes + self.cfg.mass_inputs
-
-            if isinstance(self.cfg.dynamic_inputs, list):
-                keep_cols += self.cfg.dynamic_inputs
-            else:
-                # keep all frequencies' dynamic inputs
-                keep_cols += [i for inputs in self.cfg.dynamic_inputs.values() for i in inputs]
-            # make sure that even inputs that are used in multiple frequencies occur only once in the df
-
-            keep_cols = list(sorted(set(keep_cols)))
+            keep_cols = self._get_keep_columns()
 
             if not self._disable_pbar:
                 LOGGER.info("Loading basin data into xarray data set.")
@@ -0,0 +1,425 @@
+import hashlib
+import logging
+import os
+import pickle
+from pathlib import Path
+from typing import Dict, Tuple
+
+import numpy as np
+import pandas as pd
+
+from functions.utils import atomic_write, get_file_fingerprint
+
+LOGGER = logging.getLogger(__name__)
+
+# name of the manifest files in the cache directory, see `get_camels_us_manifest`
+MANIFEST_FILE = 'camels_manifest.p'
+
+# increase whenever the content of the manifest changes, this invalidates all stored manifests
+_MANIFEST_VERSION = 2
+
+# manifests of the CAMELS US root directories used so far, keyed by the resolved root directory
+_MANIFESTS = {}
+
+# integer date columns of the forcing files, all other columns are parsed as floats
+_DATE_COLUMNS = ['Year', 'Mnth', 'Day', 'Hr']
+
+# increase whenever the parsing of the files changes, this invalidates all cached files
+_FILE_CACHE_VERSION = 1
+
+
+def get_camels_us_manifest(data_dir: Path, cache_dir: Path = None, revalidate: bool = False) -> Dict:
+    """Get the manifest of the forcing and discharge files of a CAMELS US directory.
+
+    The manifest maps each basin to its forcing file per forcing product and to its discharge file, together with the
+    catchment area of the forcing file header, the first and last date and the number of rows of each file. It is built
+    once by walking the 'basin_mean_forcing' and 'usgs_streamflow' folders and kept in memory. If `cache_dir` is
+    passed, it is also stored there (as 'camels_manifest_<hash of data_dir>.p', so one cache directory can serve
+    several CAMELS US directories) and reused by later runs. Nothing is written into `data_dir`. All loaders then find
+    the files of a basin with a dictionary lookup instead of a recursive glob over all HUC folders.
+
+    A stored manifest is rebuilt if the modification time of any of the walked folders changed (files were added,
+    removed or renamed), or if the modification time or size of any of its files changed (files were edited in place
+    or extended). This check runs once per process and CAMELS US directory; afterwards the manifest is served from
+    memory, unless `revalidate` is set.
+
+    Parameters
+    ----------
+    data_dir : Path
+        Path to the CAMELS US directory.
+    cache_dir : Path, optional
+        Directory to store the manifest in. If not passed, the manifest is only kept in memory.
+    revalidate : bool, optional
+        If True, check the folders and files again, even if the manifest was already validated in this process.
+
+    Returns
+    -------
+    Dict
+        Dictionary with the keys 'forcings', mapping each forcing product to a dictionary that maps basin ids to file
+        entries, and 'discharge', mapping basin ids to file entries. Each file entry is a dictionary with the keys
+        'file' (path relative to `data_dir`), 'start', 'end' (first and last date), 'n_rows', 'mtime_ns', 'size' (of
+        the file when the entry was built) and, for forcing files, 'area' (catchment area in m2).
+    """
+    data_dir = Path(data_dir).resolve()
+    manifest = _MANIFESTS.get(data_dir)
+    if manifest is not None and (not revalidate or _is_valid_manifest(data_dir, manifest)):
+        return manifest
+
+    manifest_file = _get_manifest_file(data_dir, cache_dir) if cache_dir is not None else None
+    manifest = None
+    if manifest_file is not None and manifest_file.is_file():
+        try:
+            with manifest_file.open('rb') as fp:
+                manifest = pickle.load(fp)
+        except (OSError, EOFError, pickle.UnpicklingError):
+            manifest = None
+        if manifest is not None and (manifest.get('version') != _MANIFEST_VERSION
+                                     or not _is_valid_manifest(data_dir, manifest)):
+            manifest = None
+
+    if manifest is None:
+        manifest = build_camels_us_manifest(data_dir)
+        if manifest_file is not None:
+            try:
+                atomic_write(manifest_file, lambda fp: pickle.dump(manifest, fp))
+            except OSError:
+                LOGGER.warning(f"Cannot store the CAMELS manifest in {cache_dir}, it is only kept in memory.")
+
+    _MANIFESTS[data_dir] = manifest
+    return manifest
+
+
+def build_camels_us_manifest(data_dir: Path) -> Dict:
+    """Build the manifest of the forcing and discharge files of a CAMELS US directory.
+
+    Reads the header, the first and the last line of each file, and counts its rows. Usually, the manifest is built and
+    stored on first use by `get_camels_us_manifest`.
+
+    Parameters
+    ----------
+    data_dir : Path
+        Path to the CAMELS US directory.
+
+    Returns
+    -------
+    Dict
+        The manifest, see `get_camels_us_manifest`.
+    """
+    data_dir = Path(data_dir)
+    manifest = {'version': _MANIFEST_VERSION, 'folders': {}, 'forcings': {}, 'discharge': {}}
+
+    forcing_root = data_dir / 'basin_mean_forcing'
+    if forcing_root.is_dir():
+        manifest['folders']['basin_mean_forcing'] = forcing_root.stat().st_mtime_ns
+        for forcing_path in sorted(p for p in forcing_root.iterdir() if p.is_dir()):
+            files = _walk(data_dir, forcing_path, '_forcing_leap.txt', manifest['folders'])
+            manifest['forcings'][forcing_path.name] = {
+                basin: _read_forcing_file_entry(data_dir, file) for basin, file in files.items()
+            }
+
+    discharge_root = data_dir / 'usgs_streamflow'
+    if discharge_root.is_dir():
+        files = _walk(data_dir, discharge_root, '_streamflow_qc.txt', manifest['folders'])
+        manifest['discharge'] = {basin: _read_discharge_file_entry(data_dir, file) for basin, file in files.items()}
+
+    return manifest
+
+
+def lookup_camels_us_file(data_dir: Path, basin: str, forcings: str = None, cache_dir: Path = None) -> Dict:
+    """Look up the manifest entry of the forcing or discharge file of a basin.
+
+    If the basin or the forcing product is not in the manifest, the manifest is revalidated once, so files added while
+    the process runs are found.
+
+    Parameters
+    ----------
+    data_dir : Path
+        Path to the CAMELS US directory.
+    basin : str
+        8-digit USGS identifier of the basin.
+    forcings : str, optional
+        Forcing product (e.g. 'daymet' or 'nldas'). If not passed, the entry of the discharge file is returned.
+    cache_dir : Path, optional
+        Directory to store the manifest in, see `get_camels_us_manifest`.
+
+    Returns
+    -------
+    Dict
+        Manifest entry with the absolute path of the file, see `get_camels_us_manifest`.
+
+    Raises
+    ------
+    OSError
+        If the folder of the forcing product does not exist.
+    FileNotFoundError
+        If there is no file for the basin.
+    """
+    manifest = get_camels_us_manifest(data_dir, cache_dir=cache_dir)
+    if basin not in _get_manifest_files(manifest, forcings):
+        manifest = get_camels_us_manifest(data_dir, cache_dir=cache_dir, revalidate=True)
+
+    if forcings is not None:
+        if forcings not in manifest['forcings']:
+            raise OSError(f"{Path(data_dir) / 'basin_mean_forcing' / forcings} does not exist")
+        files, folder = manifest['forcings'][forcings], Path(data_dir) / 'basin_mean_forcing' / forcings
+    else:
+        files, folder = manifest['discharge'], Path(data_dir) / 'usgs_streamflow'
+
+    if basin not in files:
+        raise FileNotFoundError(f'No file for Basin {basin} at {folder}')
+    return {**files[basin], 'file': Path(data_dir) / files[basin]['file']}
+
+
+def read_camels_us_forcing_file(file_path: Path,
+                                dtype: np.dtype = np.float64,
+                                cache_dir: Path = None) -> Tuple[pd.DataFrame, int]:
+    """Read a CAMELS US forcing file.
+
+    The columns are parsed by the C parser of pandas with fixed dtypes, and the dates are built from the integer year,
+    month and day columns instead of formatting and parsing date strings.
+
+    If `cache_dir` is passed, the parsed file is stored in binary form in this directory ('<cache_dir>/<file
+    name>_<hash of the resolved file path>.cache', so files of the same name in other forcing products or CAMELS US
+    directories do not share an entry) and reused as long as the modification time and the size of the file are
+    unchanged. The cache files are written atomically, so the directory can be shared by concurrent runs.
+
+    Parameters
+    ----------
+    file_path : Path
+        Path to the forcing file.
+    dtype : np.dtype, optional
+        Data type of the forcing variables. Default: float64, which gives the same values as parsing the file with
+        `pd.read_csv`. Use float32 only where the inputs are stored as float32 anyway (e.g. the CAMELS US cube), as
+        rounding the inputs changes threshold comparisons of the climate indices.
+    cache_dir : Path, optional
+        Directory to cache the parsed file in.
+
+    Returns
+    -------
+    pd.DataFrame
+        Time-indexed DataFrame, containing the forcing data.
+    int
+        Catchment area (m2), specified in the header of the forcing file.
+    """
+    df, header = _read_file(file_path, dtype, cache_dir, _parse_forcing_file)
+    df.index = get_dates(df['Year'].values, df['Mnth'].values, df['Day'].values)
+    df.index.name = 'date'
+    return df, header['area']
+
+
+def read_camels_us_discharge_file(file_path: Path, dtype: np.dtype = np.float64, cache_dir: Path = None) -> pd.Series:
+    """Read a CAMELS US discharge file.
+
+    Parameters
+    ----------
+    file_path : Path
+        Path to the discharge file.
+    dtype : np.dtype, optional
+        Data type of the discharge. Default: float64, see `read_camels_us_forcing_file`.
+    cache_dir : Path, optional
+        Directory to cache the parsed file in, see `read_camels_us_forcing_file`.
+
+    Returns
+    -------
+    pd.Series
+        Time-indexed series of the discharge in cubic feet per second, as stored in the file (missing values are
+        negative).
+    """
+    df, _ = _read_file(file_path, dtype, cache_dir, _parse_discharge_file)
+    return pd.Series(df['QObs'].values,
+                     index=get_dates(df['Year'].values, df['Mnth'].values, df['Day'].values).rename('date'),
+                     name='QObs')
+
+
+def get_dates(year: np.ndarray, month: np.ndarray, day: np.ndarray) -> pd.DatetimeIndex:
+    """Build a DatetimeIndex from integer year, month and day arrays.
+
+    Parameters
+    ----------
+    year : np.ndarray
+        Years.
+    month : np.ndarray
+        Months (1 to 12).
+    day : np.ndarray
+        Days of the month (1 to 31).
+
+    Returns
+    -------
+    pd.DatetimeIndex
+        Daily DatetimeIndex.
+
+    Raises
+    ------
+    ValueError
+        If any of the dates does not exist.
+    """
+    months = ((year - 1970) * 12 + month - 1).astype('datetime64[M]')
+    dates = pd.DatetimeIndex(months.astype('datetime64[D]') + (day - 1).astype('timedelta64[D]'))
+    # days beyond the end of a month would silently roll over into the next month
+    invalid = (dates.month != month) | (month < 1) | (month > 12) | (day < 1)
+    if invalid.any():
+        i = np.argmax(invalid)
+        raise ValueError(f"Invalid date {year[i]}-{month[i]}-{day[i]}")
+    return dates
+
+
+def _parse_forcing_file(file_path: Path, dtype: np.dtype) -> Tuple[pd.DataFrame, Dict]:
+    with open(file_path, 'r') as fp:
+        # load area from header
+        fp.readline()
+        fp.readline()
+        area = int(fp.readline())
+        columns = fp.readline().split()
+        # load the dataframe from the rest of the stream
+        df = pd.read_csv(fp,
+                         sep=r'\s+',
+                         header=None,
+                         names=columns,
+                         dtype={col: np.int64 if col in _DATE_COLUMNS else dtype for col in columns})
+    return df, {'area': area}
+
+
+def _parse_discharge_file(file_path: Path, dtype: np.dtype) -> Tuple[pd.DataFrame, Dict]:
+    col_names = ['basin', 'Year', 'Mnth', 'Day', 'QObs', 'flag']
+    df = pd.read_csv(file_path,
+                     sep=r'\s+',
+                     header=None,
+                     names=col_names,
+                     usecols=['Year', 'Mnth', 'Day', 'QObs'],
+                     dtype={'Year': np.int64, 'Mnth': np.int64, 'Day': np.int64, 'QObs': dtype})
+    return df, {}
+
+
+def _read_file(file_path: Path, dtype: np.dtype, cache_dir: Path, parse) -> Tuple[pd.DataFrame, Dict]:
+    # parse the file, or load it from the cache if it did not change since it was cached
+    if cache_dir is None:
+        return parse(file_path, dtype)
+
+    key = (_FILE_CACHE_VERSION, get_file_fingerprint(file_path), np.dtype(dtype).str)
+    cache_file = Path(cache_dir) / f"{Path(file_path).name}_{_hash_path(key[1][0])}.cache"
+    if cache_file.is_file():
+        with cache_file.open('rb') as fp:
+            # pickled header, followed by the integer and the float columns as .npy arrays
+            header = pickle.load(fp)
+            if header['key'] == key:
+                int_values, float_values = np.load(fp), np.load(fp)
+                data = {**dict(zip(header['int_columns'], int_values.T)),
+                        **dict(zip(header['float_columns'], float_values.T))}
+                return pd.DataFrame({col: data[col] for col in header['columns']}), header['header']
+
+    df, file_header = parse(file_path, dtype)
+    int_columns = [col for col in df.columns if df[col].dtype == np.int64]
+    float_columns = [col for col in df.columns if col not in int_columns]
+
+    def write(fp):
+        pickle.dump({'key': key,
+                     'columns': list(df.columns),
+                     'int_columns': int_columns,
+                     'float_columns': float_columns,
+                     'header': file_header}, fp)
+        np.save(fp, df[int_columns].values)
+        np.save(fp, df[float_columns].values)
+
+    try:
+        atomic_write(cache_file, write)
+    except OSError:
+        LOGGER.warning(f"Cannot cache {Path(file_path).name} in {cache_dir}.")
+    return df, file_header
+
+
+def _get_manifest_file(data_dir: Path, cache_dir: Path) -> Path:
+    # one cache directory can be shared by several CAMELS US directories
+    return Path(cache_dir) / f"{Path(MANIFEST_FILE).stem}_{_hash_path(data_dir)}.p"
+
+
+def _hash_path(path: Path) -> str:
+    # short, stable name component for a resolved path
+    return hashlib.md5(str(path).encode()).hexdigest()[:16]
+
+
+def _get_manifest_files(manifest: Dict, forcings: str) -> Dict:
+    if forcings is None:
+        return manifest['discharge']
+    return manifest['forcings'].get(forcings, {})
+
+
+def _is_valid_manifest(data_dir: Path, manifest: Dict) -> bool:
+    for folder, mtime in manifest['folders'].items():
+        try:
+            if (data_dir / folder).stat().st_mtime_ns != mtime:
+                return False
+        except OSError:
+            return False
+    # a forcing or discharge root that was created after the manifest was built
+    roots = [root for root in ['basin_mean_forcing', 'usgs_streamflow'] if (data_dir / root).is_dir()]
+    if not all(root in manifest['folders'] for root in roots):
+        return False
+    # files that were edited in place or extended, this does not change the modification time of their folder
+    entries = [entry for files in manifest['forcings'].values() for entry in files.values()]
+    for entry in entries + list(manifest['discharge'].values()):
+        try:
+            stat = (data_dir / entry['file']).stat()
+        except OSError:
+            return False
+        if stat.st_mtime_ns != entry['mtime_ns'] or stat.st_size != entry['size']:
+            return False
+    return True
+
+
+def _walk(data_dir: Path, root: Path, suffix: str, folders: Dict[str, int]) -> Dict[str, Path]:
+    # maps basin ids to the files below root that end with suffix, records the modification time of all folders
+    files = {}
+    for dir_path, dir_names, file_names in os.walk(root):
+        dir_names.sort()
+        folders[str(Path(dir_path).relative_to(data_dir))] = os.stat(dir_path).st_mtime_ns
+        for file_name in sorted(file_names):
+            if file_name.endswith(suffix):
+                # keep the first file of a basin, as the glob of the loaders did
+                files.setdefault(file_name.split('_')[0], Path(dir_path) / file_name)
+    return files
+
+
+def _read_forcing_file_entry(data_dir: Path, file: Path) -> Dict:
+    stat = file.stat()
+    with file.open('rb') as fp:
+        # latitude, elevation and area, followed by the column names
+        header = [fp.readline() for _ in range(4)]
+        first = fp.readline()
+        n_rows, last = _count_rows(fp, first)
+    return {
+        'file': str(file.relative_to(data_dir)),
+        'area': int(header[2]),
+        'start': _get_date(first.split()[:3]),
+        'end': _get_date(last.split()[:3]),
+        'n_rows': n_rows,
+        'mtime_ns': stat.st_mtime_ns,
+        'size': stat.st_size
+    }
+
+
+def _read_discharge_file_entry(data_dir: Path, file: Path) -> Dict:
+    stat = file.stat()
+    with file.open('rb') as fp:
+        first = fp.readline()
+        n_rows, last = _count_rows(fp, first)
+    return {
+        'file': str(file.relative_to(data_dir)),
+        'start': _get_date(first.split()[1:4]),
+        'end': _get_date(last.split()[1:4]),
+        'n_rows': n_rows,
+        'mtime_ns': stat.st_mtime_ns,
+        'size': stat.st_size
+    }
+
+
+def _count_rows(fp, first: bytes) -> Tuple[int, bytes]:
+    # number of rows starting with `first` and the last row, trailing empty lines are ignored
+    rest = fp.read().rstrip()
+    if not rest:
+        return 1, first
+    return rest.count(b'\n') + 2, rest.rsplit(b'\n', 1)[-1]
+
+
+def _get_date(fields: list) -> pd.Timestamp:
+    year, month, day = (int(f) for f in fields)
+    return pd.Timestamp(year=year, month=month, day=day)
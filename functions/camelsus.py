@@ -1,12 +1,32 @@
+import argparse
+import pickle
+import sys
 from pathlib import Path
 from typing import Dict, List, Tuple, Union
 
 import numpy as np
 import pandas as pd
 import xarray
+from tqdm import tqdm
 
+from functions import pet
 from functions.basedataset import BaseDataset
+from functions.camelsfiles import (get_camels_us_manifest, lookup_camels_us_file, read_camels_us_discharge_file,
+                                   read_camels_us_forcing_file)
 from functions.config import Config
+from functions.utils import atomic_write, get_file_fingerprint, load_basin_file
+
+# name of the derived Priestley-Taylor PET column, see `load_camels_us_pet`
+PET_COLUMN = 'PET(mm/d)'
+
+# increase whenever a change of the PET computation changes its results, this invalidates all cached PET series
+_PET_CACHE_VERSION = 3
+
+# name of the index file of a CAMELS US cube, see `convert_camels_us_to_cube`
+CUBE_INDEX_FILE = 'index.p'
+
+# increase whenever the layout of the CAMELS US cube changes, older cubes have to be converted again
+_CUBE_VERSION = 1
 
 
 class CamelsUS(BaseDataset):
@@ -36,6 +56,16 @@ class CamelsUS(BaseDataset):
     scaler : Dict[str, Union[pd.Series, xarray.DataArray]], optional
         If period is either 'validation' or 'test', this input is required. It contains the centering and scaling
         for each feature and is stored to the run directory during training (train_data/train_data_scaler.yml).
+
+    Notes
+    -----
+    Besides the raw forcing columns, the Priestley-Taylor PET ('PET(mm/d)', or 'PET(mm/d)_<forcing>' for multiple
+    forcings) can be used as a derived column, e.g. in 'dynamic_inputs'. It is only computed if it is used, from the
+    latitude and elevation of the attribute table. If the config argument 'derived_features_dir' is set, the PET of
+    each basin and forcing is cached in this directory and reused by all runs, see `load_camels_us_pet`. Likewise, if
+    the config argument 'data_cache_dir' is set, the parsed forcing and discharge files are cached in binary form in
+    this directory, see `functions.camelsfiles.read_camels_us_forcing_file`, and the manifest of the CAMELS US files is
+    stored there. Nothing is written into the (possibly read-only) 'data_dir'.
         
     References
     ----------
@@ -57,6 +87,8 @@ class CamelsUS(BaseDataset):
                  additional_features: List[Dict[str, pd.DataFrame]] = [],
                  id_to_int: Dict[str, int] = {},
                  scaler: Dict[str, Union[pd.Series, xarray.DataArray]] = {}):
+        # latitude and elevation of the basins, only loaded if a derived column is used
+        self._basin_locations = None
         super(CamelsUS, self).__init__(cfg=cfg,
                                        is_train=is_train,
                                        period=period,
@@ -69,8 +101,13 @@ class CamelsUS(BaseDataset):
         """Load input and output data from text files."""
         # get forcings
         dfs = []
+        used_columns = self._get_used_columns()
         for forcing in self.cfg.forcings:
-            df, area = load_camels_us_forcings(self.cfg.data_dir, basin, forcing)
+            df, area = load_camels_us_forcings(self.cfg.data_dir, basin, forcing, cache_dir=self.cfg.data_cache_dir)
+
+            # add derived columns
+            if (PET_COLUMN if len(self.cfg.forcings) == 1 else f"{PET_COLUMN}_{forcing}") in used_columns:
+                df[PET_COLUMN] = self._load_pet(basin, forcing, df)
 
             # rename columns
             if len(self.cfg.forcings) > 1:
@@ -79,7 +116,7 @@ class CamelsUS(BaseDataset):
         df = pd.concat(dfs, axis=1)
 
         # add discharge
-        df['QObs(mm/d)'] = load_camels_us_discharge(self.cfg.data_dir, basin, area)
+        df['QObs(mm/d)'] = load_camels_us_discharge(self.cfg.data_dir, basin, area, cache_dir=self.cfg.data_cache_dir)
 
         # replace invalid discharge values by NaNs
         qobs_cols = [col for col in df.columns if "qobs" in col.lower()]
@@ -91,6 +128,118 @@ class CamelsUS(BaseDataset):
     def _load_attributes(self) -> pd.DataFrame:
         return load_camels_us_attributes(self.cfg.data_dir, basins=self.basins)
 
+    def _load_pet(self, basin: str, forcing: str, df: pd.DataFrame) -> pd.Series:
+        if self._basin_locations is None:
+            attributes = load_camels_us_attributes(self.cfg.data_dir, basins=self.basins)
+            self._basin_locations = attributes[['gauge_lat', 'elev_mean']]
+        lat, elev = self._basin_locations.loc[basin]
+        return load_camels_us_pet(self.cfg.data_dir,
+                                  basin,
+                                  forcing,
+                                  lat=lat,
+                                  elev=elev,
+                                  cache_dir=self.cfg.derived_features_dir,
+                                  forcing_data=df,
+                                  data_cache_dir=self.cfg.data_cache_dir)
+
+
+class CamelsUSCube(BaseDataset):
+    """Data set class for the CAMELS US data set, read from a consolidated cube instead of the text files.
+
+    The config argument 'data_dir' has to point to a cube directory created by `convert_camels_us_to_cube`, containing
+    all basins and forcings of the run. The basin data and attributes are slices of the memory-mapped arrays of the
+    cube, so loading a basin is one contiguous read per forcing and the page cache is shared by all runs on a machine.
+    The columns are the same as those of `CamelsUS`, including 'PET(mm/d)' if it was computed during the conversion.
+
+    Parameters
+    ----------
+    cfg : Config
+        The run configuration.
+    is_train : bool
+        Defines if the dataset is used for training or evaluating. If True (training), means/stds for each feature
+        are computed and stored to the run directory. If one-hot encoding is used, the mapping for the one-hot encoding
+        is created and also stored to disk. If False, a `scaler` input is expected and similarly the `id_to_int` input
+        if one-hot encoding is used.
+    period : {'train', 'validation', 'test'}
+        Defines the period for which the data will be loaded
+    basin : str, optional
+        If passed, the data for only this basin will be loaded. Otherwise the basin(s) are read from the appropriate
+        basin file, corresponding to the `period`.
+    additional_features : List[Dict[str, pd.DataFrame]], optional
+        List of dictionaries, mapping from a basin id to a pandas DataFrame. This DataFrame will be added to the data
+        loaded from the dataset and all columns are available as 'dynamic_inputs', 'evolving_attributes' and
+        'target_variables'
+    id_to_int : Dict[str, int], optional
+        If the config argument 'use_basin_id_encoding' is True in the config and period is either 'validation' or
+        'test', this input is required. It is a dictionary, mapping from basin id to an integer (the one-hot encoding).
+    scaler : Dict[str, Union[pd.Series, xarray.DataArray]], optional
+        If period is either 'validation' or 'test', this input is required. It contains the centering and scaling
+        for each feature and is stored to the run directory during training (train_data/train_data_scaler.yml).
+    """
+
+    def __init__(self,
+                 cfg: Config,
+                 is_train: bool,
+                 period: str,
+                 basin: str = None,
+                 additional_features: List[Dict[str, pd.DataFrame]] = [],
+                 id_to_int: Dict[str, int] = {},
+                 scaler: Dict[str, Union[pd.Series, xarray.DataArray]] = {}):
+        self._cube_index = load_camels_us_cube_index(cfg.data_dir)
+        self._cube_basins = {basin: i for i, basin in enumerate(self._cube_index['basins'])}
+        # memory-mapped arrays of the cube, opened on first use
+        self._cube_arrays = {}
+        super(CamelsUSCube, self).__init__(cfg=cfg,
+                                           is_train=is_train,
+                                           period=period,
+                                           basin=basin,
+                                           additional_features=additional_features,
+                                           id_to_int=id_to_int,
+                                           scaler=scaler)
+
+    def _load_basin_data(self, basin: str) -> pd.DataFrame:
+        """Load input and output data from the cube."""
+        if basin not in self._cube_basins:
+            raise ValueError(f"Basin {basin} is not part of the cube at {self.cfg.data_dir}")
+        i = self._cube_basins[basin]
+
+        # get forcings
+        dfs = []
+        for forcing in self.cfg.forcings:
+            if forcing not in self._cube_index['forcings']:
+                raise ValueError(f"Forcing {forcing} is not part of the cube at {self.cfg.data_dir}")
+            df = pd.DataFrame(self._get_cube_array(f"forcings_{forcing}")[i],
+                              index=self._cube_index['dates'],
+                              columns=self._cube_index['forcings'][forcing])
+
+            # rename columns
+            if len(self.cfg.forcings) > 1:
+                df = df.rename(columns={col: f"{col}_{forcing}" for col in df.columns})
+            dfs.append(df)
+        df = pd.concat(dfs, axis=1)
+
+        # add discharge, normalized with the area of the last forcing file as in `CamelsUS`
+        area = self._cube_index['areas'][self.cfg.forcings[-1]][i]
+        df['QObs(mm/d)'] = _normalize_discharge(pd.Series(self._get_cube_array('discharge')[i], index=df.index), area)
+
+        # replace invalid discharge values by NaNs
+        qobs_cols = [col for col in df.columns if "qobs" in col.lower()]
+        for col in qobs_cols:
+            df.loc[df[col] < 0, col] = np.nan
+
+        return df
+
+    def _load_attributes(self) -> pd.DataFrame:
+        df = pd.read_pickle(self.cfg.data_dir / 'attributes.p')
+        if any(b not in df.index for b in self.basins):
+            raise ValueError('Some basins are missing static attributes.')
+        return df.loc[self.basins]
+
+    def _get_cube_array(self, name: str) -> np.ndarray:
+        if name not in self._cube_arrays:
+            self._cube_arrays[name] = np.load(self.cfg.data_dir / f"{name}.npy", mmap_mode='r')
+        return self._cube_arrays[name]
+
 
 def load_camels_us_attributes(data_dir: Path, basins: List[str] = []) -> pd.DataFrame:
     """Load CAMELS US attributes from the dataset provided by [#]_
@@ -143,7 +292,10 @@ def load_camels_us_attributes(data_dir: Path, basins: List[str] = []) -> pd.Data
     return df
 
 
-def load_camels_us_forcings(data_dir: Path, basin: str, forcings: str) -> Tuple[pd.DataFrame, int]:
+def load_camels_us_forcings(data_dir: Path,
+                            basin: str,
+                            forcings: str,
+                            cache_dir: Path = None) -> Tuple[pd.DataFrame, int]:
     """Load the forcing data for a basin of the CAMELS US data set.
 
     Parameters
@@ -157,6 +309,9 @@ def load_camels_us_forcings(data_dir: Path, basin: str, forcings: str) -> Tuple[
         8-digit USGS identifier of the basin.
     forcings : str
         Can be e.g. 'daymet' or 'nldas', etc. Must match the folder names in the 'basin_mean_forcing' directory. 
+    cache_dir : Path, optional
+        Directory to cache the parsed forcing file and the file manifest in, see
+        `functions.camelsfiles.read_camels_us_forcing_file` and `functions.camelsfiles.get_camels_us_manifest`.
 
     Returns
     -------
@@ -165,31 +320,177 @@ def load_camels_us_forcings(data_dir: Path, basin: str, forcings: str) -> Tuple[
     int
         Catchment area (m2), specified in the header of the forcing file.
     """
-    forcing_path = data_dir / 'basin_mean_forcing' / forcings
-    if not forcing_path.is_dir():
-        raise OSError(f"{forcing_path} does not exist")
-
-    file_path = list(forcing_path.glob(f'**/{basin}_*_forcing_leap.txt'))
-    if file_path:
-        file_path = file_path[0]
-    else:
-        raise FileNotFoundError(f'No file for Basin {basin} at {file_path}')
-
-    with open(file_path, 'r') as fp:
-        # load area from header
-        fp.readline()
-        fp.readline()
-        area = int(fp.readline())
-        # load the dataframe from the rest of the stream
-        df = pd.read_csv(fp, sep='\s+')
-        df["date"] = pd.to_datetime(df.Year.map(str) + "/" + df.Mnth.map(str) + "/" + df.Day.map(str),
-                                    format="%Y/%m/%d")
-        df = df.set_index("date")
-
-    return df, area
-
-
-def load_camels_us_discharge(data_dir: Path, basin: str, area: int) -> pd.Series:
+    file_path = lookup_camels_us_file(data_dir, basin, forcings, cache_dir=cache_dir)['file']
+    return read_camels_us_forcing_file(file_path, cache_dir=cache_dir)
+
+
+def get_camels_us_forcing_file(data_dir: Path, basin: str, forcings: str, cache_dir: Path = None) -> Path:
+    """Get the path to the forcing file of a basin of the CAMELS US data set.
+
+    Parameters
+    ----------
+    data_dir : Path
+        Path to the CAMELS US directory. This folder must contain a 'basin_mean_forcing' folder containing one 
+        subdirectory for each forcing.
+    basin : str
+        8-digit USGS identifier of the basin.
+    forcings : str
+        Can be e.g. 'daymet' or 'nldas', etc. Must match the folder names in the 'basin_mean_forcing' directory. 
+    cache_dir : Path, optional
+        Directory to cache the file manifest in, see `functions.camelsfiles.get_camels_us_manifest`.
+
+    Returns
+    -------
+    Path
+        Path to the forcing file, looked up in the manifest of `functions.camelsfiles.get_camels_us_manifest`.
+    """
+    return lookup_camels_us_file(data_dir, basin, forcings, cache_dir=cache_dir)['file']
+
+
+def get_camels_us_area(data_dir: Path, basin: str, forcings: str, cache_dir: Path = None) -> int:
+    """Get the catchment area of a basin from the header of its forcing file, without reading the forcing data.
+
+    Parameters
+    ----------
+    data_dir : Path
+        Path to the CAMELS US directory.
+    basin : str
+        8-digit USGS identifier of the basin.
+    forcings : str
+        Can be e.g. 'daymet' or 'nldas', etc. Must match the folder names in the 'basin_mean_forcing' directory.
+    cache_dir : Path, optional
+        Directory to cache the file manifest in, see `functions.camelsfiles.get_camels_us_manifest`.
+
+    Returns
+    -------
+    int
+        Catchment area (m2), as specified in the header of the forcing file.
+    """
+    return lookup_camels_us_file(data_dir, basin, forcings, cache_dir=cache_dir)['area']
+
+
+def get_camels_us_variable_names(forcings: str, variable_names: Dict[str, str] = None) -> Dict[str, str]:
+    """Get the names of the precipitation, temperature and radiation columns of a CAMELS US forcing product.
+
+    Parameters
+    ----------
+    forcings : str
+        Can be e.g. 'daymet' or 'nldas', etc.
+    variable_names : Dict[str, str], optional
+        If passed, this mapping is returned as is.
+
+    Returns
+    -------
+    Dict[str, str]
+        Dictionary that maps the keys 'prcp', 'tmin', 'tmax', 'srad' to the forcings' respective column names.
+
+    Raises
+    ------
+    ValueError
+        If no `variable_names` are passed and there is no predefined mapping for the forcings.
+    """
+    if variable_names is not None:
+        return variable_names
+    if forcings.startswith('nldas'):
+        return {'prcp': 'PRCP(mm/day)', 'tmin': 'Tmin(C)', 'tmax': 'Tmax(C)', 'srad': 'SRAD(W/m2)'}
+    elif forcings.startswith('daymet') or forcings.startswith('maurer'):
+        return {'prcp': 'prcp(mm/day)', 'tmin': 'tmin(C)', 'tmax': 'tmax(C)', 'srad': 'srad(W/m2)'}
+    raise ValueError(f'No predefined variable mapping for {forcings} forcings. Provide one in variable_names.')
+
+
+def calculate_camels_us_pet(df: pd.DataFrame, lat: float, elev: float, variable_names: Dict[str, str]) -> pd.Series:
+    """Calculate the Priestley-Taylor PET of a basin from its forcing data.
+
+    Parameters
+    ----------
+    df : pd.DataFrame
+        Time-indexed DataFrame of the forcing data, as returned by `load_camels_us_forcings`.
+    lat : float
+        Latitude of the basin in degree.
+    elev : float
+        Elevation of the basin in m.
+    variable_names : Dict[str, str]
+        Mapping of the forcings' variable names, see `get_camels_us_variable_names`.
+
+    Returns
+    -------
+    pd.Series
+        Time-indexed series of the PET (mm/day).
+    """
+    values = pet.get_priestley_taylor_pet_cached(t_min=df[variable_names['tmin']].values,
+                                                 t_max=df[variable_names['tmax']].values,
+                                                 s_rad=df[variable_names['srad']].values,
+                                                 lat=lat,
+                                                 elev=elev,
+                                                 doy=df.index.dayofyear.values)
+    return pd.Series(values, index=df.index, name=PET_COLUMN)
+
+
+def load_camels_us_pet(data_dir: Path,
+                       basin: str,
+                       forcings: str,
+                       lat: float,
+                       elev: float,
+                       variable_names: Dict[str, str] = None,
+                       cache_dir: Path = None,
+                       forcing_data: pd.DataFrame = None,
+                       data_cache_dir: Path = None) -> pd.Series:
+    """Load the Priestley-Taylor PET of a basin of the CAMELS US data set, derived from the forcing data.
+
+    If `cache_dir` is passed, the PET of each basin and forcing product is stored in this directory ('<cache_dir>/
+    <forcings>/<basin>.p') and reused as long as the forcing file (modification time and size), the location and the
+    variable names are unchanged. The directory can be shared by all runs.
+
+    Parameters
+    ----------
+    data_dir : Path
+        Path to the CAMELS US directory, see `load_camels_us_forcings`.
+    basin : str
+        8-digit USGS identifier of the basin.
+    forcings : str
+        Can be e.g. 'daymet' or 'nldas', etc. Must match the folder names in the 'basin_mean_forcing' directory.
+    lat : float
+        Latitude of the basin in degree (e.g. 'gauge_lat' of the CAMELS attributes).
+    elev : float
+        Elevation of the basin in m (e.g. 'elev_mean' of the CAMELS attributes).
+    variable_names : Dict[str, str], optional
+        Mapping of the forcings' variable names, needed if forcings other than DayMet, Maurer, or NLDAS are used, see
+        `get_camels_us_variable_names`.
+    cache_dir : Path, optional
+        Directory to cache the PET in.
+    forcing_data : pd.DataFrame, optional
+        The forcing data of the basin, if already loaded. Otherwise, the forcing file is read if the PET is not cached.
+    data_cache_dir : Path, optional
+        Directory to cache the parsed forcing file and the file manifest in, see `load_camels_us_forcings`.
+
+    Returns
+    -------
+    pd.Series
+        Time-indexed series of the PET (mm/day).
+    """
+    variable_names = get_camels_us_variable_names(forcings, variable_names)
+    if cache_dir is not None:
+        forcing_file = get_camels_us_forcing_file(data_dir, basin, forcings, cache_dir=data_cache_dir)
+        key = (_PET_CACHE_VERSION, get_file_fingerprint(forcing_file), float(lat), float(elev),
+               sorted(variable_names.items()))
+        cache_file = cache_dir / forcings / f"{basin}.p"
+        if cache_file.is_file():
+            with cache_file.open("rb") as fp:
+                cached = pickle.load(fp)
+            if cached['key'] == key:
+                return cached['pet']
+
+    if forcing_data is None:
+        forcing_data, _ = load_camels_us_forcings(data_dir, basin, forcings, cache_dir=data_cache_dir)
+    pet_values = calculate_camels_us_pet(forcing_data, lat, elev, variable_names)
+
+    if cache_dir is not None:
+        atomic_write(cache_file, lambda fp: pickle.dump({'key': key, 'pet': pet_values}, fp))
+
+    return pet_values
+
+
+def load_camels_us_discharge(data_dir: Path, basin: str, area: int, cache_dir: Path = None) -> pd.Series:
     """Load the discharge data for a basin of the CAMELS US data set.
 
     Parameters
@@ -202,26 +503,192 @@ def load_camels_us_discharge(data_dir: Path, basin: str, area: int) -> pd.Series
         8-digit USGS identifier of the basin.
     area : int
         Catchment area (m2), used to normalize the discharge.
+    cache_dir : Path, optional
+        Directory to cache the parsed discharge file and the file manifest in, see
+        `functions.camelsfiles.read_camels_us_forcing_file` and `functions.camelsfiles.get_camels_us_manifest`.
 
     Returns
     -------
     pd.Series
         Time-index pandas.Series of the discharge values (mm/day)
     """
+    file_path = lookup_camels_us_file(data_dir, basin, cache_dir=cache_dir)['file']
+    discharge = read_camels_us_discharge_file(file_path, cache_dir=cache_dir)
+    return _normalize_discharge(discharge, area)
 
-    discharge_path = data_dir / 'usgs_streamflow'
-    file_path = list(discharge_path.glob(f'**/{basin}_streamflow_qc.txt'))
-    if file_path:
-        file_path = file_path[0]
-    else:
-        raise FileNotFoundError(f'No file for Basin {basin} at {file_path}')
-
-    col_names = ['basin', 'Year', 'Mnth', 'Day', 'QObs', 'flag']
-    df = pd.read_csv(file_path, sep='\s+', header=None, names=col_names)
-    df["date"] = pd.to_datetime(df.Year.map(str) + "/" + df.Mnth.map(str) + "/" + df.Day.map(str), format="%Y/%m/%d")
-    df = df.set_index("date")
 
+def _normalize_discharge(discharge: pd.Series, area: int) -> pd.Series:
     # normalize discharge from cubic feet per second to mm per day
-    df.QObs = 28316846.592 * df.QObs * 86400 / (area * 10**6)
+    return 28316846.592 * discharge * 86400 / (area * 10**6)
+
+
+def convert_camels_us_to_cube(data_dir: Path,
+                              cube_dir: Path,
+                              forcings: List[str],
+                              basins: List[str] = None,
+                              cache_dir: Path = None):
+    """Convert the CAMELS US text files into one consolidated, memory-mappable cube, to be read by `CamelsUSCube`.
+
+    The cube directory contains one float32 array 'forcings_<forcing>.npy' of shape (#basins, #dates, #variables) per
+    forcing product and a float32 array 'discharge.npy' of shape (#basins, #dates) with the discharge in cubic feet per
+    second, such that the data of one basin is a contiguous block on disk. Basins with a shorter record are padded with
+    NaNs. The attribute table is stored as 'attributes.p' and the basin ids, dates, variable names and catchment areas
+    (of the forcing file headers, to normalize the discharge) as 'index.p'. If the latitude and elevation are
+    available, the Priestley-Taylor PET ('PET(mm/d)') is stored as additional variable of each forcing product (see
+    `calculate_camels_us_pet`).
+
+    The index is written last, so an interrupted conversion leaves no readable cube. Existing cubes in `cube_dir` are
+    overwritten, which must not happen while other runs read them.
+
+    Parameters
+    ----------
+    data_dir : Path
+        Path to the CAMELS US directory, see `load_camels_us_forcings`, `load_camels_us_discharge` and
+        `load_camels_us_attributes`.
+    cube_dir : Path
+        Directory to store the cube in. Will be created if it does not exist.
+    forcings : List[str]
+        Forcing products to convert, e.g. ['daymet', 'nldas']. Must match the folder names in the 'basin_mean_forcing'
+        directory.
+    basins : List[str], optional
+        Basins to convert. If not passed, all basins with a discharge file and a forcing file of each forcing product
+        are converted.
+    cache_dir : Path, optional
+        Directory to cache the parsed text files and the file manifest in, see
+        `functions.camelsfiles.read_camels_us_forcing_file` and `functions.camelsfiles.get_camels_us_manifest`.
+
+    Raises
+    ------
+    OSError
+        If the folder of a forcing product does not exist.
+    ValueError
+        If the forcing files of a forcing product do not all have the same columns, or if the dates of a parsed file
+        differ from the first and last date of its manifest entry, i.e. the file changed during the conversion.
+    """
+    data_dir, cube_dir = Path(data_dir), Path(cube_dir)
+    # the date range of the cube is taken from the manifest, so it is checked against the files once more
+    manifest = get_camels_us_manifest(data_dir, cache_dir=cache_dir, revalidate=True)
+    for forcing in forcings:
+        if forcing not in manifest['forcings']:
+            raise OSError(f"{data_dir / 'basin_mean_forcing' / forcing} does not exist")
+    if basins is None:
+        basins = sorted(set(manifest['discharge']).intersection(*[manifest['forcings'][f] for f in forcings]))
+
+    # one daily date range that covers the records of all files. The arrays are allocated before the files are parsed,
+    # so each parsed file is checked against its manifest entry, instead of silently dropping dates outside the range.
+    entries = {(basin, None): lookup_camels_us_file(data_dir, basin, cache_dir=cache_dir) for basin in basins}
+    entries.update({(basin, forcing): lookup_camels_us_file(data_dir, basin, forcing, cache_dir=cache_dir)
+                    for forcing in forcings for basin in basins})
+    dates = pd.date_range(min(e['start'] for e in entries.values()),
+                          max(e['end'] for e in entries.values()),
+                          freq='D',
+                          name='date')
+
+    attributes = load_camels_us_attributes(data_dir, basins=basins)
+    variable_names = {}
+    for forcing in forcings:
+        try:
+            variable_names[forcing] = get_camels_us_variable_names(forcing)
+        except ValueError:
+            # PET cannot be derived from forcings with unknown variable names
+            variable_names[forcing] = None
+    with_pet = all(col in attributes.columns for col in ['gauge_lat', 'elev_mean'])
+
+    cube_dir.mkdir(parents=True, exist_ok=True)
+    index_file = cube_dir / CUBE_INDEX_FILE
+    if index_file.is_file():
+        index_file.unlink()
+
+    columns, arrays = {}, {}
+    areas = {forcing: np.zeros(len(basins), dtype=np.int64) for forcing in forcings}
+    for i, basin in enumerate(tqdm(basins, file=sys.stdout)):
+        for forcing in forcings:
+            entry = entries[(basin, forcing)]
+            df, areas[forcing][i] = read_camels_us_forcing_file(entry['file'], cache_dir=cache_dir)
+            _check_cube_dates(df.index, entry)
+            if with_pet and variable_names[forcing] is not None:
+                lat, elev = attributes.loc[basin, ['gauge_lat', 'elev_mean']]
+                df[PET_COLUMN] = calculate_camels_us_pet(df, lat, elev, variable_names[forcing])
+            if forcing not in columns:
+                columns[forcing] = list(df.columns)
+                arrays[forcing] = np.lib.format.open_memmap(cube_dir / f"forcings_{forcing}.npy",
+                                                            mode='w+',
+                                                            dtype=np.float32,
+                                                            shape=(len(basins), len(dates), len(df.columns)))
+            elif list(df.columns) != columns[forcing]:
+                raise ValueError(f"Forcing file of basin {basin} has other columns than the other {forcing} files.")
+            arrays[forcing][i] = df.reindex(dates).values
+
+        if 'discharge' not in arrays:
+            arrays['discharge'] = np.lib.format.open_memmap(cube_dir / 'discharge.npy',
+                                                            mode='w+',
+                                                            dtype=np.float32,
+                                                            shape=(len(basins), len(dates)))
+        entry = entries[(basin, None)]
+        discharge = read_camels_us_discharge_file(entry['file'], cache_dir=cache_dir)
+        _check_cube_dates(discharge.index, entry)
+        arrays['discharge'][i] = discharge.reindex(dates)
+
+    for array in arrays.values():
+        array.flush()
+    del arrays
+
+    attributes.to_pickle(cube_dir / 'attributes.p')
+    index = {'version': _CUBE_VERSION, 'basins': basins, 'dates': dates, 'forcings': columns, 'areas': areas}
+    atomic_write(index_file, lambda fp: pickle.dump(index, fp))
+
+
+def _check_cube_dates(index: pd.DatetimeIndex, entry: Dict):
+    # a file that changed after the date range of the cube was taken from its manifest entry would lose dates
+    if len(index) == 0 or index[0] != entry['start'] or index[-1] != entry['end']:
+        raise ValueError(f"{entry['file']} changed during the conversion, its dates no longer match the manifest of "
+                         "the CAMELS US files. Convert the data set again.")
+
+
+def load_camels_us_cube_index(cube_dir: Path) -> Dict:
+    """Load the index of a CAMELS US cube created by `convert_camels_us_to_cube`.
 
-    return df.QObs
+    Parameters
+    ----------
+    cube_dir : Path
+        Directory of the cube.
+
+    Returns
+    -------
+    Dict
+        Dictionary with the keys 'basins' (list of basin ids), 'dates' (DatetimeIndex), 'forcings', mapping each
+        forcing product to the names of its variables, and 'areas', mapping each forcing product to the catchment areas
+        (m2) of the basins.
+
+    Raises
+    ------
+    FileNotFoundError
+        If there is no cube in `cube_dir`.
+    ValueError
+        If the cube was created by an older version of `convert_camels_us_to_cube`.
+    """
+    index_file = Path(cube_dir) / CUBE_INDEX_FILE
+    if not index_file.is_file():
+        raise FileNotFoundError(f"No CAMELS US cube found at {cube_dir}. Create it with `convert_camels_us_to_cube`.")
+    with index_file.open('rb') as fp:
+        index = pickle.load(fp)
+    if index.get('version') != _CUBE_VERSION:
+        raise ValueError(f"The CAMELS US cube at {cube_dir} is outdated. Convert the data set again.")
+    return index
+
+
+def _main():
+    parser = argparse.ArgumentParser(description="Convert the CAMELS US text files into a cube for `CamelsUSCube`.")
+    parser.add_argument('data_dir', type=Path, help="Path to the CAMELS US directory.")
+    parser.add_argument('cube_dir', type=Path, help="Directory to store the cube in.")
+    parser.add_argument('--forcings', nargs='+', default=['daymet'], help="Forcing products to convert.")
+    parser.add_argument('--basin-file', type=Path, help="Basin file of the basins to convert. Default: all basins.")
+    parser.add_argument('--cache-dir', type=Path, help="Directory to cache the parsed text files in.")
+    args = parser.parse_args()
+
+    basins = load_basin_file(args.basin_file) if args.basin_file is not None else None
+    convert_camels_us_to_cube(args.data_dir, args.cube_dir, args.forcings, basins=basins, cache_dir=args.cache_dir)
+
+
+if __name__ == '__main__':
+    _main()
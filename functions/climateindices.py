@@ -1,32 +1,85 @@
+import functools
+import hashlib
 import logging
+import os
 import pickle
 import sys
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, ThreadPoolExecutor, wait
+from itertools import islice
 from pathlib import Path
-from typing import List, Dict
+from typing import Callable, Iterator, List, Dict, Tuple, Union
 
 import numpy as np
 import pandas as pd
-from numba import njit
+import xarray
+from numba import njit, prange
 from tqdm import tqdm
 
-from functions.camelsus import load_camels_us_forcings, load_camels_us_attributes
+from functions.camelsus import (load_camels_us_forcings, load_camels_us_attributes, load_camels_us_discharge,
+                                get_camels_us_forcing_file, get_camels_us_variable_names, calculate_camels_us_pet)
 from functions import pet
+from functions.utils import atomic_write, get_file_fingerprint
 
 LOGGER = logging.getLogger(__name__)
 
+CLIMATE_INDICES = [
+    'p_mean_dyn', 'pet_mean_dyn', 'aridity_dyn', 't_mean_dyn', 'frac_snow_dyn', 'high_prec_freq_dyn',
+    'high_prec_dur_dyn', 'low_prec_freq_dyn', 'low_prec_dur_dyn'
+]
+
+SIGNATURES = [
+    'q_mean_dyn', 'runoff_ratio_dyn', 'baseflow_index_dyn', 'stream_elas_dyn', 'high_q_freq_dyn', 'high_q_dur_dyn',
+    'low_q_freq_dyn', 'low_q_dur_dyn'
+]
+
+# days with precipitation >= HIGH_PREC_FACTOR * p_mean are high, days with precipitation < LOW_PREC_THRESHOLD are low
+HIGH_PREC_FACTOR = 5
+LOW_PREC_THRESHOLD = 1
+
+# days with discharge > HIGH_Q_FACTOR * median flow are high, days with discharge < LOW_Q_FACTOR * mean flow are low
+HIGH_Q_FACTOR = 9
+LOW_Q_FACTOR = 0.2
+
+# filter parameter of the recursive Lyne-Hollick baseflow filter
+BASEFLOW_ALPHA = 0.925
+
+# increase whenever a change of the kernels changes their results, this invalidates all cached climate indices
+_CACHE_VERSION = 4
+
+# accumulators of the climate indices that can be selected by name, see `register_climate_index`
+INDEX_ACCUMULATORS = {}
+
+# fused (and batch) kernels of the accumulator selections used so far, cleared whenever an index is (re-)registered
+_FUSED_KERNELS = {}
+_BATCH_KERNELS = {}
+# time steps per block of the fused kernels, the blocks of the series and of the states' windows stay in cache
+_BLOCK_SIZE = 512
+
 
 def calculate_camels_us_dyn_climate_indices(data_dir: Path,
                                          basins: List[str],
-                                         window_length: int,
-                                         forcings: str,
+                                         window_length: Union[int, List[int]],
+                                         forcings: Union[str, List[str]],
                                          variable_names: Dict[str, str] = None,
-                                         output_file: Path = None) -> Dict[str, pd.DataFrame]:
+                                         output_file: Path = None,
+                                         n_workers: int = 1,
+                                         use_threads: bool = False,
+                                         append: bool = False,
+                                         cache_dir: Path = None,
+                                         max_cache_size: int = None,
+                                         high_prec_thresholds: List[float] = None,
+                                         low_prec_thresholds: List[float] = None,
+                                         quantiles: Dict[str, List[float]] = None,
+                                         suffix_columns: bool = False,
+                                         indices: List[str] = None,
+                                         data_cache_dir: Path = None) -> Dict[str, pd.DataFrame]:
     """Calculate dynamic climate indices for the CAMELS US dataset.
     
     Compared to the long-term static climate indices included in the CAMELS US data set, this function computes the same
     climate indices by a moving window approach over the entire data set. That is, for each time step, the climate 
     indices are re-computed from the last `window_length` time steps. The resulting dictionary of DataFrames can be
-    used with the `additional_feature_files` argument.
+    used with the `additional_feature_files` argument, either as pickle dump or as columnar feature cube stored with
+    `utils.save_feature_cube`, which is read lazily and only for the basins and columns used in a run.
     Unlike in CAMELS, the '_freq' indices will be fractions, not number of days. To compare the values to the ones in
     CAMELS, they need to be multiplied by 365.25.
     
@@ -36,77 +89,874 @@ def calculate_camels_us_dyn_climate_indices(data_dir: Path,
         Path to the CAMELS US directory.
     basins : List[str]
         List of basin ids.
-    window_length : int
-        Look-back period to use to compute the climate indices.
-    forcings : str
-        Can be e.g. 'daymet' or 'nldas', etc. Must match the folder names in the 'basin_mean_forcing' directory.
+    window_length : Union[int, List[int]]
+        Look-back period to use to compute the climate indices. If a list of look-back periods is passed, the forcings
+        are read and PET is computed once per basin and the indices of all windows are derived from the same pass over
+        the series.
+    forcings : Union[str, List[str]]
+        Can be e.g. 'daymet' or 'nldas', etc. Must match the folder names in the 'basin_mean_forcing' directory. If a
+        list of forcing products is passed, the attributes are loaded once, the forcing files of each basin are read
+        concurrently and the clear sky radiation of the PET is computed once per basin and shared by all products.
+        Multiple products cannot be combined with `append` or `cache_dir`.
     variable_names : Dict[str, str], optional
         Mapping of the forcings' variable names, needed if forcings other than DayMet, Maurer, or NLDAS are used.
         If provided, this must be a dictionary that maps the keys 'prcp', 'tmin', 'tmax', 'srad' to the forcings'
-        respective variable names.
+        respective variable names. For multiple forcing products, this is a dictionary that maps a product to such a
+        mapping (only needed for products without a predefined mapping).
     output_file : Path, optional
-        If specified, stores the resulting dictionary of DataFrames to this location as a pickle dump.
+        If specified, stores the resulting dictionary of DataFrames to this location as a pickle dump. If multiple
+        window lengths are passed, one pickle dump per window is stored, with the window length appended to the file
+        name (e.g. 'dyn_clim_indices_daymet_531basins.p' becomes 'dyn_clim_indices_daymet_531basins_365.p'). For
+        multiple forcing products without `suffix_columns`, one pickle dump per product is stored, with the product
+        appended to the file name (e.g. 'dyn_clim_indices_531basins_daymet.p').
+    n_workers : int, optional
+        Number of parallel workers the basins are distributed over. The attribute table is loaded once and each worker
+        only receives the latitude and elevation of its basins. Results are returned in the order of `basins`.
+        Default: 1 (sequential processing).
+    use_threads : bool, optional
+        If True and `n_workers` > 1, use a thread pool instead of a process pool. The numba kernels release the GIL,
+        but parsing the forcing files does not, so a process pool is usually faster. Default: False.
+    append : bool, optional
+        If True and `output_file` exists, only the days after the last date stored in `output_file` are computed and
+        appended to the existing indices. This uses the trailing forcing state that is stored next to the output file
+        (same name with a '_state' suffix) and raises a ValueError if the forcings of these days changed since the
+        output file was created, or if the stored columns differ from the requested indices, thresholds and quantiles.
+        Basins that are not yet in `output_file` are computed from scratch. Basins of `output_file` that are not in
+        `basins` are kept in the file, but not returned. The state is only stored by runs with `append`, i.e. the
+        first run that creates `output_file` has to set `append` as well. Requires a single window length.
+        Default: False.
+    cache_dir : Path, optional
+        If specified, the climate indices of each basin are cached in this directory. Cache entries are keyed by the
+        forcings, basin, latitude and elevation, window length(s), variable names, precipitation thresholds, selected
+        indices and the modification time and size of the basin's forcing file. Only basins without a valid cache
+        entry are computed.
+    max_cache_size : int, optional
+        Maximum size of `cache_dir` in bytes. If exceeded, the least recently used cache entries are removed.
+    high_prec_thresholds : List[float], optional
+        Thresholds of high precipitation days as multiples of the window's mean precipitation, see
+        `calculate_dyn_climate_indices`. All thresholds are computed in the same pass over the forcings.
+    low_prec_thresholds : List[float], optional
+        Thresholds of low precipitation days in mm/day, see `calculate_dyn_climate_indices`.
+    quantiles : Dict[str, List[float]], optional
+        Rolling quantiles to add per forcing variable, see `calculate_dyn_climate_indices`.
+    suffix_columns : bool, optional
+        Only used for multiple forcing products. If True, the indices of all products are combined into one DataFrame
+        per basin, with the product appended to the column names (e.g. 'p_mean_dyn_daymet'), as in
+        `CamelsUS._load_basin_data` for multiple forcings. If False, the indices are returned per product.
+        Default: False.
+    indices : List[str], optional
+        Names of the climate indices to compute (default: `CLIMATE_INDICES`), see `calculate_dyn_climate_indices`.
+        Indices added with `register_climate_index` have to be registered in the worker processes as well, i.e. at
+        import time of a module, or `use_threads` has to be set.
+    data_cache_dir : Path, optional
+        Directory the parsed forcing files and the manifest of the CAMELS US files are cached in, e.g. the
+        'data_cache_dir' of a run configuration. Nothing is written into `data_dir`.
 
     Returns
     -------
     Dict[str, pd.DataFrame]
         Dictionary with one time-indexed DataFrame per basin. By definition, the climate indices for a given day in the
-        DataFrame are computed from the `window_length` previous time steps (including the given day).
+        DataFrame are computed from the `window_length` previous time steps (including the given day). If multiple
+        window lengths are passed, the DataFrames have (window, index) MultiIndex columns. For multiple forcing
+        products without `suffix_columns`, a dictionary that maps each product to such a dictionary.
     """
+    if not isinstance(forcings, str):
+        if append or cache_dir is not None:
+            raise ValueError("append and cache_dir are only supported for a single forcing product.")
+        return _calculate_camels_us_multi_forcing_indices(data_dir=data_dir,
+                                                          basins=basins,
+                                                          window_length=window_length,
+                                                          forcings=forcings,
+                                                          variable_names=variable_names,
+                                                          output_file=output_file,
+                                                          n_workers=n_workers,
+                                                          use_threads=use_threads,
+                                                          high_prec_thresholds=high_prec_thresholds,
+                                                          low_prec_thresholds=low_prec_thresholds,
+                                                          quantiles=quantiles,
+                                                          suffix_columns=suffix_columns,
+                                                          indices=indices,
+                                                          data_cache_dir=data_cache_dir)
+
     camels_attributes = load_camels_us_attributes(data_dir=data_dir, basins=basins)
     additional_features = {}
+    variable_names = get_camels_us_variable_names(forcings, variable_names)
 
+    existing_features, states = {}, {}
+    if append:
+        if not isinstance(window_length, int):
+            raise ValueError("Appending to existing climate indices requires a single window length.")
+        if output_file is None:
+            raise ValueError("Appending to existing climate indices requires an output_file.")
+        if output_file.is_file():
+            state_file = _get_state_file(output_file)
+            if not state_file.is_file():
+                raise FileNotFoundError(f"No forcing state found at {state_file}. Only runs with append store the "
+                                        f"state, remove {output_file} and recompute it with append to create it.")
+            with output_file.open("rb") as fp:
+                existing_features = pickle.load(fp)
+            with state_file.open("rb") as fp:
+                states = pickle.load(fp)
+            columns = _get_index_columns(high_prec_thresholds, low_prec_thresholds, quantiles, indices)
+            mismatched = [basin for basin, df in existing_features.items() if list(df.columns) != columns]
+            if mismatched:
+                raise ValueError(f"Climate indices of basins {mismatched} in {output_file} have other columns than "
+                                 f"requested ({columns}). Recompute {output_file} without append to change the "
+                                 "indices, thresholds or quantiles.")
+    # only states that cover a full window can be continued, all other basins are computed from scratch
+    basin_states = [
+        states[basin] if basin in existing_features and len(states.get(basin, [])) == window_length else None
+        for basin in basins
+    ]
+
+    basin_fn = functools.partial(_calculate_basin_dyn_climate_indices,
+                                 data_dir=data_dir,
+                                 window_length=window_length,
+                                 forcings=forcings,
+                                 variable_names=variable_names,
+                                 high_prec_thresholds=high_prec_thresholds,
+                                 low_prec_thresholds=low_prec_thresholds,
+                                 quantiles=quantiles,
+                                 indices=indices,
+                                 data_cache_dir=data_cache_dir)
+    lats = camels_attributes.loc[basins, 'gauge_lat'].values
+    elevs = camels_attributes.loc[basins, 'elev_mean'].values
+
+    results, cache_keys = {}, {}
+    if cache_dir is not None:
+        cache_dir.mkdir(parents=True, exist_ok=True)
+        for basin, lat, elev, state in zip(basins, lats, elevs, basin_states):
+            # appended basins only compute a few new days, caching them would not pay off
+            if state is None:
+                cache_keys[basin] = _get_cache_key(data_dir, basin, lat, elev, window_length, forcings, variable_names,
+                                                   high_prec_thresholds, low_prec_thresholds, quantiles, indices,
+                                                   data_cache_dir)
+                cached = _load_from_cache(cache_dir, cache_keys[basin])
+                if cached is not None:
+                    results[basin] = cached
+        LOGGER.info(f"Loaded climate indices of {len(results)} of {len(basins)} basins from {cache_dir}")
+
+    todo = [i for i, basin in enumerate(basins) if basin not in results]
+    todo_args = [[basins[i] for i in todo], [lats[i] for i in todo], [elevs[i] for i in todo],
+                 [basin_states[i] for i in todo]]
+
+    if n_workers > 1:
+        pool = ThreadPoolExecutor if use_threads else ProcessPoolExecutor
+        with pool(max_workers=n_workers) as executor:
+            # map returns the results in the order of the basins, independent of when the workers finish
+            new_results = list(tqdm(executor.map(basin_fn, *todo_args), total=len(todo), file=sys.stdout))
+    else:
+        new_results = [basin_fn(*args) for args in zip(tqdm(todo_args[0], file=sys.stdout), *todo_args[1:])]
+
+    for basin, result in zip(todo_args[0], new_results):
+        results[basin] = result
+        if basin in cache_keys:
+            _store_in_cache(cache_dir, cache_keys[basin], result)
+    if cache_dir is not None and max_cache_size is not None:
+        _evict_cache(cache_dir, max_cache_size)
+
+    for basin, state in zip(basins, basin_states):
+        clim_indices, new_state = results[basin]
+        if state is not None:
+            clim_indices = pd.concat([existing_features[basin], clim_indices])
+        additional_features[basin] = clim_indices
+        states[basin] = new_state
+
+    if output_file is not None:
+        if append:
+            # keep basins of the existing file that were not part of this run, but only return the requested ones
+            _save_dyn_climate_indices({**existing_features, **additional_features}, output_file, window_length)
+            with _get_state_file(output_file).open("wb") as fp:
+                pickle.dump(states, fp)
+        else:
+            # a state of an earlier run with append does not match the overwritten output file anymore
+            _get_state_file(output_file).unlink(missing_ok=True)
+            _save_dyn_climate_indices(additional_features, output_file, window_length)
+
+    return additional_features
+
+
+def _calculate_camels_us_multi_forcing_indices(data_dir: Path, basins: List[str], window_length: Union[int, List[int]],
+                                               forcings: List[str], variable_names: Dict[str, Dict[str, str]],
+                                               output_file: Path, n_workers: int, use_threads: bool,
+                                               high_prec_thresholds: List[float], low_prec_thresholds: List[float],
+                                               quantiles: Dict[str, List[float]], suffix_columns: bool,
+                                               indices: List[str], data_cache_dir: Path) -> Dict[str, pd.DataFrame]:
+    camels_attributes = load_camels_us_attributes(data_dir=data_dir, basins=basins)
     if variable_names is None:
-        if forcings.startswith('nldas'):
-            variable_names = {'prcp': 'PRCP(mm/day)', 'tmin': 'Tmin(C)', 'tmax': 'Tmax(C)', 'srad': 'SRAD(W/m2)'}
-        elif forcings.startswith('daymet') or forcings.startswith('maurer'):
-            variable_names = {'prcp': 'prcp(mm/day)', 'tmin': 'tmin(C)', 'tmax': 'tmax(C)', 'srad': 'srad(W/m2)'}
+        variable_names = {}
+    variable_names = {
+        forcing: get_camels_us_variable_names(forcing, variable_names.get(forcing)) for forcing in forcings
+    }
+
+    basin_fn = functools.partial(_calculate_basin_multi_forcing_indices,
+                                 data_dir=data_dir,
+                                 window_length=window_length,
+                                 forcings=forcings,
+                                 variable_names=variable_names,
+                                 high_prec_thresholds=high_prec_thresholds,
+                                 low_prec_thresholds=low_prec_thresholds,
+                                 quantiles=quantiles,
+                                 indices=indices,
+                                 data_cache_dir=data_cache_dir)
+    lats = camels_attributes.loc[basins, 'gauge_lat'].values
+    elevs = camels_attributes.loc[basins, 'elev_mean'].values
+
+    if n_workers > 1:
+        pool = ThreadPoolExecutor if use_threads else ProcessPoolExecutor
+        with pool(max_workers=n_workers) as executor:
+            results = list(tqdm(executor.map(basin_fn, basins, lats, elevs), total=len(basins), file=sys.stdout))
+    else:
+        results = [basin_fn(*args) for args in zip(tqdm(basins, file=sys.stdout), lats, elevs)]
+
+    if suffix_columns:
+        additional_features = {}
+        for basin, basin_results in zip(basins, results):
+            dfs = []
+            for forcing in forcings:
+                df = basin_results[forcing]
+                level = 'index' if isinstance(df.columns, pd.MultiIndex) else None
+                dfs.append(df.rename(columns=lambda col: f"{col}_{forcing}", level=level))
+            additional_features[basin] = pd.concat(dfs, axis=1)
+        if output_file is not None:
+            _save_dyn_climate_indices(additional_features, output_file, window_length)
+        return additional_features
+
+    additional_features = {
+        forcing: {basin: basin_results[forcing] for basin, basin_results in zip(basins, results)}
+        for forcing in forcings
+    }
+    if output_file is not None:
+        for forcing in forcings:
+            forcing_file = output_file.parent / f"{output_file.stem}_{forcing}{output_file.suffix}"
+            _save_dyn_climate_indices(additional_features[forcing], forcing_file, window_length)
+    return additional_features
+
+
+def _save_dyn_climate_indices(additional_features: Dict[str, pd.DataFrame], output_file: Path,
+                              window_length: Union[int, List[int]]):
+    # one pickle dump, or one per window with the window length appended to the file name
+    if isinstance(window_length, int):
+        files = {output_file: additional_features}
+    else:
+        files = {
+            output_file.parent / f"{output_file.stem}_{w}{output_file.suffix}":
+            {basin: df[w] for basin, df in additional_features.items()} for w in window_length
+        }
+    for file, features in files.items():
+        with file.open("wb") as fp:
+            pickle.dump(features, fp)
+        LOGGER.info(f"Precalculated features successfully stored at {file}")
+
+
+def iter_camels_us_dyn_climate_indices(data_dir: Path,
+                                       basins: List[str],
+                                       window_length: Union[int, List[int]],
+                                       forcings: str,
+                                       variable_names: Dict[str, str] = None,
+                                       n_workers: int = 1,
+                                       use_threads: bool = False,
+                                       high_prec_thresholds: List[float] = None,
+                                       low_prec_thresholds: List[float] = None,
+                                       quantiles: Dict[str, List[float]] = None,
+                                       indices: List[str] = None,
+                                       data_cache_dir: Path = None) -> Iterator[Tuple[str, pd.DataFrame]]:
+    """Calculate dynamic climate indices for the CAMELS US dataset basin by basin.
+
+    Generator version of `calculate_camels_us_dyn_climate_indices`: instead of collecting all basins in memory, the
+    climate indices of each basin are yielded as soon as the basin is finished. With multiple workers, only a bounded
+    number of basins is in flight at a time, and basins are yielded in the order they finish. Combine with
+    `functions.utils.save_features_per_basin` to write each basin to disk as it arrives, e.g.::
+
+        done = set(utils.get_saved_basins(output_dir))
+        todo = [basin for basin in basins if basin not in done]
+        utils.save_features_per_basin(iter_camels_us_dyn_climate_indices(data_dir, todo, 365, 'daymet'), output_dir)
+
+    Parameters
+    ----------
+    data_dir : Path
+        Path to the CAMELS US directory. This folder must contain a 'basin_mean_forcing' folder containing one 
+        subdirectory for each forcing. The forcing directories have to contain 18 subdirectories (for the 18 HUCS) as in
+        the original CAMELS data set. In each HUC folder are the forcing files (.txt), starting with the 8-digit basin 
+        id. Additionally, this folder must contain a 'camels_attributes_v2.0' with the CAMELS attributes.
+    basins : List[str]
+        List of basin ids.
+    window_length : Union[int, List[int]]
+        Look-back period(s) to use to compute the climate indices, see `calculate_camels_us_dyn_climate_indices`.
+    forcings : str
+        Can be e.g. 'daymet' or 'nldas', etc. Must match the folder names in the 'basin_mean_forcing' directory.
+    variable_names : Dict[str, str], optional
+        Mapping of the forcings' variable names, see `calculate_camels_us_dyn_climate_indices`.
+    n_workers : int, optional
+        Number of parallel workers the basins are distributed over. Default: 1 (sequential processing).
+    use_threads : bool, optional
+        If True and `n_workers` > 1, use a thread pool instead of a process pool. Default: False.
+    high_prec_thresholds : List[float], optional
+        Thresholds of high precipitation days as multiples of the window's mean precipitation, see
+        `calculate_dyn_climate_indices`.
+    low_prec_thresholds : List[float], optional
+        Thresholds of low precipitation days in mm/day, see `calculate_dyn_climate_indices`.
+    quantiles : Dict[str, List[float]], optional
+        Rolling quantiles to add per forcing variable, see `calculate_dyn_climate_indices`.
+    indices : List[str], optional
+        Names of the climate indices to compute, see `calculate_camels_us_dyn_climate_indices`.
+    data_cache_dir : Path, optional
+        Directory to cache the parsed forcing files and the file manifest in, see
+        `calculate_camels_us_dyn_climate_indices`.
+
+    Yields
+    ------
+    Tuple[str, pd.DataFrame]
+        Basin id and time-indexed DataFrame of the basin's climate indices.
+    """
+    camels_attributes = load_camels_us_attributes(data_dir=data_dir, basins=basins)
+    basin_fn = functools.partial(_calculate_basin_dyn_climate_indices,
+                                 state=None,
+                                 return_state=False,
+                                 data_dir=data_dir,
+                                 window_length=window_length,
+                                 forcings=forcings,
+                                 variable_names=get_camels_us_variable_names(forcings, variable_names),
+                                 high_prec_thresholds=high_prec_thresholds,
+                                 low_prec_thresholds=low_prec_thresholds,
+                                 quantiles=quantiles,
+                                 indices=indices,
+                                 data_cache_dir=data_cache_dir)
+    basin_args = zip(basins, camels_attributes.loc[basins, 'gauge_lat'].values,
+                     camels_attributes.loc[basins, 'elev_mean'].values)
+
+    with tqdm(total=len(basins), file=sys.stdout) as progress:
+        if n_workers > 1:
+            pool = ThreadPoolExecutor if use_threads else ProcessPoolExecutor
+            with pool(max_workers=n_workers) as executor:
+                # keep a bounded number of basins in flight, so finished results do not pile up in memory
+                pending = {executor.submit(basin_fn, *args): args[0] for args in islice(basin_args, 2 * n_workers)}
+                while pending:
+                    done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        basin = pending.pop(future)
+                        for args in islice(basin_args, 1):
+                            pending[executor.submit(basin_fn, *args)] = args[0]
+                        progress.update()
+                        yield basin, future.result()
         else:
-            raise ValueError(f'No predefined variable mapping for {forcings} forcings. Provide one in variable_names.')
-
-    for basin in tqdm(basins, file=sys.stdout):
-        df, _ = load_camels_us_forcings(data_dir=data_dir, basin=basin, forcings=forcings)
-        lat = camels_attributes.loc[camels_attributes.index == basin, 'gauge_lat'].values
-        elev = camels_attributes.loc[camels_attributes.index == basin, 'elev_mean'].values
-        df["PET(mm/d)"] = pet.get_priestley_taylor_pet(t_min=df[variable_names['tmin']].values,
-                                                       t_max=df[variable_names['tmax']].values,
-                                                       s_rad=df[variable_names['srad']].values,
-                                                       lat=lat,
-                                                       elev=elev,
-                                                       doy=df.index.dayofyear.values)
-
-        clim_indices = calculate_dyn_climate_indices(df[variable_names['prcp']],
-                                                     df[variable_names['tmax']],
-                                                     df[variable_names['tmin']],
-                                                     df['PET(mm/d)'],
-                                                     window_length=window_length)
+            for args in basin_args:
+                clim_indices = basin_fn(*args)
+                progress.update()
+                yield args[0], clim_indices
 
-        if np.any(clim_indices.isna()):
-            raise ValueError(f"NaN in new features of basin {basin}")
 
-        clim_indices = clim_indices.reindex(df.index)  # add NaN rows for the first window_length - 1 entries
-        additional_features[basin] = clim_indices
+def calculate_camels_us_dyn_signatures(data_dir: Path,
+                                       basins: List[str],
+                                       window_length: int,
+                                       forcings: str,
+                                       variable_names: Dict[str, str] = None,
+                                       output_file: Path = None,
+                                       n_workers: int = 1,
+                                       use_threads: bool = False,
+                                       min_valid_fraction: float = 0.8,
+                                       data_cache_dir: Path = None) -> Dict[str, pd.DataFrame]:
+    """Calculate dynamic hydrological signatures for the CAMELS US dataset.
+
+    Counterpart of `calculate_camels_us_dyn_climate_indices` for the USGS discharge: the signatures of
+    `calculate_dyn_signatures` are computed over a trailing window for each day, from the discharge of
+    `load_camels_us_discharge` and the precipitation of the given forcings.
+
+    Parameters
+    ----------
+    data_dir : Path
+        Path to the CAMELS US directory. This folder must contain a 'basin_mean_forcing' folder containing one 
+        subdirectory for each forcing and a 'usgs_streamflow' folder with the discharge files.
+    basins : List[str]
+        List of basin ids.
+    window_length : int
+        Look-back period to use to compute the signatures.
+    forcings : str
+        Can be e.g. 'daymet' or 'nldas', etc. Must match the folder names in the 'basin_mean_forcing' directory. The
+        precipitation of these forcings is used for the runoff ratio and the streamflow elasticity.
+    variable_names : Dict[str, str], optional
+        Mapping of the forcings' variable names, needed if forcings other than DayMet, Maurer, or NLDAS are used.
+        If provided, this must be a dictionary that maps at least the key 'prcp' to the forcings' variable name.
+    output_file : Path, optional
+        If specified, stores the resulting dictionary of DataFrames to this location as a pickle dump, which can be
+        used like the dynamic climate indices as additional feature file.
+    n_workers : int, optional
+        Number of parallel workers the basins are distributed over. Default: 1 (sequential processing).
+    use_threads : bool, optional
+        If True and `n_workers` > 1, use a thread pool instead of a process pool. Default: False.
+    min_valid_fraction : float, optional
+        Minimum fraction of days with valid discharge per window, see `calculate_dyn_signatures`. Default: 0.8.
+    data_cache_dir : Path, optional
+        Directory to cache the parsed forcing and discharge files and the file manifest in, see
+        `calculate_camels_us_dyn_climate_indices`.
+
+    Returns
+    -------
+    Dict[str, pd.DataFrame]
+        Dictionary with one time-indexed DataFrame per basin and one column per entry of `SIGNATURES`.
+    """
+    variable_names = get_camels_us_variable_names(forcings, variable_names)
+    basin_fn = functools.partial(_calculate_basin_dyn_signatures,
+                                 data_dir=data_dir,
+                                 window_length=window_length,
+                                 forcings=forcings,
+                                 variable_names=variable_names,
+                                 min_valid_fraction=min_valid_fraction,
+                                 data_cache_dir=data_cache_dir)
+
+    if n_workers > 1:
+        pool = ThreadPoolExecutor if use_threads else ProcessPoolExecutor
+        with pool(max_workers=n_workers) as executor:
+            results = list(tqdm(executor.map(basin_fn, basins), total=len(basins), file=sys.stdout))
+    else:
+        results = [basin_fn(basin) for basin in tqdm(basins, file=sys.stdout)]
+    signatures = dict(zip(basins, results))
 
     if output_file is not None:
         with output_file.open("wb") as fp:
-            pickle.dump(additional_features, fp)
-        LOGGER.info(f"Precalculated features successfully stored at {output_file}")
+            pickle.dump(signatures, fp)
 
-    return additional_features
+    return signatures
+
+
+def calculate_water_year_indices(climate_indices: Dict[str, pd.DataFrame],
+                                 columns: List[str] = None) -> xarray.Dataset:
+    """Aggregate daily dynamic climate indices to a dense (basin, water year, index) table.
+
+    Water years run from October 1 to September 30 and are labeled by the calendar year they end in. For each basin,
+    water year and index, the table holds the value on September 30 (i.e., the index computed from the window that ends
+    with the water year) and the mean over all days of the water year. The mean is NaN if any day of the water year is
+    missing or NaN. With this table, extreme or random train/test years can be selected for all basins and indices
+    at once, e.g. with ``np.argsort(table['end'].values, axis=1)``.
+
+    Parameters
+    ----------
+    climate_indices : Dict[str, pd.DataFrame]
+        Dictionary mapping from basin id to a DataFrame with daily DatetimeIndex, as returned by
+        `calculate_camels_us_dyn_climate_indices`.
+    columns : List[str], optional
+        Indices to aggregate. If not passed, all columns of the first DataFrame are used.
+
+    Returns
+    -------
+    xarray.Dataset
+        Dataset with the variables 'end' and 'mean' of dimensions (basin, water_year, index). The coordinates
+        'start_date' and 'end_date' along the water_year dimension hold October 1 and September 30 of each water year.
+    """
+    basins = list(climate_indices.keys())
+    if columns is None:
+        columns = list(climate_indices[basins[0]].columns)
+
+    dates = climate_indices[basins[0]].index
+    for df in climate_indices.values():
+        dates = dates.union(df.index)
+    data = np.stack([climate_indices[basin].reindex(dates)[columns].values for basin in basins])
+
+    # water years are labeled by the year of their end (September 30)
+    water_years = dates.year.values + (dates.month.values >= 10)
+    years, starts = np.unique(water_years, return_index=True)
+    start_dates = pd.to_datetime([f"{year - 1}-10-01" for year in years])
+    end_dates = pd.to_datetime([f"{year}-09-30" for year in years])
+
+    valid = ~np.isnan(data)
+    sums = np.add.reduceat(np.where(valid, data, 0), starts, axis=1)
+    counts = np.add.reduceat(valid, starts, axis=1)
+    n_days = ((end_dates - start_dates).days.values + 1)[np.newaxis, :, np.newaxis]
+    with np.errstate(invalid='ignore', divide='ignore'):
+        means = np.where(counts == n_days, sums / counts, np.nan)
+
+    ends = np.full((len(basins), len(years), len(columns)), np.nan)
+    end_positions = dates.get_indexer(end_dates)
+    has_end = end_positions >= 0
+    ends[:, has_end] = data[:, end_positions[has_end]]
+
+    dims = ('basin', 'water_year', 'index')
+    coords = {
+        'basin': basins,
+        'water_year': years,
+        'index': columns,
+        'start_date': ('water_year', start_dates),
+        'end_date': ('water_year', end_dates)
+    }
+    return xarray.Dataset({'end': (dims, ends), 'mean': (dims, means)}, coords=coords)
+
+
+def calculate_gridded_dyn_climate_indices(forcings: xarray.Dataset,
+                                          dem: xarray.DataArray,
+                                          window_length: Union[int, str],
+                                          output_dir: Path,
+                                          variable_names: Dict[str, str] = None,
+                                          chunk_size: int = 8,
+                                          indices: List[str] = None) -> xarray.Dataset:
+    """Calculate dynamic climate indices for gridded forcings.
+
+    Gridded counterpart of `calculate_camels_us_dyn_climate_indices`: PET and the climate indices of
+    `calculate_dyn_climate_indices` are computed for each grid cell of a (time, lat, lon) dataset, e.g. a daily
+    netCDF file opened with ``xarray.open_dataset``. The grid is processed in chunks of `chunk_size` latitude rows, so
+    only one chunk of the forcings and indices is in memory at a time. Within a chunk, the cells are processed in
+    parallel by numba kernels. Cells with a NaN elevation (e.g. ocean) are skipped and NaN in the output.
+
+    The output is written chunk by chunk to `output_dir`: a 'data.npy' float32 array of shape (#indices, #lat, #lon,
+    #time), such that the time series of each index and cell is a contiguous block on disk, and an 'index.p' pickle
+    dump with the index names and coordinates. Use `load_gridded_climate_indices` to open it.
+
+    Parameters
+    ----------
+    forcings : xarray.Dataset
+        Daily forcings with the dimensions 'time', 'lat' and 'lon', and the coordinate 'lat' in degree.
+    dem : xarray.DataArray
+        Elevation (m) with the dimensions 'lat' and 'lon', on the same grid as `forcings`.
+    window_length : Union[int, str]
+        Look-back period to use to compute the climate indices, in days or as time-based window (e.g. '365D').
+    output_dir : Path
+        Directory to store the indices in. Will be created if it does not exist.
+    variable_names : Dict[str, str], optional
+        Mapping of the keys 'prcp', 'tmin', 'tmax', 'srad' to the variable names in `forcings`. Default: the key names.
+    chunk_size : int, optional
+        Number of latitude rows per chunk. Default: 8.
+    indices : List[str], optional
+        Names of the climate indices to compute (default: `CLIMATE_INDICES`), see `calculate_dyn_climate_indices`.
+
+    Returns
+    -------
+    xarray.Dataset
+        The memory-mapped indices, see `load_gridded_climate_indices`.
+
+    Raises
+    ------
+    ValueError
+        If `dem` does not have the same shape as the grid of `forcings` or `indices` contains an unknown index.
+    """
+    if variable_names is None:
+        variable_names = {'prcp': 'prcp', 'tmin': 'tmin', 'tmax': 'tmax', 'srad': 'srad'}
+    window_length = _get_window_days(window_length)
+    columns = CLIMATE_INDICES if indices is None else list(indices)
+    batch_kernel = _get_batch_kernel(_get_accumulators(columns))
+
+    forcings = forcings.transpose('time', 'lat', 'lon')
+    dem = dem.transpose('lat', 'lon')
+    n_time, n_lat, n_lon = forcings.sizes['time'], forcings.sizes['lat'], forcings.sizes['lon']
+    if dem.shape != (n_lat, n_lon):
+        raise ValueError(f"DEM of shape {dem.shape} does not match the grid of shape {(n_lat, n_lon)}")
+
+    doy = forcings['time'].dt.dayofyear.values
+    lats = forcings['lat'].values
+    elevs = dem.values
+
+    output_dir.mkdir(parents=True, exist_ok=True)
+    data = np.lib.format.open_memmap(output_dir / 'data.npy',
+                                     mode='w+',
+                                     dtype=np.float32,
+                                     shape=(len(columns), n_lat, n_lon, n_time))
+    for start in tqdm(range(0, n_lat, chunk_size), file=sys.stdout):
+        end = min(start + chunk_size, n_lat)
+        chunk = forcings.isel(lat=slice(start, end))
+        # (#cells, #time) arrays of the valid cells of this chunk
+        valid = ~np.isnan(elevs[start:end])
+        cell_lats = np.repeat(lats[start:end], n_lon).reshape(end - start, n_lon)[valid]
+        variables = {
+            key: np.moveaxis(chunk[name].values, 0, -1)[valid].astype(np.float64)
+            for key, name in variable_names.items()
+        }
+        pet_values = pet.get_priestley_taylor_pet_batch(variables['tmin'], variables['tmax'], variables['srad'],
+                                                        cell_lats, elevs[start:end][valid], doy)
+
+        features = np.stack([variables['prcp'], variables['tmax'], variables['tmin'], pet_values], axis=-1)
+        chunk_indices = np.full((len(columns), end - start, n_lon, n_time), np.nan, dtype=np.float32)
+        chunk_indices[:, valid] = np.moveaxis(batch_kernel(features, window_length), -1, 0)
+        data[:, start:end] = chunk_indices
+    data.flush()
+    del data
+
+    with (output_dir / 'index.p').open('wb') as fp:
+        pickle.dump(
+            {
+                'columns': columns,
+                'lat': forcings['lat'].values,
+                'lon': forcings['lon'].values,
+                'time': forcings['time'].values
+            }, fp)
+
+    return load_gridded_climate_indices(output_dir)
+
+
+def load_gridded_climate_indices(output_dir: Path) -> xarray.Dataset:
+    """Open the indices stored by `calculate_gridded_dyn_climate_indices`.
+
+    The data is memory-mapped, so only the selected indices, cells and time steps are read from disk.
+
+    Parameters
+    ----------
+    output_dir : Path
+        Directory of the stored indices.
+
+    Returns
+    -------
+    xarray.Dataset
+        Dataset with one float32 variable of dimensions (lat, lon, time) per climate index.
+    """
+    with (output_dir / 'index.p').open('rb') as fp:
+        index = pickle.load(fp)
+    data = np.load(output_dir / 'data.npy', mmap_mode='r')
+    coords = {'lat': index['lat'], 'lon': index['lon'], 'time': index['time']}
+    return xarray.Dataset({col: (('lat', 'lon', 'time'), data[i]) for i, col in enumerate(index['columns'])},
+                          coords=coords)
+
+
+def create_synthetic_grid(n_lat: int = 16,
+                          n_lon: int = 16,
+                          start_date: str = '1980-01-01',
+                          end_date: str = '1989-12-31',
+                          seed: int = 0) -> Tuple[xarray.Dataset, xarray.DataArray]:
+    """Create a synthetic daily forcing grid and DEM, e.g. to test `calculate_gridded_dyn_climate_indices` locally.
+
+    Parameters
+    ----------
+    n_lat : int, optional
+        Number of latitude rows, spread over 25-50 degree north. Default: 16.
+    n_lon : int, optional
+        Number of longitude columns, spread over 125-67 degree west. Default: 16.
+    start_date : str, optional
+        First day of the forcings. Default: '1980-01-01'.
+    end_date : str, optional
+        Last day of the forcings. Default: '1989-12-31'.
+    seed : int, optional
+        Seed of the random number generator. Default: 0.
+
+    Returns
+    -------
+    xarray.Dataset
+        Forcings with the variables 'prcp' (mm/day), 'tmin', 'tmax' (degree C) and 'srad' (W/m2) of dimensions (time,
+        lat, lon).
+    xarray.DataArray
+        DEM (m) of dimensions (lat, lon), with NaNs in one corner to mimic cells outside of the domain.
+    """
+    rng = np.random.default_rng(seed)
+    time = pd.date_range(start_date, end_date)
+    lat = np.linspace(25, 50, n_lat)
+    lon = np.linspace(-125, -67, n_lon)
+    shape = (len(time), n_lat, n_lon)
+
+    season = np.sin(2 * np.pi * (time.dayofyear.values - 110) / 365)[:, np.newaxis, np.newaxis]
+    tmean = 25 - 0.6 * (lat[np.newaxis, :, np.newaxis] - 25) + 12 * season + rng.normal(0, 3, shape)
+    trange = rng.uniform(5, 15, shape)
+    prcp = rng.gamma(0.6, 5, shape) * (rng.random(shape) < 0.4)
+    srad = np.clip(200 + 100 * season + rng.normal(0, 30, shape), 20, None)
+
+    dims = ('time', 'lat', 'lon')
+    forcings = xarray.Dataset(
+        {
+            'prcp': (dims, prcp),
+            'tmin': (dims, tmean - trange / 2),
+            'tmax': (dims, tmean + trange / 2),
+            'srad': (dims, srad)
+        },
+        coords={
+            'time': time,
+            'lat': lat,
+            'lon': lon
+        })
+    elevation = rng.uniform(0, 3000, (n_lat, n_lon))
+    elevation[:n_lat // 4, :n_lon // 4] = np.nan
+    dem = xarray.DataArray(elevation, dims=('lat', 'lon'), coords={'lat': lat, 'lon': lon})
+    return forcings, dem
+
+
+def _calculate_basin_dyn_climate_indices(basin: str, lat: float, elev: float, state: pd.DataFrame, data_dir: Path,
+                                         window_length: Union[int, List[int]], forcings: str,
+                                         variable_names: Dict[str, str], high_prec_thresholds: List[float],
+                                         low_prec_thresholds: List[float], quantiles: Dict[str, List[float]],
+                                         indices: List[str], data_cache_dir: Path, return_state: bool = True
+                                         ) -> Union[pd.DataFrame, Tuple[pd.DataFrame, pd.DataFrame]]:
+    # Returns the climate indices and, if `return_state`, the kernel inputs of the last window, which are the state to
+    # continue from. If a state is passed, only the indices of the days after the state are returned.
+    df, _ = load_camels_us_forcings(data_dir=data_dir, basin=basin, forcings=forcings, cache_dir=data_cache_dir)
+    if state is not None:
+        df = df.loc[state.index[0]:]
+    df["PET(mm/d)"] = calculate_camels_us_pet(df, lat, elev, variable_names)
+    inputs = df[[variable_names['prcp'], variable_names['tmax'], variable_names['tmin'], 'PET(mm/d)']]
+    inputs.columns = ['prcp', 'tmax', 'tmin', 'pet']
+
+    if state is not None:
+        history = inputs.iloc[:len(state)]
+        if not (history.index.equals(state.index)
+                and np.allclose(history.values, state.values, rtol=1e-6, equal_nan=True)):
+            raise ValueError(f"Forcings of basin {basin} changed between {state.index[0]:%Y-%m-%d} and "
+                             f"{state.index[-1]:%Y-%m-%d}. Remove the output file and recompute the climate "
+                             "indices.")
+        if len(inputs) == len(state):
+            columns = _get_index_columns(high_prec_thresholds, low_prec_thresholds, quantiles, indices)
+            return pd.DataFrame(columns=columns, index=inputs.index[:0], dtype=float), state
+        # the first day of the state only anchors the state, all following days are the history of the new days
+        inputs = inputs.iloc[1:]
+
+    clim_indices = calculate_dyn_climate_indices(inputs['prcp'],
+                                                 inputs['tmax'],
+                                                 inputs['tmin'],
+                                                 inputs['pet'],
+                                                 window_length=window_length,
+                                                 high_prec_thresholds=high_prec_thresholds,
+                                                 low_prec_thresholds=low_prec_thresholds,
+                                                 quantiles=quantiles,
+                                                 indices=indices)
+
+    _check_nan(clim_indices, window_length, len(df), basin)
+
+    if state is None:
+        clim_indices = clim_indices.reindex(df.index)  # add NaN rows for the first window_length - 1 entries
+    if not return_state:
+        return clim_indices
+
+    max_window = window_length if isinstance(window_length, int) else max(window_length)
+    return clim_indices, inputs.iloc[-max_window:]
+
+
+def _calculate_basin_multi_forcing_indices(basin: str, lat: float, elev: float, data_dir: Path,
+                                           window_length: Union[int, List[int]], forcings: List[str],
+                                           variable_names: Dict[str, Dict[str, str]], high_prec_thresholds: List[float],
+                                           low_prec_thresholds: List[float], quantiles: Dict[str, List[float]],
+                                           indices: List[str], data_cache_dir: Path) -> Dict[str, pd.DataFrame]:
+    # Returns the climate indices per forcing product. The forcing files are read concurrently, and the clear sky
+    # radiation, which only depends on the location and the day of the year, is looked up once for all products.
+    with ThreadPoolExecutor(max_workers=len(forcings)) as executor:
+        dfs = list(executor.map(lambda forcing: load_camels_us_forcings(data_dir, basin, forcing, data_cache_dir)[0],
+                                forcings))
+
+    dates = dfs[0].index
+    for df in dfs[1:]:
+        dates = dates.union(df.index)
+    cs_rad = pd.Series(pet.get_clear_sky_rad_table(lat, elev)[dates.dayofyear.values - 1], index=dates)
+
+    clim_indices = {}
+    for forcing, df in zip(forcings, dfs):
+        names = variable_names[forcing]
+        pet_values = pet.get_priestley_taylor_pet_from_clear_sky_rad(t_min=df[names['tmin']].values,
+                                                                     t_max=df[names['tmax']].values,
+                                                                     s_rad=df[names['srad']].values,
+                                                                     elev=elev,
+                                                                     cs_rad=cs_rad.loc[df.index].values)
+        forcing_indices = calculate_dyn_climate_indices(df[names['prcp']],
+                                                        df[names['tmax']],
+                                                        df[names['tmin']],
+                                                        pd.Series(pet_values, index=df.index),
+                                                        window_length=window_length,
+                                                        high_prec_thresholds=high_prec_thresholds,
+                                                        low_prec_thresholds=low_prec_thresholds,
+                                                        quantiles=quantiles,
+                                                        indices=indices)
+        _check_nan(forcing_indices, window_length, len(df), f"{basin} ({forcing})")
+        clim_indices[forcing] = forcing_indices.reindex(df.index)
+
+    return clim_indices
+
+
+def _check_nan(clim_indices: pd.DataFrame, window_length: Union[int, List[int]], n_samples: int, basin: str):
+    if isinstance(window_length, int):
+        if np.any(clim_indices.isna()):
+            raise ValueError(f"NaN in new features of basin {basin}")
+    elif any(np.any(clim_indices[w].iloc[min(w, n_samples) - 1:].isna()) for w in window_length):
+        raise ValueError(f"NaN in new features of basin {basin}")
+
+
+def _calculate_basin_dyn_signatures(basin: str, data_dir: Path, window_length: int, forcings: str,
+                                    variable_names: Dict[str, str], min_valid_fraction: float,
+                                    data_cache_dir: Path) -> pd.DataFrame:
+    df, area = load_camels_us_forcings(data_dir=data_dir, basin=basin, forcings=forcings, cache_dir=data_cache_dir)
+    discharge = load_camels_us_discharge(data_dir=data_dir, basin=basin, area=area, cache_dir=data_cache_dir)
+    # invalid discharge values are NaN, as in the data set classes
+    discharge = discharge.where(discharge >= 0).reindex(df.index)
+    return calculate_dyn_signatures(discharge,
+                                    df[variable_names['prcp']],
+                                    window_length=window_length,
+                                    min_valid_fraction=min_valid_fraction)
+
+
+def _get_state_file(output_file: Path) -> Path:
+    return output_file.parent / f"{output_file.stem}_state{output_file.suffix}"
+
+
+def _get_cache_key(data_dir: Path, basin: str, lat: float, elev: float, window_length: Union[int, List[int]],
+                   forcings: str, variable_names: Dict[str, str], high_prec_thresholds: List[float],
+                   low_prec_thresholds: List[float], quantiles: Dict[str, List[float]], indices: List[str],
+                   data_cache_dir: Path) -> str:
+    key = {
+        'version': _CACHE_VERSION,
+        'forcings': forcings,
+        'basin': basin,
+        'lat': float(lat),
+        'elev': float(elev),
+        'window_length': window_length,
+        'variable_names': sorted(variable_names.items()),
+        'thresholds': (HIGH_PREC_FACTOR, LOW_PREC_THRESHOLD, high_prec_thresholds, low_prec_thresholds),
+        'quantiles': sorted(quantiles.items()) if quantiles is not None else None,
+        'indices': indices,
+        'forcing_file': get_file_fingerprint(get_camels_us_forcing_file(data_dir, basin, forcings, data_cache_dir))
+    }
+    return hashlib.sha256(repr(key).encode()).hexdigest()
+
+
+def _load_from_cache(cache_dir: Path, key: str) -> Tuple[pd.DataFrame, pd.DataFrame]:
+    cache_file = cache_dir / f"{key}.p"
+    try:
+        with cache_file.open("rb") as fp:
+            result = pickle.load(fp)
+        # the modification time marks the last use for the least recently used eviction
+        os.utime(cache_file)
+    except (OSError, EOFError, pickle.UnpicklingError):
+        # missing, partial, or evicted by a concurrent run in the meantime
+        return None
+    return result
+
+
+def _store_in_cache(cache_dir: Path, key: str, result: Tuple[pd.DataFrame, pd.DataFrame]):
+    atomic_write(cache_dir / f"{key}.p", lambda fp: pickle.dump(result, fp))
+
+
+def _evict_cache(cache_dir: Path, max_cache_size: int):
+    entries = []
+    for cache_file in cache_dir.glob("*.p"):
+        try:
+            stat = cache_file.stat()
+        except OSError:
+            # evicted by a concurrent run
+            continue
+        entries.append((stat.st_mtime, stat.st_size, cache_file))
+    entries.sort(key=lambda e: e[0])
+    total_size = sum(size for _, size, _ in entries)
+    for _, size, cache_file in entries:
+        if total_size <= max_cache_size:
+            break
+        try:
+            cache_file.unlink()
+        except OSError:
+            pass
+        total_size -= size
 
 
 def calculate_dyn_climate_indices(precip: pd.Series,
                                   tmax: pd.Series,
                                   tmin: pd.Series,
                                   pet: pd.Series,
-                                  window_length: int,
-                                  raise_nan=False) -> pd.DataFrame:
+                                  window_length: Union[int, str, List[Union[int, str]]],
+                                  raise_nan=False,
+                                  at_dates: List[pd.Timestamp] = None,
+                                  every: int = None,
+                                  high_prec_thresholds: List[float] = None,
+                                  low_prec_thresholds: List[float] = None,
+                                  quantiles: Dict[str, List[float]] = None,
+                                  output_freq: str = None,
+                                  indices: List[str] = None) -> pd.DataFrame:
     """Calculate dynamic climate indices.
 
     Compared to the long-term static climate indices included in the CAMELS dataset, this function computes the same
     climate indices by a moving window approach over the entire dataset. That is, for each time step, the climate
     indices are re-computed from the last `window_length` time steps.
 
+    Sub-daily (e.g. hourly) inputs are aggregated to daily values on the fly (sum of precipitation and PET, max of
+    `tmax`, min of `tmin`), because all indices are defined on daily values. Days with missing time steps are NaN. The
+    indices are computed from the daily values and emitted at the native frequency: the indices of a time step are
+    those of the last complete day up to (and including) this time step.
+
     Parameters
     ----------
     precip : pd.Series
@@ -117,49 +967,1049 @@ def calculate_dyn_climate_indices(precip: pd.Series,
         Time-indexed series of minimum temperature.
     pet : pd.Series
         Time-indexed series of potential evapotranspiration.
-    window_length : int
-        Look-back period to use to compute the climate indices.
+    window_length : Union[int, str, List[Union[int, str]]]
+        Look-back period to use to compute the climate indices, either as number of days or as time-based window in
+        whole days (e.g. '365D'). If a list of look-back periods is passed, the indices of all windows are computed in
+        a single pass over the series, and the columns are labeled with the window length in days. Time-based windows
+        cover calendar days: daily inputs with missing dates are reindexed to a complete daily range (the missing days
+        are NaN, like missing values, so all indices of the windows that contain them are NaN), and the indices are
+        only returned for the dates of the inputs. Windows given as number of days count time steps.
     raise_nan : bool, optional
         If True, will raise a ValueError if a climate index is NaN. Default: False.
+    at_dates : List[pd.Timestamp], optional
+        If passed, the climate indices are only evaluated for the windows that end at these dates (e.g., water-year
+        boundaries). All dates must be part of the index of `precip`. The accumulators still slide over the series up
+        to the last date, but the indices are only queried at these dates, and the rolling quantiles only scan their
+        windows.
+    every : int, optional
+        If passed, the climate indices are only evaluated at every `every`-th time step, starting with the first
+        complete window. Cannot be combined with `at_dates`.
+    high_prec_thresholds : List[float], optional
+        If passed, days with precipitation >= threshold * p_mean of the window count as high precipitation days for
+        each of these thresholds (default: 5). The columns 'high_prec_freq_dyn' and 'high_prec_dur_dyn' are then
+        replaced by one pair of columns per threshold, named e.g. 'high_prec_freq_dyn_3' and 'high_prec_dur_dyn_3',
+        which are appended after the other indices. All thresholds are answered from the same pass over the series.
+    low_prec_thresholds : List[float], optional
+        If passed, days with precipitation < threshold (mm/day) count as low precipitation days for each of these
+        thresholds (default: 1). The columns 'low_prec_freq_dyn' and 'low_prec_dur_dyn' are then replaced by one pair
+        of columns per threshold, named e.g. 'low_prec_freq_dyn_0.5' and 'low_prec_dur_dyn_0.5'.
+    quantiles : Dict[str, List[float]], optional
+        If passed, rolling quantiles over the same window(s) are added as extra columns. Maps a variable ('prcp',
+        'tmax', 'tmin', 'tmean' or 'pet') to a list of quantiles in [0, 1], e.g. {'prcp': [0.95], 'tmean': [0.05]}
+        adds the columns 'prcp_q95_dyn' and 'tmean_q5_dyn'. See `calculate_rolling_quantiles`.
+    output_freq : str, optional
+        If passed, the climate indices are emitted at this frequency (e.g. '1D' for hourly inputs), using the indices of
+        the last time step of each period. By default, the native frequency of the inputs is used. Cannot be combined
+        with `at_dates` or `every`, which refer to the daily values.
+    indices : List[str], optional
+        If passed, only these climate indices are computed, in this order. Any index of `INDEX_ACCUMULATORS` can be
+        selected, including indices added with `register_climate_index`. The accumulators of all selected indices and
+        of the swept thresholds are fused into a single pass over the series.
 
     Returns
     -------
     pd.DataFrame
         Time-indexed DataFrame of climate indices. By definition, the climate indices for a given day in the
-        DataFrame are computed from the `window_length` previous time steps (including the given day).
+        DataFrame are computed from the `window_length` previous time steps (including the given day). If multiple
+        window lengths are passed, the DataFrame has (window, index) MultiIndex columns and covers the full index of
+        `precip`, with NaNs for the first `window - 1` time steps of each window. If `at_dates` or `every` is passed,
+        the DataFrame only contains the evaluated dates (for a single window length only those with a complete
+        window).
 
     Raises
     ------
     ValueError
-        If `raise_nan` is True and a calculated climate index is NaN at any point in time.
+        If `raise_nan` is True and a calculated climate index is NaN at any point in time, if both `at_dates` and
+        `every` are passed, if any of `at_dates` is not part of the index of `precip`, if `quantiles` contains an
+        unknown variable or a quantile outside of [0, 1], if a time-based window is not a multiple of one day, or if
+        `indices` contains an unknown index.
     """
+    columns = _get_index_columns(high_prec_thresholds, low_prec_thresholds, indices=indices)
+    accumulators = _get_accumulators(columns, high_prec_thresholds, low_prec_thresholds)
+
+    time_based = any(isinstance(w, str) for w in ([window_length] if isinstance(window_length, (int, str))
+                                                  else window_length))
+    if isinstance(window_length, (int, str)):
+        window_length = _get_window_days(window_length)
+    else:
+        window_length = [_get_window_days(w) for w in window_length]
+
+    if output_freq is not None and (at_dates is not None or every is not None):
+        raise ValueError("output_freq cannot be combined with at_dates or every.")
+
+    native_index = None
+    if len(precip) > 1 and (precip.index[1:] - precip.index[:-1]).min() < pd.Timedelta(days=1):
+        native_index = precip.index
+        precip, tmax, tmin, pet = _aggregate_to_daily(precip, tmax, tmin, pet)
+
+    input_index = None
+    if native_index is None and time_based and len(precip) > 1:
+        # time-based windows cover calendar days, so missing dates have to be NaN days instead of being skipped
+        full_index = pd.date_range(precip.index[0], precip.index[-1], freq='1D', name=precip.index.name)
+        if len(full_index) != len(precip):
+            input_index = precip.index
+            if at_dates is not None and not pd.DatetimeIndex(at_dates).isin(input_index).all():
+                missing = pd.DatetimeIndex(at_dates)[~pd.DatetimeIndex(at_dates).isin(input_index)]
+                raise ValueError(f"Dates {list(missing)} are not in the index.")
+            precip, tmax, tmin, pet = [series.reindex(full_index) for series in [precip, tmax, tmin, pet]]
+
     x = np.array([precip.values, tmax.values, tmin.values, pet.values]).T
-    
-    new_features = _numba_climate_indexes(x, window_length=window_length)
 
-    df = pd.DataFrame(
-        {
-            'p_mean_dyn': new_features[:, 0],
-            'pet_mean_dyn': new_features[:, 1],
-            'aridity_dyn': new_features[:, 2],
-            't_mean_dyn': new_features[:, 3],
-            'frac_snow_dyn': new_features[:, 4],
-            'high_prec_freq_dyn': new_features[:, 5],
-            'high_prec_dur_dyn': new_features[:, 6],
-            'low_prec_freq_dyn': new_features[:, 7],
-            'low_prec_dur_dyn': new_features[:, 8]
-        },
-        index=precip.iloc[min(window_length, len(precip)) - 1:].index)
+    if at_dates is not None and every is not None:
+        raise ValueError("Only one of at_dates and every can be passed.")
+    if at_dates is not None:
+        anchors = precip.index.get_indexer(pd.DatetimeIndex(at_dates))
+        if (anchors < 0).any():
+            raise ValueError(f"Dates {list(pd.DatetimeIndex(at_dates)[anchors < 0])} are not in the index.")
+    elif every is not None:
+        first_window = min(window_length if isinstance(window_length, int) else min(window_length), len(precip))
+        anchors = np.arange(first_window - 1, len(precip), every)
+    else:
+        anchors = None
+
+    # one fused pass per window over the accumulators of the (default) indices and the swept thresholds, which are
+    # only queried for the windows that end at the anchors
+    if anchors is not None:
+        if isinstance(window_length, int):
+            complete = anchors >= min(window_length, len(precip)) - 1
+            df = pd.DataFrame(_run_fused_kernel(accumulators, x, window_length, anchors[complete]),
+                              columns=columns,
+                              index=precip.index[anchors[complete]])
+        else:
+            df = pd.concat(
+                {w: pd.DataFrame(_run_fused_kernel(accumulators, x, w, anchors), columns=columns,
+                                 index=precip.index[anchors])
+                 for w in window_length},
+                axis=1)
+            df.columns.names = ['window', 'index']
+    else:
+        frames = {}
+        for w in ([window_length] if isinstance(window_length, int) else window_length):
+            anchors = np.arange(min(w, len(precip)) - 1, len(precip))
+            frames[w] = pd.DataFrame(_run_fused_kernel(accumulators, x, w, anchors),
+                                     columns=columns,
+                                     index=precip.index[anchors])
+        if isinstance(window_length, int):
+            df = frames[window_length]
+        else:
+            anchors = np.arange(len(precip))
+            df = pd.concat(frames, axis=1).reindex(precip.index)
+            df.columns.names = ['window', 'index']
+
+    # the quantiles of sparse dates only evaluate the windows that end at these dates
+    positions = None
+    if at_dates is not None or every is not None:
+        positions = precip.index.get_indexer(df.index).astype(np.int64)
 
-    if raise_nan and np.any(df.isna()):
-        raise ValueError(f"NaN in climate indices {[col for col in df.columns[df.isna().any()]]}")
+    if quantiles is not None:
+        variables = {'prcp': precip, 'tmax': tmax, 'tmin': tmin, 'tmean': (tmax + tmin) / 2, 'pet': pet}
+        unknown = [var for var in quantiles.keys() if var not in variables]
+        if unknown:
+            raise ValueError(f"Unknown variables {unknown} in quantiles. Use any of {list(variables.keys())}.")
+        frames = {}
+        for w in ([window_length] if isinstance(window_length, int) else window_length):
+            if positions is None:
+                rolling = [calculate_rolling_quantiles(variables[var], w, qs).loc[df.index]
+                           for var, qs in quantiles.items()]
+            else:
+                rolling = [_rolling_quantiles_at(variables[var], w, qs, positions) for var, qs in quantiles.items()]
+            block = df if isinstance(window_length, int) else df[w]
+            frames[w] = pd.concat([block] + [q.add_prefix(f"{var}_").add_suffix("_dyn")
+                                             for var, q in zip(quantiles.keys(), rolling)],
+                                  axis=1)
+        if isinstance(window_length, int):
+            df = frames[window_length]
+        else:
+            df = pd.concat(frames, axis=1)
+            df.columns.names = ['window', 'index']
+
+    if raise_nan:
+        if isinstance(window_length, int):
+            nan_columns = [col for col in df.columns[df.isna().any()]]
+        else:
+            nan_columns = [(w, col) for w in window_length
+                           for col in df[w].columns[df[w][anchors >= min(w, len(precip)) - 1].isna().any()]]
+        if nan_columns:
+            raise ValueError(f"NaN in climate indices {nan_columns}")
+
+    if input_index is not None:
+        # only return the dates of the input, not the filled missing dates
+        df = df[df.index.isin(input_index)]
+
+    if at_dates is None and every is None:
+        if native_index is not None:
+            # the indices of a day are valid from the last time step of this day on
+            step = (native_index[1:] - native_index[:-1]).min()
+            df.index = df.index + pd.Timedelta(days=1) - step
+            df = df.reindex(native_index[native_index >= df.index[0]], method='ffill')
+        if output_freq is not None:
+            # take the last time step of each period, including its NaNs (unlike resample().last())
+            last_steps = df.index.to_series().resample(output_freq).max()
+            df = df.reindex(last_steps.values)
+            df.index = last_steps.index
 
     return df
 
 
-@njit
+def _get_window_days(window_length: Union[int, str]) -> int:
+    # window length in days from a number of days or a time-based window such as '365D'
+    if isinstance(window_length, str):
+        window = pd.Timedelta(window_length)
+        if window % pd.Timedelta(days=1) != pd.Timedelta(0):
+            raise ValueError(f"Time-based windows must be a multiple of one day, got {window_length}")
+        return window // pd.Timedelta(days=1)
+    return window_length
+
+
+def _aggregate_to_daily(precip: pd.Series, tmax: pd.Series, tmin: pd.Series,
+                        pet: pd.Series) -> Tuple[pd.Series, pd.Series, pd.Series, pd.Series]:
+    # daily values from sub-daily inputs, days with missing time steps are NaN
+    step = (precip.index[1:] - precip.index[:-1]).min()
+    steps_per_day = pd.Timedelta(days=1) // step
+    df = pd.DataFrame({'prcp': precip, 'tmax': tmax, 'tmin': tmin, 'pet': pet})
+    resampler = df.resample('1D')
+    daily = pd.concat([resampler['prcp'].sum(), resampler['tmax'].max(), resampler['tmin'].min(),
+                       resampler['pet'].sum()],
+                      axis=1)
+    daily[resampler.count() < steps_per_day] = np.nan
+    return daily['prcp'], daily['tmax'], daily['tmin'], daily['pet']
+
+
+def calculate_rolling_quantiles(series: pd.Series, window_length: int, quantiles: List[float]) -> pd.DataFrame:
+    """Calculate rolling quantiles of a time series, e.g. of precipitation, temperature or discharge.
+
+    The values of the window are kept in a sliding order-statistics structure (a Fenwick tree over the ranks of the
+    values), so each step costs O(log n) instead of sorting every window. Quantiles are linearly interpolated between
+    the two closest values, which is the same definition as in ``series.rolling(window_length).quantile(q)``.
+
+    Parameters
+    ----------
+    series : pd.Series
+        Time-indexed series.
+    window_length : int
+        Look-back period of the quantiles.
+    quantiles : List[float]
+        Quantiles in [0, 1].
+
+    Returns
+    -------
+    pd.DataFrame
+        Time-indexed DataFrame with one column per quantile, named e.g. 'q95' for 0.95. The quantile for a given day is
+        computed from the `window_length` previous time steps (including the given day). The first
+        `window_length - 1` time steps and all windows that contain a NaN are NaN.
+
+    Raises
+    ------
+    ValueError
+        If any quantile is outside of [0, 1].
+    """
+    quantiles = _check_quantiles(quantiles)
+    new_features = _numba_rolling_quantiles(series.values.astype(np.float64), window_length, quantiles)
+    return pd.DataFrame(new_features, columns=[f"q{100 * q:g}" for q in quantiles], index=series.index)
+
+
+def _rolling_quantiles_at(series: pd.Series, window_length: int, quantiles: List[float],
+                          anchors: np.ndarray) -> pd.DataFrame:
+    # `calculate_rolling_quantiles` of the windows that end at the anchor positions only
+    quantiles = _check_quantiles(quantiles)
+    new_features = _numba_rolling_quantiles_at(series.values.astype(np.float64), window_length, quantiles, anchors)
+    return pd.DataFrame(new_features, columns=[f"q{100 * q:g}" for q in quantiles], index=series.index[anchors])
+
+
+def _check_quantiles(quantiles: List[float]) -> np.ndarray:
+    quantiles = np.array(quantiles, dtype=np.float64)
+    if np.any((quantiles < 0) | (quantiles > 1)):
+        raise ValueError(f"Quantiles must be in [0, 1], got {quantiles}")
+    return quantiles
+
+
+def calculate_dyn_signatures(discharge: pd.Series,
+                             precip: pd.Series,
+                             window_length: int,
+                             min_valid_fraction: float = 0.8) -> pd.DataFrame:
+    """Calculate dynamic hydrological signatures.
+
+    The signatures follow the definitions of the static CAMELS signatures by [#]_, but are re-computed for each time
+    step from the last `window_length` time steps in a single streaming pass:
+
+    - q_mean_dyn: mean daily discharge
+    - runoff_ratio_dyn: mean discharge divided by mean precipitation
+    - baseflow_index_dyn: baseflow divided by total discharge, where the baseflow is separated by one forward pass of
+      the recursive Lyne-Hollick filter (alpha = `BASEFLOW_ALPHA`) over the whole series. The filter restarts after
+      gaps in the discharge.
+    - stream_elas_dyn: streamflow elasticity, estimated from the daily values as cov(P, Q) / var(P) * mean(P) / mean(Q)
+    - high_q_freq_dyn / high_q_dur_dyn: frequency and mean duration of days with discharge > `HIGH_Q_FACTOR` times the
+      median discharge
+    - low_q_freq_dyn / low_q_dur_dyn: frequency and mean duration of days with discharge < `LOW_Q_FACTOR` times the
+      mean discharge
+
+    Days with missing discharge (or precipitation) are left out of all signatures and interrupt high and low flow
+    spells. Durations are 0 if there is no high or low flow day in a window.
+
+    Parameters
+    ----------
+    discharge : pd.Series
+        Time-indexed series of discharge (mm/day), may contain NaNs.
+    precip : pd.Series
+        Time-indexed series of precipitation (mm/day) with the same index as `discharge`.
+    window_length : int
+        Look-back period to use to compute the signatures.
+    min_valid_fraction : float, optional
+        Minimum fraction of days with valid discharge per window. Windows with fewer valid days are NaN. Default: 0.8.
+
+    Returns
+    -------
+    pd.DataFrame
+        Time-indexed DataFrame with one column per entry of `SIGNATURES`. The signatures for a given day are computed
+        from the `window_length` previous time steps (including the given day), the first `window_length - 1` time
+        steps are NaN.
+
+    References
+    ----------
+    .. [#] Addor, N., Newman, A. J., Mizukami, N. and Clark, M. P.: The CAMELS data set: catchment attributes and 
+        meteorology for large-sample studies, Hydrol. Earth Syst. Sci., 21, 5293-5313, doi:10.5194/hess-21-5293-2017,
+        2017.
+    """
+    if not discharge.index.equals(precip.index):
+        raise ValueError("discharge and precip must have the same index.")
+
+    new_features = _numba_signatures_sliding(discharge.values.astype(np.float64),
+                                             precip.values.astype(np.float64),
+                                             window_length=window_length,
+                                             min_valid_fraction=min_valid_fraction)
+    return pd.DataFrame(new_features, columns=SIGNATURES, index=discharge.index)
+
+
+def _get_index_columns(high_prec_thresholds: List[float],
+                       low_prec_thresholds: List[float],
+                       quantiles: Dict[str, List[float]] = None,
+                       indices: List[str] = None) -> List[str]:
+    # names of the climate index columns, the fixed-threshold precipitation indices are replaced by one pair of
+    # frequency and duration columns per swept threshold
+    replaced = []
+    if high_prec_thresholds is not None:
+        replaced += CLIMATE_INDICES[5:7]
+    if low_prec_thresholds is not None:
+        replaced += CLIMATE_INDICES[7:]
+    columns = [column for column in (CLIMATE_INDICES if indices is None else indices) if column not in replaced]
+    columns = columns + _get_sweep_columns(high_prec_thresholds, low_prec_thresholds)
+    if quantiles is not None:
+        columns = columns + [f"{var}_q{100 * q:g}_dyn" for var, qs in quantiles.items() for q in qs]
+    return columns
+
+
+def _get_sweep_columns(high_prec_thresholds: List[float], low_prec_thresholds: List[float]) -> List[str]:
+    columns = []
+    for kind, thresholds in [('high', high_prec_thresholds), ('low', low_prec_thresholds)]:
+        for threshold in thresholds if thresholds is not None else []:
+            columns += [f"{kind}_prec_freq_dyn_{threshold:g}", f"{kind}_prec_dur_dyn_{threshold:g}"]
+    return columns
+
+
+def calculate_dyn_climate_indices_batch(features: np.ndarray,
+                                        window_length: int,
+                                        indices: List[str] = None) -> np.ndarray:
+    """Calculate dynamic climate indices for a batch of basins (or scenarios) at once.
+
+    Array-level counterpart of `calculate_dyn_climate_indices` without any pandas overhead. The basins are processed in
+    parallel by a numba kernel.
+
+    Parameters
+    ----------
+    features : np.ndarray
+        Array of shape (#basins, #timesteps, 4), where the last dimension contains (prcp, tmax, tmin, pet) and all
+        basins share the same time steps. float32 inputs are used as is, without conversion.
+    window_length : int
+        Look-back period to use to compute the climate indices.
+    indices : List[str], optional
+        Names of the climate indices to compute (default: `CLIMATE_INDICES`), see `calculate_dyn_climate_indices`.
+
+    Returns
+    -------
+    np.ndarray
+        Array of shape (#basins, #timesteps, #indices) with the same dtype as `features`, containing the climate indices
+        in the order of `indices`. The first `window_length - 1` time steps of each basin are NaN.
+
+    Raises
+    ------
+    ValueError
+        If `features` does not have the shape (#basins, #timesteps, 4) or `indices` contains an unknown index.
+    """
+    if features.ndim != 3 or features.shape[2] != 4:
+        raise ValueError(f"Expected features of shape (#basins, #timesteps, 4), got {features.shape}")
+
+    batch_kernel = _get_batch_kernel(_get_accumulators(CLIMATE_INDICES if indices is None else list(indices)))
+    return batch_kernel(np.ascontiguousarray(features), window_length)
+
+
+def register_climate_index(name: str,
+                           init: Callable,
+                           add: Callable,
+                           remove: Callable,
+                           value: Callable,
+                           output: int = None):
+    """Register a climate index that can be selected by name with the `indices` argument.
+
+    A climate index is declared as an accumulator of four numba functions (decorated with `numba.njit`). The
+    accumulators of all selected indices are fused into a single kernel, which slides over the series once and calls
+    the steps of all accumulators for each time step. Adding an index therefore neither needs another pass over the
+    series nor changes to the existing kernels. The built-in indices of `CLIMATE_INDICES` and the indices of the
+    precipitation threshold sweeps are accumulators as well, and all climate indices are computed by these fused
+    kernels, including the evaluation at single dates, the batch and the gridded computation.
+
+    Indices that are registered with the same `init`, `add` and `remove` functions share one state in the fused
+    kernel, and indices that additionally share the `value` function share one query per window. E.g., all mean-type
+    built-in indices share one set of prefix sums, and the high precipitation frequency and duration share one set of
+    Fenwick trees and one threshold query, which returns both values.
+
+    Parameters
+    ----------
+    name : str
+        Name of the climate index, used as column name. Registering an existing name replaces its accumulator. Cached
+        climate indices are keyed by the name only, so use a new name when changing the definition of an index.
+    init : Callable
+        `init(features) -> state`, called once per series. `features` is the array of shape (#timesteps, 4) with
+        (prcp, tmax, tmin, pet) per time step. The state can be any numba type that is updated in place, e.g. an array
+        or a tuple of arrays. Precomputed prefix sums are a good state for sums and means, as they keep all-zero windows
+        exactly zero.
+    add : Callable
+        `add(state, features, t)`, called when time step t enters the window.
+    remove : Callable
+        `remove(state, features, t)`, called when time step t leaves the window, after the next time step was added.
+    value : Callable
+        `value(state, features, start, end) -> float`, returns the climate index of the window [start, end). If
+        `output` is passed, `value` returns a tuple of floats and the climate index is its `output`-th element.
+    output : int, optional
+        Position of the climate index in the tuple returned by `value`, for value functions shared by several indices.
+    """
+    INDEX_ACCUMULATORS[name] = (init, add, remove, value, output)
+    _FUSED_KERNELS.clear()
+    _BATCH_KERNELS.clear()
+
+
+def _get_accumulators(columns: List[str],
+                      high_prec_thresholds: List[float] = None,
+                      low_prec_thresholds: List[float] = None) -> Tuple[Tuple]:
+    # accumulators of the index columns, the columns of the swept thresholds get the accumulators of their threshold
+    sweeps = {}
+    for factor in high_prec_thresholds if high_prec_thresholds is not None else []:
+        value = _get_high_prec_value(float(factor))
+        for output, kind in enumerate(['freq', 'dur']):
+            sweeps[f"high_prec_{kind}_dyn_{factor:g}"] = (_init_high_prec, _add_high_prec_day, _remove_high_prec_day,
+                                                          value, output)
+    for threshold in low_prec_thresholds if low_prec_thresholds is not None else []:
+        for output, kind in enumerate(['freq', 'dur']):
+            sweeps[f"low_prec_{kind}_dyn_{threshold:g}"] = (*_get_low_prec_accumulator(float(threshold)), output)
+
+    unknown = [column for column in columns if column not in sweeps and column not in INDEX_ACCUMULATORS]
+    if unknown:
+        raise ValueError(f"Unknown climate indices {unknown}. Use any of {list(INDEX_ACCUMULATORS.keys())}.")
+    return tuple(sweeps[column] if column in sweeps else INDEX_ACCUMULATORS[column] for column in columns)
+
+
+def _get_fused_kernel(accumulators: Tuple[Tuple]) -> Callable:
+    # composes (and compiles on first call) a kernel that computes all accumulators in one slide over the series,
+    # accumulators with the same (init, add, remove) functions share their state, and accumulators with the same state
+    # and value function share their query
+    if accumulators not in _FUSED_KERNELS:
+        groups = {}
+        for column, (init, add, remove, value, output) in enumerate(accumulators):
+            groups.setdefault((init, add, remove), {}).setdefault(value, []).append((output, column))
+        parts = []
+        for (init, add, remove), queries in groups.items():
+            stores = {value: functools.reduce(_chain_stores, [_make_store(*output) for output in outputs])
+                      for value, outputs in queries.items()}
+            (value, store), *others = stores.items()
+            write = functools.reduce(_chain_writes, [_make_write(*other) for other in others]) if others else _no_write
+            parts.append((init, _make_advance(add, remove, value, store, write)))
+        _FUSED_KERNELS[accumulators] = _make_fused_kernel(functools.reduce(_combine_parts, parts))
+    return _FUSED_KERNELS[accumulators]
+
+
+def _get_batch_kernel(accumulators: Tuple[Tuple]) -> Callable:
+    # parallel kernel over a batch of series, each series is computed by the fused kernel of the accumulators
+    if accumulators not in _BATCH_KERNELS:
+        _BATCH_KERNELS[accumulators] = _make_batch_kernel(_get_fused_kernel(accumulators), len(accumulators))
+    return _BATCH_KERNELS[accumulators]
+
+
+def _run_fused_kernel(accumulators: Tuple[Tuple], features: np.ndarray, window_length: int,
+                      anchors: np.ndarray) -> np.ndarray:
+    # the kernel slides over the series once and therefore needs sorted anchors, the result is in the order of `anchors`
+    order = np.argsort(anchors, kind='stable')
+    result = np.full((len(anchors), len(accumulators)), np.nan)
+    _get_fused_kernel(accumulators)(features, window_length, anchors[order].astype(np.int64), result)
+    new_features = np.empty_like(result)
+    new_features[order] = result
+    return new_features
+
+
+# The kernels are composed of small closures, the positions and columns are constants of the closures. Each state
+# advances in a loop of its own, which gets the state as an argument and calls the first query of the state directly:
+# taking the state from the tuple of all states, or passing it on to another function, in every time step would cost
+# about as much as the query of a cheap index.
+def _make_store(position: int, column: int) -> Callable:
+    # stores the `position`-th element of the result of a query (or the result, if position is None) in row k and
+    # column `column` of `out`
+    if position is None:
+
+        @njit(nogil=True)
+        def store(result, out, k):
+            out[k, column] = result
+    else:
+
+        @njit(nogil=True)
+        def store(result, out, k):
+            out[k, column] = result[position]
+
+    return store
+
+
+def _chain_stores(first: Callable, second: Callable) -> Callable:
+    # the indices of one query
+    @njit(nogil=True)
+    def store(result, out, k):
+        first(result, out, k)
+        second(result, out, k)
+
+    return store
+
+
+def _make_write(value: Callable, store: Callable) -> Callable:
+    # queries the window once and stores the result in the columns of its indices
+    @njit(nogil=True)
+    def write(state, features, start, end, out, k):
+        store(value(state, features, start, end), out, k)
+
+    return write
+
+
+@njit(nogil=True)
+def _no_write(state, features, start, end, out, k):
+    pass
+
+
+def _chain_writes(first: Callable, second: Callable) -> Callable:
+    # the further queries of one state
+    @njit(nogil=True)
+    def write(state, features, start, end, out, k):
+        first(state, features, start, end, out, k)
+        second(state, features, start, end, out, k)
+
+    return write
+
+
+def _make_advance(add: Callable, remove: Callable, value: Callable, store: Callable, write: Callable) -> Callable:
+    # slides the window of one state over the time steps [start, end) and writes the windows that end at the anchors
+    # from k on, returns the first anchor after the time steps. `value` and `store` are the first query of the state,
+    # `write` the others.
+    @njit(nogil=True)
+    def advance(state, features, window_length, anchors, k, start, end, out):
+        for t in range(start, end):
+            add(state, features, t)
+            if t >= window_length:
+                remove(state, features, t - window_length)
+            while k < len(anchors) and anchors[k] == t:
+                if t >= window_length - 1:
+                    store(value(state, features, t - window_length + 1, t + 1), out, k)
+                    write(state, features, t - window_length + 1, t + 1, out, k)
+                k += 1
+        return k
+
+    return advance
+
+
+def _combine_parts(first: Tuple[Callable, Callable], second: Tuple[Callable, Callable]) -> Tuple[Callable, Callable]:
+    # (init, advance) of two accumulators with separate states, the combined state is the tuple of both
+    init_first, advance_first = first
+    init_second, advance_second = second
+
+    @njit(nogil=True)
+    def init(features):
+        return init_first(features), init_second(features)
+
+    @njit(nogil=True)
+    def advance(state, features, window_length, anchors, k, start, end, out):
+        advance_first(state[0], features, window_length, anchors, k, start, end, out)
+        return advance_second(state[1], features, window_length, anchors, k, start, end, out)
+
+    return init, advance
+
+
+def _make_fused_kernel(accumulator: Tuple[Callable, Callable]) -> Callable:
+    init, advance = accumulator
+
+    @njit(nogil=True)
+    def fused_kernel(features, window_length, anchors, out):
+        # features shape is (#timesteps, 4), writes the indices of the windows that end at the sorted anchor positions
+        # (inclusive) into the rows of `out`, shape (#anchors, #indices), the rows of anchors without a complete window
+        # are not written. The series is traversed once in blocks of _BLOCK_SIZE time steps, all states advance over a
+        # block while it is in cache.
+        n_samples = features.shape[0]
+        window_length = min(n_samples, window_length)
+
+        state = init(features)
+        n_steps = anchors[-1] + 1 if len(anchors) > 0 else 0
+        k = 0
+        for start in range(0, n_steps, _BLOCK_SIZE):
+            k = advance(state, features, window_length, anchors, k, start, min(start + _BLOCK_SIZE, n_steps), out)
+
+    return fused_kernel
+
+
+def _make_batch_kernel(fused_kernel: Callable, n_indices: int) -> Callable:
+    @njit(nogil=True, parallel=True)
+    def batch_kernel(features, window_length):
+        # features shape is (#basins, #timesteps, 4), returns shape (#basins, #timesteps, n_indices), NaN for the first
+        # window_length - 1 steps
+        n_basins, n_samples = features.shape[0], features.shape[1]
+        anchors = np.arange(n_samples)
+        new_features = np.full((n_basins, n_samples, n_indices), np.nan, dtype=features.dtype)
+        for b in prange(n_basins):
+            fused_kernel(features[b], window_length, anchors, new_features[b])
+        return new_features
+
+    return batch_kernel
+
+
+@njit(nogil=True)
+def _value_ranks(x: np.ndarray):
+    # ranks of the (non-NaN) values, used to count values above a threshold or to find order statistics in O(log n)
+    values = np.unique(x[~np.isnan(x)])
+    ranks = np.searchsorted(values, x)
+    return values, ranks
+
+
+@njit(nogil=True)
+def _high_prec_from_trees(tree_values: np.ndarray, tree_pair_low: np.ndarray, tree_pair_high: np.ndarray,
+                          values: np.ndarray, prcp: np.ndarray, start: int, end: int, factor: float, p_mean: float):
+    # frequency and duration of days with precipitation >= factor * p_mean in the window [start, end)
+    threshold = factor * p_mean
+    rank = np.searchsorted(values, threshold)
+    if _is_tie(values, rank, threshold):
+        # a value (nearly) equals the threshold, resolve the comparison with the window mean of the reference
+        threshold = factor * np.mean(prcp[start:end])
+        rank = np.searchsorted(values, threshold)
+    n_high = (_fenwick_sum(tree_values, len(values)) - _fenwick_sum(tree_values, rank))
+    if n_high == 0:
+        return 0.0, 0.0
+    n_spells = _fenwick_sum(tree_pair_low, rank) - _fenwick_sum(tree_pair_high, rank)
+    if prcp[start] >= threshold:
+        n_spells += 1
+    return n_high / (end - start), n_high / n_spells
+
+
+@njit(nogil=True)
+def _prefix_sums(features: np.ndarray):
+    # cumulative sums of (prcp, tmax, tmin, pet, snow prcp), NaNs are counted separately and summed as zero
+    n_samples = features.shape[0]
+    sums = np.zeros((n_samples + 1, 5))
+    nan_counts = np.zeros((n_samples + 1, 4), dtype=np.int64)
+    for t in range(n_samples):
+        for j in range(4):
+            if np.isnan(features[t, j]):
+                sums[t + 1, j] = sums[t, j]
+                nan_counts[t + 1, j] = nan_counts[t, j] + 1
+            else:
+                sums[t + 1, j] = sums[t, j] + features[t, j]
+                nan_counts[t + 1, j] = nan_counts[t, j]
+        if (features[t, 1] + features[t, 2]) / 2 <= 0 and not np.isnan(features[t, 0]):
+            sums[t + 1, 4] = sums[t, 4] + features[t, 0]
+        else:
+            sums[t + 1, 4] = sums[t, 4]
+    return sums, nan_counts
+
+
+@njit(nogil=True)
+def _is_tie(values: np.ndarray, rank: int, threshold: float) -> bool:
+    tolerance = 1e-6 * max(1.0, abs(threshold))
+    if rank < len(values) and values[rank] - threshold <= tolerance:
+        return True
+    return rank > 0 and threshold - values[rank - 1] <= tolerance
+
+
+@njit(nogil=True)
+def _update_value(tree: np.ndarray, prcp: np.ndarray, ranks: np.ndarray, t: int, delta: int):
+    # add (delta=1) or remove (delta=-1) the precipitation of day t
+    if not np.isnan(prcp[t]):
+        _fenwick_add(tree, ranks[t], delta)
+
+
+@njit(nogil=True)
+def _update_pair(tree_low: np.ndarray, tree_high: np.ndarray, prcp: np.ndarray, ranks: np.ndarray, t: int, delta: int):
+    # add (delta=1) or remove (delta=-1) the pair of days (t - 1, t) if precipitation increases from t - 1 to t
+    if prcp[t - 1] < prcp[t]:
+        _fenwick_add(tree_low, ranks[t - 1], delta)
+        _fenwick_add(tree_high, ranks[t], delta)
+
+
+@njit(nogil=True)
+def _numba_rolling_quantiles(x: np.ndarray, window_length: int, quantiles: np.ndarray) -> np.ndarray:
+    # x shape is (#timesteps,), returns shape (#timesteps, #quantiles), NaN for the first window_length - 1 steps and
+    # for windows that contain NaNs
+    # The window is a Fenwick tree over the ranks of the values, the k-th smallest value is found by descending the
+    # tree.
+    n_samples = len(x)
+    window_length = min(n_samples, window_length)
+    new_features = np.full((n_samples, len(quantiles)), np.nan)
+
+    values, ranks = _value_ranks(x)
+    tree = np.zeros(len(values) + 1, dtype=np.int64)
+    n_nan = 0
+    for t in range(n_samples):
+        # day t enters the window, day t - window_length leaves it
+        if np.isnan(x[t]):
+            n_nan += 1
+        else:
+            _fenwick_add(tree, ranks[t], 1)
+        if t >= window_length:
+            if np.isnan(x[t - window_length]):
+                n_nan -= 1
+            else:
+                _fenwick_add(tree, ranks[t - window_length], -1)
+
+        if t < window_length - 1 or n_nan > 0:
+            continue
+        for j in range(len(quantiles)):
+            position = quantiles[j] * (window_length - 1)
+            k = int(np.floor(position))
+            low = values[_fenwick_kth(tree, k)]
+            if position > k:
+                high = values[_fenwick_kth(tree, k + 1)]
+                new_features[t, j] = low + (high - low) * (position - k)
+            else:
+                new_features[t, j] = low
+
+    return new_features
+
+
+@njit(nogil=True)
+def _numba_rolling_quantiles_at(x: np.ndarray, window_length: int, quantiles: np.ndarray,
+                                anchors: np.ndarray) -> np.ndarray:
+    # returns shape (#anchors, #quantiles) with the quantiles of `_numba_rolling_quantiles` for the windows that end at
+    # the anchor positions (inclusive), NaN for anchors without a complete window and for windows that contain NaNs
+    n_samples = len(x)
+    window_length = min(n_samples, window_length)
+    new_features = np.full((len(anchors), len(quantiles)), np.nan)
+
+    for i in range(len(anchors)):
+        start, end = anchors[i] + 1 - window_length, anchors[i] + 1
+        if start < 0 or np.isnan(x[start:end]).any():
+            continue
+        window = np.sort(x[start:end])
+        for j in range(len(quantiles)):
+            position = quantiles[j] * (window_length - 1)
+            k = int(np.floor(position))
+            low = window[k]
+            if position > k:
+                new_features[i, j] = low + (window[k + 1] - low) * (position - k)
+            else:
+                new_features[i, j] = low
+
+    return new_features
+
+
+@njit(nogil=True)
+def _fenwick_kth(tree: np.ndarray, k: int) -> int:
+    # rank of the k-th smallest element (0-based)
+    rank = 0
+    step = 1
+    while step * 2 < len(tree):
+        step *= 2
+    while step > 0:
+        if rank + step < len(tree) and tree[rank + step] <= k:
+            rank += step
+            k -= tree[rank]
+        step //= 2
+    return rank
+
+
+@njit(nogil=True)
+def _fenwick_add(tree: np.ndarray, rank: int, delta: int):
+    i = rank + 1
+    while i < len(tree):
+        tree[i] += delta
+        i += i & (-i)
+
+
+@njit(nogil=True)
+def _fenwick_sum(tree: np.ndarray, rank: int) -> int:
+    # number of elements with a rank smaller than `rank`
+    total = 0
+    i = rank
+    while i > 0:
+        total += tree[i]
+        i -= i & (-i)
+    return total
+
+
+@njit(nogil=True)
+def _numba_signatures_sliding(discharge: np.ndarray, prcp: np.ndarray, window_length: int,
+                              min_valid_fraction: float) -> np.ndarray:
+    # returns shape (#timesteps, 8) with the signatures in the order of SIGNATURES, NaN for the first window_length - 1
+    # steps and for windows with too few valid days
+    # Sums come from prefix sums over the valid days. The flow thresholds depend on the window (median and mean), so
+    # as for the high precipitation indices the discharge values and the rising and falling pairs of consecutive days
+    # are kept in Fenwick trees over the ranks of the values. Days after a gap start a spell without a pair.
+    n_samples = len(discharge)
+    window_length = min(n_samples, window_length)
+    new_features = np.full((n_samples, 8), np.nan)
+
+    q = discharge.copy()
+    q[np.isnan(prcp)] = np.nan
+    baseflow = _baseflow_filter(q)
+
+    # cumulative sums of (q, p, baseflow, p * q, p * p) and number of valid days
+    sums = np.zeros((n_samples + 1, 5))
+    valid_counts = np.zeros(n_samples + 1, dtype=np.int64)
+    for t in range(n_samples):
+        sums[t + 1] = sums[t]
+        valid_counts[t + 1] = valid_counts[t]
+        if not np.isnan(q[t]):
+            sums[t + 1, 0] += q[t]
+            sums[t + 1, 1] += prcp[t]
+            sums[t + 1, 2] += baseflow[t]
+            sums[t + 1, 3] += prcp[t] * q[t]
+            sums[t + 1, 4] += prcp[t] * prcp[t]
+            valid_counts[t + 1] += 1
+
+    values, ranks = _value_ranks(q)
+    tree_values = np.zeros(len(values) + 1, dtype=np.int64)
+    # pairs of consecutive days, stored with the rank of the smaller and of the larger value
+    tree_rise_low = np.zeros(len(values) + 1, dtype=np.int64)
+    tree_rise_high = np.zeros(len(values) + 1, dtype=np.int64)
+    tree_fall_low = np.zeros(len(values) + 1, dtype=np.int64)
+    tree_fall_high = np.zeros(len(values) + 1, dtype=np.int64)
+    tree_after_gap = np.zeros(len(values) + 1, dtype=np.int64)
+
+    for t in range(n_samples):
+        # day t enters the window, day t - window_length leaves it
+        _update_value(tree_values, q, ranks, t, 1)
+        if t > 0 and window_length > 1:
+            _update_flow_pair(tree_rise_low, tree_rise_high, tree_fall_low, tree_fall_high, tree_after_gap, q, ranks,
+                              t, 1)
+        if t >= window_length:
+            _update_value(tree_values, q, ranks, t - window_length, -1)
+            if window_length > 1:
+                _update_flow_pair(tree_rise_low, tree_rise_high, tree_fall_low, tree_fall_high, tree_after_gap, q,
+                                  ranks, t - window_length + 1, -1)
+
+        start, end = t - window_length + 1, t + 1
+        if start < 0:
+            continue
+        n_valid = valid_counts[end] - valid_counts[start]
+        if n_valid == 0 or n_valid < min_valid_fraction * window_length:
+            continue
+
+        out = new_features[t]
+        q_mean = (sums[end, 0] - sums[start, 0]) / n_valid
+        p_mean = (sums[end, 1] - sums[start, 1]) / n_valid
+        out[0] = q_mean
+        out[1] = q_mean / p_mean if p_mean > 0 else np.nan
+        out[2] = (sums[end, 2] - sums[start, 2]) / (sums[end, 0] - sums[start, 0]) if q_mean > 0 else np.nan
+        p_var = (sums[end, 4] - sums[start, 4]) / n_valid - p_mean * p_mean
+        pq_cov = (sums[end, 3] - sums[start, 3]) / n_valid - p_mean * q_mean
+        # the variance is a difference of prefix sums, so treat round-off of constant precipitation as zero variance
+        if p_var > 1e-10 * max(1.0, p_mean * p_mean) and q_mean > 0:
+            out[3] = pq_cov / p_var * p_mean / q_mean
+
+        # high flows: discharge > threshold, i.e. a rank of at least the number of values <= threshold
+        if n_valid % 2 == 1:
+            q_median = values[_fenwick_kth(tree_values, n_valid // 2)]
+        else:
+            q_median = (values[_fenwick_kth(tree_values, n_valid // 2 - 1)] +
+                        values[_fenwick_kth(tree_values, n_valid // 2)]) / 2
+        threshold = HIGH_Q_FACTOR * q_median
+        rank = np.searchsorted(values, threshold, side='right')
+        n_high = n_valid - _fenwick_sum(tree_values, rank)
+        n_spells = (_fenwick_sum(tree_rise_low, rank) - _fenwick_sum(tree_rise_high, rank) +
+                    _fenwick_sum(tree_after_gap, len(values)) - _fenwick_sum(tree_after_gap, rank) +
+                    (q[start] > threshold))
+        out[4] = n_high / n_valid
+        out[5] = n_high / n_spells if n_spells > 0 else 0.0
+
+        # low flows: discharge < threshold, i.e. a rank below the number of values < threshold
+        threshold = LOW_Q_FACTOR * q_mean
+        rank = np.searchsorted(values, threshold)
+        n_low = _fenwick_sum(tree_values, rank)
+        n_spells = (_fenwick_sum(tree_fall_low, rank) - _fenwick_sum(tree_fall_high, rank) +
+                    _fenwick_sum(tree_after_gap, rank) + (q[start] < threshold))
+        out[6] = n_low / n_valid
+        out[7] = n_low / n_spells if n_spells > 0 else 0.0
+
+    return new_features
+
+
+@njit(nogil=True)
+def _baseflow_filter(q: np.ndarray) -> np.ndarray:
+    # one forward pass of the Lyne-Hollick filter, the quickflow is reset to 0 at the start and after each gap
+    baseflow = np.full(len(q), np.nan)
+    quickflow = 0.0
+    for t in range(len(q)):
+        if np.isnan(q[t]):
+            continue
+        if t == 0 or np.isnan(q[t - 1]):
+            quickflow = 0.0
+        else:
+            quickflow = BASEFLOW_ALPHA * quickflow + (1 + BASEFLOW_ALPHA) / 2 * (q[t] - q[t - 1])
+            quickflow = min(max(quickflow, 0.0), q[t])
+        baseflow[t] = q[t] - quickflow
+    return baseflow
+
+
+@njit(nogil=True)
+def _update_flow_pair(tree_rise_low: np.ndarray, tree_rise_high: np.ndarray, tree_fall_low: np.ndarray,
+                      tree_fall_high: np.ndarray, tree_after_gap: np.ndarray, q: np.ndarray, ranks: np.ndarray, t: int,
+                      delta: int):
+    # add (delta=1) or remove (delta=-1) the pair of days (t - 1, t)
+    if np.isnan(q[t]):
+        return
+    if np.isnan(q[t - 1]):
+        _fenwick_add(tree_after_gap, ranks[t], delta)
+    elif q[t - 1] < q[t]:
+        _fenwick_add(tree_rise_low, ranks[t - 1], delta)
+        _fenwick_add(tree_rise_high, ranks[t], delta)
+    elif q[t - 1] > q[t]:
+        _fenwick_add(tree_fall_low, ranks[t], delta)
+        _fenwick_add(tree_fall_high, ranks[t - 1], delta)
+
+
+@njit(nogil=True)
+def _skip_day(state, features: np.ndarray, t: int):
+    # add and remove step of accumulators whose state is fully precomputed by their init step
+    pass
+
+
+@njit(nogil=True)
+def _window_mean(state, j: int, start: int, end: int) -> float:
+    # mean of feature j (see `_prefix_sums`) in the window [start, end), NaN if the window contains NaNs
+    sums, nan_counts = state[0], state[1]
+    if nan_counts[end, j] - nan_counts[start, j] > 0:
+        return np.nan
+    return (sums[end, j] - sums[start, j]) / (end - start)
+
+
+@njit(nogil=True)
+def _mean_indices_value(state, features: np.ndarray, start: int, end: int) -> Tuple[float, float, float, float, float]:
+    # p_mean, pet_mean, aridity, t_mean and frac_snow, shared by the mean-type indices
+    p_mean, pet_mean = _window_mean(state, 0, start, end), _window_mean(state, 3, start, end)
+    aridity = pet_mean / p_mean if p_mean > 0 else np.nan
+    t_mean = (_window_mean(state, 1, start, end) + _window_mean(state, 2, start, end)) / 2
+
+    # fraction of precipitation falling as snow
+    if np.isnan(p_mean):
+        frac_snow = np.nan
+    elif p_mean > 0:
+        sums = state[0]
+        frac_snow = (sums[end, 4] - sums[start, 4]) / (sums[end, 0] - sums[start, 0])
+    else:
+        frac_snow = 0.0
+    return p_mean, pet_mean, aridity, t_mean, frac_snow
+
+
+@njit(nogil=True)
+def _init_high_prec(features: np.ndarray):
+    # prefix sums of the precipitation for the window mean and Fenwick trees of the values and of the pairs of
+    # consecutive days (a, b) with a < b, a high precipitation spell starts at b if a < threshold <= b
+    n_samples = features.shape[0]
+    sums = np.zeros(n_samples + 1)
+    nan_counts = np.zeros(n_samples + 1, dtype=np.int64)
+    for t in range(n_samples):
+        is_nan = np.isnan(features[t, 0])
+        sums[t + 1] = sums[t] + (0.0 if is_nan else features[t, 0])
+        nan_counts[t + 1] = nan_counts[t] + is_nan
+    values, ranks = _value_ranks(features[:, 0])
+    trees = np.zeros((3, len(values) + 1), dtype=np.int64)
+    return sums, nan_counts, values, ranks, trees
+
+
+@njit(nogil=True)
+def _add_high_prec_day(state, features: np.ndarray, t: int):
+    ranks, trees = state[3], state[4]
+    _update_value(trees[0], features[:, 0], ranks, t, 1)
+    if t > 0:
+        _update_pair(trees[1], trees[2], features[:, 0], ranks, t, 1)
+
+
+@njit(nogil=True)
+def _remove_high_prec_day(state, features: np.ndarray, t: int):
+    # the pair (t, t + 1) leaves the window with day t
+    ranks, trees = state[3], state[4]
+    _update_value(trees[0], features[:, 0], ranks, t, -1)
+    _update_pair(trees[1], trees[2], features[:, 0], ranks, t + 1, -1)
+
+
+@functools.lru_cache(maxsize=None)
+def _get_high_prec_value(factor: float) -> Callable:
+    # value function of the high precipitation indices of one factor. All factors share the state of `_init_high_prec`,
+    # so the swept thresholds are answered from the same Fenwick trees as the default indices.
+    @njit(nogil=True)
+    def high_prec_value(state, features, start, end):
+        # frequency and duration of days with precipitation >= factor * p_mean, shared by both indices
+        sums, nan_counts, values, trees = state[0], state[1], state[2], state[4]
+        if nan_counts[end] - nan_counts[start] > 0:
+            return np.nan, np.nan
+        p_mean = (sums[end] - sums[start]) / (end - start)
+        return _high_prec_from_trees(trees[0], trees[1], trees[2], values, features[:, 0], start, end, factor, p_mean)
+
+    return high_prec_value
+
+
+@njit(nogil=True)
+def _init_dry_days(features: np.ndarray) -> np.ndarray:
+    # number of dry days, of dry spells starting in the window (a spell cut by the window start is not included) and of
+    # days with missing precipitation, which are neither dry nor wet
+    return np.zeros(3)
+
+
+@njit(nogil=True)
+def _dry_day(features: np.ndarray, t: int, threshold: float) -> Tuple[float, float]:
+    dry = features[t, 0] < threshold
+    spell_start = dry and (t == 0 or not features[t - 1, 0] < threshold)
+    return 1.0 if dry else 0.0, 1.0 if spell_start else 0.0
+
+
+@njit(nogil=True)
+def _update_dry_days(state: np.ndarray, features: np.ndarray, t: int, threshold: float, delta: float):
+    # add (delta=1) or remove (delta=-1) day t
+    dry, spell_start = _dry_day(features, t, threshold)
+    state[0] += delta * dry
+    state[1] += delta * spell_start
+    if np.isnan(features[t, 0]):
+        state[2] += delta
+
+
+@functools.lru_cache(maxsize=None)
+def _get_low_prec_accumulator(threshold: float) -> Tuple[Callable, Callable, Callable, Callable]:
+    # init, add, remove and value function of the low precipitation indices of one threshold, the same threshold
+    # always returns the same functions, so its indices share one state in the fused kernels
+    @njit(nogil=True)
+    def add_dry_day(state, features, t):
+        _update_dry_days(state, features, t, threshold, 1.0)
+
+    @njit(nogil=True)
+    def remove_dry_day(state, features, t):
+        _update_dry_days(state, features, t, threshold, -1.0)
+
+    @njit(nogil=True)
+    def low_prec_value(state, features, start, end):
+        # frequency and duration of days with precipitation < threshold, shared by both indices
+        if state[2] > 0:
+            return np.nan, np.nan
+        if state[0] == 0:
+            return 0.0, np.nan
+        # a spell that is cut by the window start starts at the first day of the window
+        dry, spell_start = _dry_day(features, start, threshold)
+        return state[0] / (end - start), state[0] / (state[1] - spell_start + dry)
+
+    return _init_dry_days, add_dry_day, remove_dry_day, low_prec_value
+
+
+@njit(nogil=True)
 def _numba_climate_indexes(features: np.ndarray, window_length: int) -> np.ndarray:
     # features shape is (#timesteps, 4), where 4 breaks down into: (prcp, tmax, tmin, pet)
+    # Reference implementation that recomputes every window from scratch, O(#timesteps * window_length). It is not
+    # used by the entry points, which all run the fused kernels of the registered accumulators.
     n_samples = features.shape[0]
     window_length = min(n_samples, window_length)
     new_features = np.zeros((n_samples - window_length + 1, 9))
@@ -182,8 +2032,12 @@ def _numba_climate_indexes(features: np.ndarray, window_length: int) -> np.ndarr
         low_prec_freq = np.sum(x[:, 0] < 1) / x.shape[0]
 
         idx = np.where(x[:, 0] < 1)[0]
-        groups = _split_list(idx)
-        low_prec_dur = np.mean(np.array([len(p) for p in groups]))
+        if len(idx) == 0:
+            # no dry spell to average over
+            low_prec_dur = np.nan
+        else:
+            groups = _split_list(idx)
+            low_prec_dur = np.mean(np.array([len(p) for p in groups]))
 
         idx = np.where(x[:, 0] >= 5 * p_mean)[0]
         if len(idx) == 0:
@@ -202,10 +2056,15 @@ def _numba_climate_indexes(features: np.ndarray, window_length: int) -> np.ndarr
         new_features[i, 7] = low_prec_freq
         new_features[i, 8] = low_prec_dur
 
+        # a day with missing precipitation is neither dry nor wet, all precipitation indices of the window are NaN
+        if np.isnan(x[:, 0]).any():
+            for j in [0, 2, 4, 5, 6, 7, 8]:
+                new_features[i, j] = np.nan
+
     return new_features
 
 
-@njit
+@njit(nogil=True)
 def _split_list(a_list: List) -> List:
     new_list = []
     start = 0
@@ -218,3 +2077,17 @@ def _split_list(a_list: List) -> List:
         else:
             new_list.append(a_list[start:len(a_list)])
     return new_list
+
+
+for _name, _accumulator in zip(CLIMATE_INDICES, [
+    (_prefix_sums, _skip_day, _skip_day, _mean_indices_value, 0),
+    (_prefix_sums, _skip_day, _skip_day, _mean_indices_value, 1),
+    (_prefix_sums, _skip_day, _skip_day, _mean_indices_value, 2),
+    (_prefix_sums, _skip_day, _skip_day, _mean_indices_value, 3),
+    (_prefix_sums, _skip_day, _skip_day, _mean_indices_value, 4),
+    (_init_high_prec, _add_high_prec_day, _remove_high_prec_day, _get_high_prec_value(float(HIGH_PREC_FACTOR)), 0),
+    (_init_high_prec, _add_high_prec_day, _remove_high_prec_day, _get_high_prec_value(float(HIGH_PREC_FACTOR)), 1),
+    (*_get_low_prec_accumulator(float(LOW_PREC_THRESHOLD)), 0),
+    (*_get_low_prec_accumulator(float(LOW_PREC_THRESHOLD)), 1),
+]):
+    register_climate_index(_name, *_accumulator)
@@ -258,6 +258,10 @@ class Config(object):
     def custom_normalization(self) -> dict:
         return self._as_default_dict(self._cfg.get("custom_normalization", {}))
 
+    @property
+    def data_cache_dir(self) -> Path:
+        return self._cfg.get("data_cache_dir", None)
+
     @property
     def data_dir(self) -> Path:
         return self._get_value_verbose("data_dir")
@@ -266,6 +270,10 @@ class Config(object):
     def dataset(self) -> str:
         return self._get_value_verbose("dataset")
 
+    @property
+    def derived_features_dir(self) -> Path:
+        return self._cfg.get("derived_features_dir", None)
+
     @property
     def device(self) -> str:
         return self._cfg.get("device", None)
@@ -44,10 +44,12 @@ import pandas as pd
 from scipy import stats, signal
 from xarray.core.dataarray import DataArray
 
+from functions.camelsfiles import lookup_camels_us_file, read_camels_us_discharge_file, read_camels_us_forcing_file
 
 
 
-def load_forcings(data_dir: Path, basin: str, forcings: str) -> Tuple[pd.DataFrame, int]:
+
+def load_forcings(data_dir: Path, basin: str, forcings: str, cache_dir: Path = None) -> Tuple[pd.DataFrame, int]:
     """Load the forcing data for a basin of the CAMELS US data set.
 
     Parameters
@@ -61,6 +63,8 @@ def load_forcings(data_dir: Path, basin: str, forcings: str) -> Tuple[pd.DataFra
         8-digit USGS identifier of the basin.
     forcings : str
         Can be e.g. 'daymet' or 'nldas', etc. Must match the folder names in the 'basin_mean_forcing' directory. 
+    cache_dir : Path, optional
+        Directory to cache the parsed forcing file in, see `functions.camelsfiles.read_camels_us_forcing_file`.
 
     Returns
     -------
@@ -69,31 +73,33 @@ def load_forcings(data_dir: Path, basin: str, forcings: str) -> Tuple[pd.DataFra
     int
         Catchment area (m2), specified in the header of the forcing file.
     """
-    forcing_path = data_dir / 'basin_mean_forcing' / forcings
-    if not forcing_path.is_dir():
-        raise OSError(f"{forcing_path} does not exist")
-
-    file_path = list(forcing_path.glob(f'**/{basin}_*_forcing_leap.txt'))
-    if file_path:
-        file_path = file_path[0]
-    else:
-        raise FileNotFoundError(f'No file for Basin {basin} at {file_path}')
-
-    with open(file_path, 'r') as fp:
-        # load area from header
-        fp.readline()
-        fp.readline()
-        area = int(fp.readline())
-        # load the dataframe from the rest of the stream
-        df = pd.read_csv(fp, sep='\s+')
-        df["date"] = pd.to_datetime(df.Year.map(str) + "/" + df.Mnth.map(str) + "/" + df.Day.map(str),
-                                    format="%Y/%m/%d")
-        df = df.set_index("date")
-
-    return df, area
+    file_path = lookup_camels_us_file(data_dir, basin, forcings, cache_dir=cache_dir)['file']
+    return read_camels_us_forcing_file(file_path, cache_dir=cache_dir)
 
 ######################
-def load_usgs(data_dir: Path, basin: str, area: int) -> pd.Series:
+def load_area(data_dir: Path, basin: str, forcings: str, cache_dir: Path = None) -> int:
+    """Load the catchment area of a basin from the header of its forcing file, without parsing the forcing data.
+
+    Parameters
+    ----------
+    data_dir : Path
+        Path to the CAMELS US directory.
+    basin : str
+        8-digit USGS identifier of the basin.
+    forcings : str
+        Can be e.g. 'daymet' or 'nldas', etc. Must match the folder names in the 'basin_mean_forcing' directory.
+    cache_dir : Path, optional
+        Directory to cache the file manifest in, see `functions.camelsfiles.get_camels_us_manifest`.
+
+    Returns
+    -------
+    int
+        Catchment area (m2), specified in the header of the forcing file.
+    """
+    return lookup_camels_us_file(data_dir, basin, forcings, cache_dir=cache_dir)['area']
+
+######################
+def load_usgs(data_dir: Path, basin: str, area: int, cache_dir: Path = None) -> pd.Series:
     """Load the discharge data for a basin of the CAMELS US data set.
 
     Parameters
@@ -106,29 +112,19 @@ def load_usgs(data_dir: Path, basin: str, area: int) -> pd.Series:
         8-digit USGS identifier of the basin.
     area : int
         Catchment area (m2), used to normalize the discharge.
+    cache_dir : Path, optional
+        Directory to cache the parsed discharge file in, see `functions.camelsfiles.read_camels_us_forcing_file`.
 
     Returns
     -------
     pd.Series
         Time-index pandas.Series of the discharge values (mm/day)
     """
-
-    discharge_path = data_dir / 'usgs_streamflow'
-    file_path = list(discharge_path.glob(f'**/{basin}_streamflow_qc.txt'))
-    if file_path:
-        file_path = file_path[0]
-    else:
-        raise FileNotFoundError(f'No file for Basin {basin} at {file_path}')
-
-    col_names = ['basin', 'Year', 'Mnth', 'Day', 'QObs', 'flag']
-    df = pd.read_csv(file_path, sep='\s+', header=None, names=col_names)
-    df["date"] = pd.to_datetime(df.Year.map(str) + "/" + df.Mnth.map(str) + "/" + df.Day.map(str), format="%Y/%m/%d")
-    df = df.set_index("date")
+    file_path = lookup_camels_us_file(data_dir, basin, cache_dir=cache_dir)['file']
+    discharge = read_camels_us_discharge_file(file_path, cache_dir=cache_dir)
 
     # normalize discharge from cubic feet per second to mm per day
-    df.QObs = 28316846.592 * df.QObs * 86400 / (area * 10**6)
-
-    return df.QObs
+    return 28316846.592 * discharge * 86400 / (area * 10**6)
 
 def nse(obs: DataArray, sim: DataArray) -> float:
     r"""Calculate Nash-Sutcliffe Efficiency [#]_
@@ -1,8 +1,15 @@
+from pathlib import Path
+
 import numpy as np
-from numba import njit
+from numba import njit, prange
+
+from functions.utils import atomic_write
 
+# clear sky radiation tables per (lat, elev), see `get_clear_sky_rad_table`
+_CLEAR_SKY_RAD_TABLES = {}
 
-@njit
+
+@njit(nogil=True)
 def get_priestley_taylor_pet(t_min: np.ndarray, t_max: np.ndarray, s_rad: np.ndarray, lat: float, elev: float,
                              doy: np.ndarray) -> np.ndarray:
     """Calculate potential evapotranspiration (PET) as an approximation following the Priestley-Taylor equation.
@@ -40,8 +47,65 @@ def get_priestley_taylor_pet(t_min: np.ndarray, t_max: np.ndarray, s_rad: np.nda
     .. [#] Allen, R. G., Pereira, L. S., Raes, D., & Smith, M. (1998). Crop evapotranspiration-Guidelines for computing 
         crop water requirements-FAO Irrigation and drainage paper 56. Fao, Rome, 300(9), D05109.
     """
+    cs_rad = get_clear_sky_rad(lat, elev, doy)
+    return get_priestley_taylor_pet_from_clear_sky_rad(t_min, t_max, s_rad, elev, cs_rad)
+
+
+@njit(nogil=True)
+def get_clear_sky_rad(lat: float, elev: float, doy: np.ndarray) -> np.ndarray:
+    """Calculate the clear sky radiation, which only depends on the location and the day of the year.
+
+    Can be computed once per location and shared by all forcing products, see
+    `get_priestley_taylor_pet_from_clear_sky_rad`.
+
+    Parameters
+    ----------
+    lat : float
+        Latitude in degree
+    elev : float
+        Elevation in m
+    doy : np.ndarray
+        Day of the year
+
+    Returns
+    -------
+    np.ndarray
+        Clear sky radiation MJm-2day-1
+    """
     lat = lat * (np.pi / 180)  # degree to rad
 
+    sol_dec = _get_sol_decl(doy)
+    sha = _get_sunset_hour_angle(lat, sol_dec)
+    ird = _get_ird_earth_sun(doy)
+    et_rad = _get_extraterra_rad(lat, sol_dec, sha, ird)
+    return _get_clear_sky_rad(elev, et_rad)
+
+
+@njit(nogil=True)
+def get_priestley_taylor_pet_from_clear_sky_rad(t_min: np.ndarray, t_max: np.ndarray, s_rad: np.ndarray, elev: float,
+                                                cs_rad: np.ndarray) -> np.ndarray:
+    """Calculate potential evapotranspiration (PET) following the Priestley-Taylor equation from clear sky radiation.
+
+    Same as `get_priestley_taylor_pet`, but with the clear sky radiation of `get_clear_sky_rad` as input.
+
+    Parameters
+    ----------
+    t_min : np.ndarray
+        Daily min temperature (degree C)
+    t_max : np.ndarray
+        Daily max temperature (degree C)
+    s_rad : np.ndarray
+        Solar radiation (Wm-2)
+    elev : float
+        Elevation in m
+    cs_rad : np.ndarray
+        Clear sky radiation MJm-2day-1
+
+    Returns
+    -------
+    np.ndarray
+        Array containing PET estimates in mm/day
+    """
     # Slope of saturation vapour pressure curve
     t_mean = 0.5 * (t_min + t_max)
     slope_svp = _get_slope_svp_curve(t_mean)
@@ -51,11 +115,6 @@ def get_priestley_taylor_pet(t_min: np.ndarray, t_max: np.ndarray, s_rad: np.nda
     in_sw_rad = _get_net_sw_srad(s_rad)
 
     # outgoginng netto long-wave radiation
-    sol_dec = _get_sol_decl(doy)
-    sha = _get_sunset_hour_angle(lat, sol_dec)
-    ird = _get_ird_earth_sun(doy)
-    et_rad = _get_extraterra_rad(lat, sol_dec, sha, ird)
-    cs_rad = _get_clear_sky_rad(elev, et_rad)
     a_vp = _get_avp_tmin(t_min)
     out_lw_rad = _get_net_outgoing_lw_rad(t_min, t_max, s_rad, cs_rad, a_vp)
 
@@ -77,7 +136,326 @@ def get_priestley_taylor_pet(t_min: np.ndarray, t_max: np.ndarray, s_rad: np.nda
     return pet
 
 
-@njit
+def get_clear_sky_rad_table(lat: float, elev: float, cache_dir: Path = None) -> np.ndarray:
+    """Get the clear sky radiation of a location for each day of the year.
+
+    The clear sky radiation (with solar declination, sunset hour angle, inverse Earth-Sun distance and extraterrestrial
+    radiation) only depends on the location and the day of the year. The table is computed once per location and kept in
+    memory for the lifetime of the process, and optionally stored in `cache_dir` to be shared between processes and
+    runs.
+
+    Parameters
+    ----------
+    lat : float
+        Latitude in degree
+    elev : float
+        Elevation in m
+    cache_dir : Path, optional
+        If passed, the table is loaded from (or stored to) this directory.
+
+    Returns
+    -------
+    np.ndarray
+        Read-only array of length 366 with the clear sky radiation (MJm-2day-1) of the days of the year 1 to 366, i.e.
+        the clear sky radiation of day of the year `doy` is at index `doy - 1`.
+    """
+    key = (float(lat), float(elev))
+    if key not in _CLEAR_SKY_RAD_TABLES:
+        table = None
+        if cache_dir is not None:
+            table_file = Path(cache_dir) / f"clear_sky_rad_{key[0]!r}_{key[1]!r}.npy"
+            if table_file.is_file():
+                table = np.load(table_file)
+        if table is None:
+            table = get_clear_sky_rad(key[0], key[1], np.arange(1, 367))
+            if cache_dir is not None:
+                atomic_write(table_file, lambda fp: np.save(fp, table))
+        table.flags.writeable = False
+        _CLEAR_SKY_RAD_TABLES[key] = table
+    return _CLEAR_SKY_RAD_TABLES[key]
+
+
+def get_priestley_taylor_pet_cached(t_min: np.ndarray, t_max: np.ndarray, s_rad: np.ndarray, lat: float, elev: float,
+                                    doy: np.ndarray, cache_dir: Path = None) -> np.ndarray:
+    """Calculate potential evapotranspiration (PET) following the Priestley-Taylor equation with cached solar geometry.
+
+    Same as `get_priestley_taylor_pet`, but the clear sky radiation is looked up from the table of
+    `get_clear_sky_rad_table`, so only the temperature and radiation terms are computed per day. Useful whenever the PET
+    of the same location is computed repeatedly, e.g. for several forcing products or runs.
+
+    Parameters
+    ----------
+    t_min : np.ndarray
+        Daily min temperature (degree C)
+    t_max : np.ndarray
+        Daily max temperature (degree C)
+    s_rad : np.ndarray
+        Solar radiation (Wm-2)
+    lat : float
+        Latitude in degree
+    elev : float
+        Elevation in m
+    doy : np.ndarray
+        Day of the year
+    cache_dir : Path, optional
+        Directory to store the clear sky radiation table in, see `get_clear_sky_rad_table`.
+
+    Returns
+    -------
+    np.ndarray
+        Array containing PET estimates in mm/day
+    """
+    cs_rad_table = get_clear_sky_rad_table(lat, elev, cache_dir=cache_dir)
+    return get_priestley_taylor_pet_from_table(t_min, t_max, s_rad, float(elev), doy, cs_rad_table)
+
+
+@njit(nogil=True)
+def get_priestley_taylor_pet_from_table(t_min: np.ndarray, t_max: np.ndarray, s_rad: np.ndarray, elev: float,
+                                        doy: np.ndarray, cs_rad_table: np.ndarray) -> np.ndarray:
+    """Calculate potential evapotranspiration (PET) following the Priestley-Taylor equation from a clear sky table.
+
+    Parameters
+    ----------
+    t_min : np.ndarray
+        Daily min temperature (degree C)
+    t_max : np.ndarray
+        Daily max temperature (degree C)
+    s_rad : np.ndarray
+        Solar radiation (Wm-2)
+    elev : float
+        Elevation in m
+    doy : np.ndarray
+        Day of the year
+    cs_rad_table : np.ndarray
+        Clear sky radiation MJm-2day-1 of the days of the year 1 to 366, see `get_clear_sky_rad_table`
+
+    Returns
+    -------
+    np.ndarray
+        Array containing PET estimates in mm/day
+    """
+    gamma = _get_psy_const(_get_atmos_pressure(elev))
+    pet = np.empty(len(t_min))
+    for i in range(len(t_min)):
+        pet[i] = _get_pet_day(t_min[i], t_max[i], s_rad[i], cs_rad_table[doy[i] - 1], gamma)
+    return pet
+
+
+def get_priestley_taylor_pet_batch(t_min: np.ndarray, t_max: np.ndarray, s_rad: np.ndarray, lat: np.ndarray,
+                                   elev: np.ndarray, doy: np.ndarray) -> np.ndarray:
+    """Calculate potential evapotranspiration (PET) following the Priestley-Taylor equation for many basins at once.
+
+    Batched version of `get_priestley_taylor_pet` for basins (or grid cells) that share the same days. The basins are
+    distributed over the numba threads in a single call. The clear sky radiation of each basin is tabulated for the 366
+    days of the year and looked up for each day, as in `get_priestley_taylor_pet_cached`. The results are identical to
+    calling `get_priestley_taylor_pet` for each basin.
+
+    Parameters
+    ----------
+    t_min : np.ndarray
+        Daily min temperature (degree C) of shape (#basins, #days)
+    t_max : np.ndarray
+        Daily max temperature (degree C) of shape (#basins, #days)
+    s_rad : np.ndarray
+        Solar radiation (Wm-2) of shape (#basins, #days)
+    lat : np.ndarray
+        Latitude in degree of each basin, shape (#basins,)
+    elev : np.ndarray
+        Elevation in m of each basin, shape (#basins,)
+    doy : np.ndarray
+        Day of the year of each day, shape (#days,)
+
+    Returns
+    -------
+    np.ndarray
+        Array of shape (#basins, #days) containing PET estimates in mm/day
+
+    Raises
+    ------
+    ValueError
+        If the temperature and radiation arrays are not two-dimensional arrays of the same shape, or if the shapes of
+        `lat`, `elev` or `doy` do not match.
+    """
+    t_min, t_max, s_rad = np.asarray(t_min), np.asarray(t_max), np.asarray(s_rad)
+    lat, elev, doy = np.asarray(lat, dtype=np.float64), np.asarray(elev, dtype=np.float64), np.asarray(doy)
+    if t_min.ndim != 2 or t_max.shape != t_min.shape or s_rad.shape != t_min.shape:
+        raise ValueError(f"Expected t_min, t_max and s_rad of the same shape (#basins, #days), got {t_min.shape}, "
+                         f"{t_max.shape} and {s_rad.shape}")
+    if lat.shape != (t_min.shape[0],) or elev.shape != (t_min.shape[0],):
+        raise ValueError(f"Expected lat and elev of shape ({t_min.shape[0]},), got {lat.shape} and {elev.shape}")
+    if doy.shape != (t_min.shape[1],):
+        raise ValueError(f"Expected doy of shape ({t_min.shape[1]},), got {doy.shape}")
+    return _get_priestley_taylor_pet_batch(t_min, t_max, s_rad, lat, elev, doy.astype(np.int64))
+
+
+@njit(nogil=True, parallel=True)
+def _get_priestley_taylor_pet_batch(t_min: np.ndarray, t_max: np.ndarray, s_rad: np.ndarray, lat: np.ndarray,
+                                    elev: np.ndarray, doy: np.ndarray) -> np.ndarray:
+    """Parallel kernel of `get_priestley_taylor_pet_batch`, see there for the parameters."""
+    pet = np.empty(t_min.shape)
+    for b in prange(t_min.shape[0]):
+        lat_rad = lat[b] * (np.pi / 180)  # degree to rad
+        sin_lat, cos_lat, tan_lat = np.sin(lat_rad), np.cos(lat_rad), np.tan(lat_rad)
+        cs_rad_table = np.empty(366)
+        for d in range(366):
+            cs_rad_table[d] = _get_clear_sky_rad_day(sin_lat, cos_lat, tan_lat, elev[b], d + 1)
+        gamma = _get_psy_const(_get_atmos_pressure(elev[b]))
+        for i in range(t_min.shape[1]):
+            pet[b, i] = _get_pet_day(t_min[b, i], t_max[b, i], s_rad[b, i], cs_rad_table[doy[i] - 1], gamma)
+    return pet
+
+
+@njit(nogil=True)
+def get_priestley_taylor_pet_fused(t_min: np.ndarray, t_max: np.ndarray, s_rad: np.ndarray, lat: float, elev: float,
+                                   doy: np.ndarray) -> np.ndarray:
+    """Calculate potential evapotranspiration (PET) following the Priestley-Taylor equation in a single loop.
+
+    Same as `get_priestley_taylor_pet`, but all terms of a day are computed in one loop over the days, without any
+    temporary arrays. The results agree with `get_priestley_taylor_pet` up to floating point round-off.
+
+    Parameters
+    ----------
+    t_min : np.ndarray
+        Daily min temperature (degree C)
+    t_max : np.ndarray
+        Daily max temperature (degree C)
+    s_rad : np.ndarray
+        Solar radiation (Wm-2)
+    lat : float
+        Latitude in degree
+    elev : float
+        Elevation in m
+    doy : np.ndarray
+        Day of the year
+
+    Returns
+    -------
+    np.ndarray
+        Array containing PET estimates in mm/day
+    """
+    lat = lat * (np.pi / 180)  # degree to rad
+    sin_lat, cos_lat, tan_lat = np.sin(lat), np.cos(lat), np.tan(lat)
+    gamma = _get_psy_const(_get_atmos_pressure(elev))
+    pet = np.empty(len(t_min))
+    for i in range(len(t_min)):
+        cs_rad = _get_clear_sky_rad_day(sin_lat, cos_lat, tan_lat, elev, doy[i])
+        pet[i] = _get_pet_day(t_min[i], t_max[i], s_rad[i], cs_rad, gamma)
+    return pet
+
+
+@njit(nogil=True, parallel=True)
+def get_priestley_taylor_pet_parallel(t_min: np.ndarray, t_max: np.ndarray, s_rad: np.ndarray, lat: float,
+                                      elev: float, doy: np.ndarray) -> np.ndarray:
+    """Calculate potential evapotranspiration (PET) following the Priestley-Taylor equation on multiple threads.
+
+    Parallel version of `get_priestley_taylor_pet_fused`, the days are distributed over the numba threads. Only pays
+    off for long series (e.g. hourly or many decades), otherwise the threading overhead dominates.
+
+    Parameters
+    ----------
+    t_min : np.ndarray
+        Daily min temperature (degree C)
+    t_max : np.ndarray
+        Daily max temperature (degree C)
+    s_rad : np.ndarray
+        Solar radiation (Wm-2)
+    lat : float
+        Latitude in degree
+    elev : float
+        Elevation in m
+    doy : np.ndarray
+        Day of the year
+
+    Returns
+    -------
+    np.ndarray
+        Array containing PET estimates in mm/day
+    """
+    lat = lat * (np.pi / 180)  # degree to rad
+    sin_lat, cos_lat, tan_lat = np.sin(lat), np.cos(lat), np.tan(lat)
+    gamma = _get_psy_const(_get_atmos_pressure(elev))
+    pet = np.empty(len(t_min))
+    for i in prange(len(t_min)):
+        cs_rad = _get_clear_sky_rad_day(sin_lat, cos_lat, tan_lat, elev, doy[i])
+        pet[i] = _get_pet_day(t_min[i], t_max[i], s_rad[i], cs_rad, gamma)
+    return pet
+
+
+@njit(nogil=True, error_model='numpy')
+def _get_clear_sky_rad_day(sin_lat: float, cos_lat: float, tan_lat: float, elev: float, doy: float) -> float:
+    """Clear sky radiation of a single day, see `get_clear_sky_rad`
+
+    Equations 21, 23, 24, 25 and 37 FAO-56 Allen et al. (1998). The trigonometric functions of the latitude are passed
+    in, as they are the same for all days.
+
+    Parameters
+    ----------
+    sin_lat : float
+        Sine of the latitude
+    cos_lat : float
+        Cosine of the latitude
+    tan_lat : float
+        Tangent of the latitude
+    elev : float
+        Elevation in m
+    doy : float
+        Day of the year
+
+    Returns
+    -------
+    float
+        Clear sky radiation MJm-2day-1
+    """
+    sol_dec = 0.409 * np.sin((2 * np.pi) / 365 * doy - 1.39)
+    sin_dec, cos_dec = np.sin(sol_dec), np.cos(sol_dec)
+    term = -tan_lat * np.tan(sol_dec)
+    if term < -1:
+        term = -1.0
+    elif term > 1:
+        term = 1.0
+    sha = np.arccos(term)
+    ird = 1 + 0.033 * np.cos((2 * np.pi) / 365 * doy)
+    et_rad = (24 * 60) / np.pi * 0.082 * ird * (sha * sin_lat * sin_dec + cos_lat * cos_dec * np.sin(sha))
+    return (0.75 + 2 * 10e-5 * elev) * et_rad
+
+
+@njit(nogil=True, error_model='numpy')
+def _get_pet_day(t_min: float, t_max: float, s_rad: float, cs_rad: float, gamma: float) -> float:
+    """Priestley-Taylor PET of a single day, see `get_priestley_taylor_pet_from_clear_sky_rad`
+
+    Parameters
+    ----------
+    t_min : float
+        Min temperature (degree C)
+    t_max : float
+        Max temperature (degree C)
+    s_rad : float
+        Solar radiation (Wm-2)
+    cs_rad : float
+        Clear sky radiation MJm-2day-1
+    gamma : float
+        Psychometric constant in kPa/(degree C)
+
+    Returns
+    -------
+    float
+        PET estimate in mm/day
+    """
+    t_mean = 0.5 * (t_min + t_max)
+    slope_svp = 4098 * (0.6108 * np.exp((17.27 * t_mean) / (t_mean + 237.3))) / ((t_mean + 237.3)**2)
+
+    s_rad = s_rad * 0.0864  # conversion Wm-2 -> MJm-2day-1
+    in_sw_rad = (1 - 0.23) * s_rad
+
+    a_vp = 0.611 * np.exp((17.27 * t_min) / (t_min + 237.3))
+    out_lw_rad = 4.903e-09 * (((t_max + 273.16)**4 + (t_min + 273.16)**4) / 2) * (0.34 - 0.14 * np.sqrt(a_vp)) * (
+        1.35 * s_rad / cs_rad - 0.35)
+
+    net_rad = in_sw_rad - out_lw_rad
+    return (1.26 / 2.45) * (slope_svp * net_rad) / (slope_svp + gamma) * 0.408
+
+
+@njit(nogil=True)
 def _get_slope_svp_curve(t_mean: np.ndarray) -> np.ndarray:
     """Slope of saturation vapour pressure curve
 
@@ -97,7 +475,7 @@ def _get_slope_svp_curve(t_mean: np.ndarray) -> np.ndarray:
     return delta
 
 
-@njit
+@njit(nogil=True)
 def _get_net_sw_srad(s_rad: np.ndarray, albedo: float = 0.23) -> np.ndarray:
     """Calculate net shortwave radiation
 
@@ -119,7 +497,7 @@ def _get_net_sw_srad(s_rad: np.ndarray, albedo: float = 0.23) -> np.ndarray:
     return net_srad
 
 
-@njit
+@njit(nogil=True)
 def _get_sol_decl(doy: np.ndarray) -> np.ndarray:
     """Get solar declination
 
@@ -140,7 +518,7 @@ def _get_sol_decl(doy: np.ndarray) -> np.ndarray:
     return sol_dec
 
 
-@njit
+@njit(nogil=True)
 def _get_sunset_hour_angle(lat: float, sol_dec: np.ndarray) -> np.ndarray:
     """Sunset hour angle
 
@@ -165,7 +543,7 @@ def _get_sunset_hour_angle(lat: float, sol_dec: np.ndarray) -> np.ndarray:
     return sha
 
 
-@njit
+@njit(nogil=True)
 def _get_ird_earth_sun(doy: np.ndarray) -> np.ndarray:
     """Inverse relative distance between Earth and Sun
 
@@ -185,7 +563,7 @@ def _get_ird_earth_sun(doy: np.ndarray) -> np.ndarray:
     return ird
 
 
-@njit
+@njit(nogil=True)
 def _get_extraterra_rad(lat: float, sol_dec: np.ndarray, sha: np.ndarray, ird: np.ndarray) -> np.ndarray:
     """Extraterrestrial Radiation
 
@@ -213,7 +591,7 @@ def _get_extraterra_rad(lat: float, sol_dec: np.ndarray, sha: np.ndarray, ird: n
     return et_rad
 
 
-@njit
+@njit(nogil=True)
 def _get_clear_sky_rad(elev: float, et_rad: np.ndarray) -> np.ndarray:
     """Clear sky radiation
 
@@ -235,7 +613,7 @@ def _get_clear_sky_rad(elev: float, et_rad: np.ndarray) -> np.ndarray:
     return cs_rad
 
 
-@njit
+@njit(nogil=True)
 def _get_avp_tmin(t_min: np.ndarray) -> np.ndarray:
     """Actual vapor pressure estimated using min temperature
 
@@ -255,7 +633,7 @@ def _get_avp_tmin(t_min: np.ndarray) -> np.ndarray:
     return avp
 
 
-@njit
+@njit(nogil=True)
 def _get_net_outgoing_lw_rad(t_min: np.ndarray, t_max: np.ndarray, s_rad: np.ndarray, cs_rad: np.ndarray,
                              a_vp: np.ndarray) -> np.ndarray:
     """Net outgoing longwave radiation
@@ -290,7 +668,7 @@ def _get_net_outgoing_lw_rad(t_min: np.ndarray, t_max: np.ndarray, s_rad: np.nda
     return net_lw
 
 
-@njit
+@njit(nogil=True)
 def _get_net_rad(sw_rad: np.ndarray, lw_rad: np.ndarray) -> np.ndarray:
     """Net radiation
 
@@ -311,7 +689,7 @@ def _get_net_rad(sw_rad: np.ndarray, lw_rad: np.ndarray) -> np.ndarray:
     return sw_rad - lw_rad
 
 
-@njit
+@njit(nogil=True)
 def _get_atmos_pressure(elev: float) -> float:
     """Atmospheric pressure
 
@@ -331,7 +709,7 @@ def _get_atmos_pressure(elev: float) -> float:
     return np.power(temp, 5.26) * 101.3
 
 
-@njit
+@njit(nogil=True)
 def _get_psy_const(atm_pressure: float) -> float:
     """Psychometric constant
 
@@ -348,7 +726,7 @@ def _get_psy_const(atm_pressure: float) -> float:
     return 0.000665 * atm_pressure
 
 
-@njit
+@njit(nogil=True)
 def _srad_from_t(et_rad, cs_rad, t_min, t_max, coastal=False):
     """Estimate solar radiation from temperature"""
     # equation 50
@@ -1,8 +1,10 @@
 import functools
+import os
+import pickle
 import re
 from collections import defaultdict
 from pathlib import Path
-from typing import List, Union
+from typing import BinaryIO, Callable, Dict, Iterable, List, Tuple, Union
 
 import numpy as np
 import pandas as pd
@@ -77,6 +79,321 @@ def load_basin_file(basin_file: Path) -> List[str]:
     return basins
 
 
+def atomic_write(file_path: Path, writer: Callable[[BinaryIO], None]):
+    """Write a file such that concurrent readers never see a partially written file.
+
+    `writer` writes to a temporary file next to `file_path`, named after the file and the process id, which then
+    replaces `file_path`. A file therefore either holds its previous or its complete new content, also if several
+    processes write the same file at once.
+
+    Parameters
+    ----------
+    file_path : Path
+        Path of the file to write. Missing parent directories are created.
+    writer : Callable[[BinaryIO], None]
+        Function that writes the content to the binary file object it is called with, e.g.
+        ``lambda fp: pickle.dump(data, fp)``.
+    """
+    file_path = Path(file_path)
+    file_path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_file = file_path.parent / f"{file_path.name}.{os.getpid()}.tmp"
+    try:
+        with tmp_file.open('wb') as fp:
+            writer(fp)
+        os.replace(tmp_file, file_path)
+    except BaseException:
+        if tmp_file.exists():
+            tmp_file.unlink()
+        raise
+
+
+def get_file_fingerprint(file_path: Path) -> Tuple[str, int, int]:
+    """Get the resolved path, modification time (ns) and size of a file, e.g. as part of a cache key.
+
+    Parameters
+    ----------
+    file_path : Path
+        Path of the file.
+
+    Returns
+    -------
+    Tuple[str, int, int]
+        Resolved path, modification time in nanoseconds and size in bytes. Any change of the file (other than an
+        in-place rewrite with the same size within the timestamp resolution) changes the fingerprint.
+    """
+    file_path = Path(file_path).resolve()
+    stat = file_path.stat()
+    return str(file_path), stat.st_mtime_ns, stat.st_size
+
+
+def save_feature_cube(features: Dict[str, pd.DataFrame], cube_dir: Path):
+    """Store additional features as a columnar, memory-mappable float32 cube.
+
+    The cube directory contains a 'data.npy' array of shape (#columns, #basins, #dates), such that the time series of
+    one feature of one basin is a contiguous block on disk, and an 'index.p' pickle dump with the basin ids, column
+    names and the date index. Basins with a shorter record are padded with NaNs. The directory can be used in the
+    `additional_feature_files` config argument in place of a pickled dictionary of DataFrames.
+
+    Parameters
+    ----------
+    features : Dict[str, pd.DataFrame]
+        Dictionary mapping from basin id to a time-indexed DataFrame. All DataFrames must have the same columns, e.g.
+        the output of `calculate_camels_us_dyn_climate_indices`. MultiIndex columns are stored with flat names, see
+        `flatten_columns`.
+    cube_dir : Path
+        Directory to store the cube in. Will be created if it does not exist.
+
+    Raises
+    ------
+    ValueError
+        If the DataFrames do not all have the same columns.
+    """
+    basins = list(features.keys())
+    columns = list(features[basins[0]].columns)
+    if any(list(df.columns) != columns for df in features.values()):
+        raise ValueError("All DataFrames must have the same columns to be stored as feature cube.")
+    columns = [_flatten_column_name(column) for column in columns]
+
+    dates = features[basins[0]].index
+    for df in features.values():
+        dates = dates.union(df.index)
+
+    cube_dir.mkdir(parents=True, exist_ok=True)
+    data = np.lib.format.open_memmap(cube_dir / 'data.npy',
+                                     mode='w+',
+                                     dtype=np.float32,
+                                     shape=(len(columns), len(basins), len(dates)))
+    for i, basin in enumerate(basins):
+        data[:, i, :] = features[basin].reindex(dates).values.T
+    data.flush()
+    del data
+
+    with (cube_dir / 'index.p').open('wb') as fp:
+        pickle.dump({'basins': basins, 'columns': columns, 'dates': dates}, fp)
+
+
+def load_feature_cube(cube_dir: Path,
+                      basins: List[str] = None,
+                      columns: List[str] = None,
+                      start_date: pd.Timestamp = None,
+                      end_date: pd.Timestamp = None) -> Dict[str, pd.DataFrame]:
+    """Load (parts of) a feature cube stored with `save_feature_cube`.
+
+    The cube is memory-mapped, so only the requested basins, columns and dates are read from disk.
+
+    Parameters
+    ----------
+    cube_dir : Path
+        Directory of the feature cube.
+    basins : List[str], optional
+        Basins to load. If not passed, all basins of the cube are loaded.
+    columns : List[str], optional
+        Columns to load. If not passed, all columns of the cube are loaded.
+    start_date : pd.Timestamp, optional
+        First date to load. If not passed, the data is loaded from the first date of the cube.
+    end_date : pd.Timestamp, optional
+        Last date to load (inclusive). If not passed, the data is loaded until the last date of the cube.
+
+    Returns
+    -------
+    Dict[str, pd.DataFrame]
+        Dictionary mapping from basin id to a time-indexed float32 DataFrame.
+
+    Raises
+    ------
+    ValueError
+        If any of the requested basins or columns is not part of the cube.
+    """
+    index = _load_feature_cube_index(cube_dir)
+    if basins is None:
+        basins = index['basins']
+    if columns is None:
+        columns = index['columns']
+
+    missing = [b for b in basins if b not in index['basins']] + [c for c in columns if c not in index['columns']]
+    if missing:
+        raise ValueError(f"Feature cube at {cube_dir} has no data for {missing}")
+
+    basin_idx = {basin: i for i, basin in enumerate(index['basins'])}
+    column_idx = [index['columns'].index(c) for c in columns]
+    date_slice = index['dates'].slice_indexer(start_date, end_date)
+    dates = index['dates'][date_slice]
+
+    data = np.load(cube_dir / 'data.npy', mmap_mode='r')
+    features = {}
+    for basin in basins:
+        values = data[column_idx, basin_idx[basin], date_slice]
+        features[basin] = pd.DataFrame(values.T, index=dates, columns=columns)
+
+    return features
+
+
+def get_feature_cube_dates(cube_dir: Path) -> pd.DatetimeIndex:
+    """Get the date index of a feature cube.
+
+    Parameters
+    ----------
+    cube_dir : Path
+        Directory of the feature cube.
+
+    Returns
+    -------
+    pd.DatetimeIndex
+        Dates of the feature cube.
+    """
+    return _load_feature_cube_index(cube_dir)['dates']
+
+
+def get_feature_cube_columns(cube_dir: Path) -> List[str]:
+    """Get the names of the columns stored in a feature cube.
+
+    Parameters
+    ----------
+    cube_dir : Path
+        Directory of the feature cube.
+
+    Returns
+    -------
+    List[str]
+        Column names of the feature cube.
+    """
+    return _load_feature_cube_index(cube_dir)['columns']
+
+
+def _load_feature_cube_index(cube_dir: Path) -> dict:
+    index_file = cube_dir / 'index.p'
+    if not index_file.is_file():
+        raise FileNotFoundError(f"No feature cube index found at {index_file}")
+    with index_file.open('rb') as fp:
+        index = pickle.load(fp)
+    # cubes stored before the column names were flattened on save
+    index['columns'] = [_flatten_column_name(column) for column in index['columns']]
+    return index
+
+
+def flatten_columns(df: pd.DataFrame) -> pd.DataFrame:
+    """Flatten MultiIndex columns into one string per column, such that they can be used as input features.
+
+    The levels are joined with underscores in reverse order, e.g. the (window, index) columns of climate indices for
+    multiple window lengths become '<index>_<window>' (e.g. 'p_mean_dyn_365'). DataFrames with flat columns are
+    returned unchanged.
+
+    Parameters
+    ----------
+    df : pd.DataFrame
+        DataFrame with flat or MultiIndex columns.
+
+    Returns
+    -------
+    pd.DataFrame
+        DataFrame with flat column names.
+    """
+    if not isinstance(df.columns, pd.MultiIndex):
+        return df
+    return df.set_axis([_flatten_column_name(column) for column in df.columns], axis=1)
+
+
+def _flatten_column_name(column) -> str:
+    if isinstance(column, tuple):
+        return '_'.join(str(level) for level in reversed(column))
+    return column
+
+
+def is_feature_cube(feature_dir: Path) -> bool:
+    """Check if a directory contains a feature cube (see `save_feature_cube`) or per-basin feature files.
+
+    Parameters
+    ----------
+    feature_dir : Path
+        Directory of additional features.
+
+    Returns
+    -------
+    bool
+        True if the directory contains a feature cube.
+    """
+    return (feature_dir / 'data.npy').is_file()
+
+
+def save_features_per_basin(features: Iterable[Tuple[str, pd.DataFrame]], output_dir: Path) -> List[str]:
+    """Write per-basin features to disk as they arrive, e.g. from `iter_camels_us_dyn_climate_indices`.
+
+    Each basin is written to its own pickle dump ('<basin>.p') as soon as it is yielded, so memory does not grow with
+    the number of basins and the results of all finished basins survive a crash. Files are written to a temporary file
+    first and then renamed, so a file either holds a complete result or does not exist. To resume an interrupted run,
+    only compute the basins that are not yet returned by `get_saved_basins`. The directory can be used in the
+    `additional_feature_files` config argument.
+
+    Parameters
+    ----------
+    features : Iterable[Tuple[str, pd.DataFrame]]
+        Iterable of (basin id, time-indexed DataFrame) tuples.
+    output_dir : Path
+        Directory to store the features in. Will be created if it does not exist.
+
+    Returns
+    -------
+    List[str]
+        Basin ids that were written.
+    """
+    output_dir.mkdir(parents=True, exist_ok=True)
+    basins = []
+    for basin, df in features:
+        atomic_write(output_dir / f"{basin}.p", lambda fp: pickle.dump(df, fp))
+        basins.append(basin)
+    return basins
+
+
+def get_saved_basins(output_dir: Path) -> List[str]:
+    """Get the basins that were written by `save_features_per_basin`.
+
+    Parameters
+    ----------
+    output_dir : Path
+        Directory of the per-basin features.
+
+    Returns
+    -------
+    List[str]
+        Sorted basin ids. Empty if the directory does not exist.
+    """
+    return sorted(file.stem for file in output_dir.glob('*.p'))
+
+
+def load_features_per_basin(output_dir: Path, basins: List[str] = None) -> Dict[str, pd.DataFrame]:
+    """Load per-basin features written by `save_features_per_basin`.
+
+    Parameters
+    ----------
+    output_dir : Path
+        Directory of the per-basin features.
+    basins : List[str], optional
+        Basins to load. If not passed, all basins of the directory are loaded.
+
+    Returns
+    -------
+    Dict[str, pd.DataFrame]
+        Dictionary mapping from basin id to a time-indexed DataFrame.
+
+    Raises
+    ------
+    ValueError
+        If any of the requested basins is not part of the directory.
+    """
+    if basins is None:
+        basins = get_saved_basins(output_dir)
+
+    missing = [basin for basin in basins if not (output_dir / f"{basin}.p").is_file()]
+    if missing:
+        raise ValueError(f"No features at {output_dir} for basins {missing}")
+
+    features = {}
+    for basin in basins:
+        with (output_dir / f"{basin}.p").open('rb') as fp:
+            features[basin] = pickle.load(fp)
+    return features
+
+
 def attributes_sanity_check(df: pd.DataFrame):
     """Utility function to check the suitability of the attributes for model training.
     
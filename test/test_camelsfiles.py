@@ -0,0 +1,152 @@
+import os
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from functions.camelsfiles import (get_camels_us_manifest, lookup_camels_us_file, read_camels_us_discharge_file,
+                                   read_camels_us_forcing_file)
+from functions.camelsus import load_camels_us_discharge, load_camels_us_forcings
+from functions.climateindices import calculate_dyn_climate_indices
+
+BASIN = '01013500'
+
+
+def _load_forcings_baseline(file_path: Path):
+    # `functions.load_forcings` before the parsers of `functions.camelsfiles`
+    with open(file_path, 'r') as fp:
+        fp.readline()
+        fp.readline()
+        area = int(fp.readline())
+        df = pd.read_csv(fp, sep=r'\s+')
+        df["date"] = pd.to_datetime(df.Year.map(str) + "/" + df.Mnth.map(str) + "/" + df.Day.map(str),
+                                    format="%Y/%m/%d")
+        df = df.set_index("date")
+    return df, area
+
+
+def _load_usgs_baseline(file_path: Path, area: int):
+    # `functions.load_usgs` before the parsers of `functions.camelsfiles`
+    col_names = ['basin', 'Year', 'Mnth', 'Day', 'QObs', 'flag']
+    df = pd.read_csv(file_path, sep=r'\s+', header=None, names=col_names)
+    df["date"] = pd.to_datetime(df.Year.map(str) + "/" + df.Mnth.map(str) + "/" + df.Day.map(str), format="%Y/%m/%d")
+    df = df.set_index("date")
+    df.QObs = 28316846.592 * df.QObs * 86400 / (area * 10**6)
+    return df.QObs
+
+
+@pytest.fixture
+def camels_dir(tmp_path: Path) -> Path:
+    # two years of one basin, the precipitation has many days on the high precipitation threshold of 5 * p_mean
+    rng = np.random.default_rng(0)
+    dates = pd.date_range('1980-01-01', '1981-12-31')
+    prcp = rng.choice([0.0, 0.41, 1.312, 6.56], size=len(dates), p=[0.5, 0.2, 0.2, 0.1])
+    tmax = rng.uniform(-10, 30, len(dates)).round(2)
+
+    forcing_file = tmp_path / 'basin_mean_forcing' / 'daymet' / '01' / f'{BASIN}_lump_cida_forcing_leap.txt'
+    forcing_file.parent.mkdir(parents=True)
+    lines = ['44.6', '250', '199600281', 'Year Mnth Day Hr\tdayl(s)\tprcp(mm/day)\tsrad(W/m2)\tswe(mm)\ttmax(C)\t'
+             'tmin(C)\tvp(Pa)']
+    for date, p, tx in zip(dates, prcp, tmax):
+        lines.append(f'{date.year} {date.month:02d} {date.day:02d} 12\t40000.00\t{p:.3f}\t190.80\t0.00\t{tx:.2f}\t'
+                     f'{tx - 7.13:.2f}\t880.17')
+    forcing_file.write_text('\n'.join(lines) + '\n')
+
+    discharge_file = tmp_path / 'usgs_streamflow' / '01' / f'{BASIN}_streamflow_qc.txt'
+    discharge_file.parent.mkdir(parents=True)
+    discharge = rng.uniform(0, 500, len(dates)).round(2)
+    discharge[::50] = -999
+    discharge_file.write_text(''.join(f'{BASIN} {date.year} {date.month:02d} {date.day:02d} {q:.2f} A\n'
+                                      for date, q in zip(dates, discharge)))
+    return tmp_path
+
+
+def test_forcings_match_baseline(camels_dir: Path):
+    file_path = next((camels_dir / 'basin_mean_forcing').rglob('*.txt'))
+    expected, expected_area = _load_forcings_baseline(file_path)
+
+    df, area = load_camels_us_forcings(camels_dir, BASIN, 'daymet')
+    pd.testing.assert_frame_equal(df, expected, check_exact=True, check_freq=False)
+    assert area == expected_area
+
+    df, _ = read_camels_us_forcing_file(file_path, cache_dir=camels_dir / 'cache')
+    df, _ = read_camels_us_forcing_file(file_path, cache_dir=camels_dir / 'cache')
+    pd.testing.assert_frame_equal(df, expected, check_exact=True, check_freq=False)
+
+
+def test_discharge_matches_baseline(camels_dir: Path):
+    file_path = next((camels_dir / 'usgs_streamflow').rglob('*.txt'))
+    expected = _load_usgs_baseline(file_path, 199600281)
+
+    discharge = load_camels_us_discharge(camels_dir, BASIN, 199600281)
+    pd.testing.assert_series_equal(discharge, expected, check_exact=True, check_freq=False, check_names=False)
+    assert read_camels_us_discharge_file(file_path).dtype == np.float64
+
+
+def test_climate_indices_match_baseline(camels_dir: Path):
+    # threshold comparisons against 5 * p_mean must not change with the parser
+    file_path = next((camels_dir / 'basin_mean_forcing').rglob('*.txt'))
+    expected, _ = _load_forcings_baseline(file_path)
+    df, _ = load_camels_us_forcings(camels_dir, BASIN, 'daymet')
+
+    columns = ['prcp(mm/day)', 'tmax(C)', 'tmin(C)', 'prcp(mm/day)']
+    pd.testing.assert_frame_equal(calculate_dyn_climate_indices(*[df[col] for col in columns], 90),
+                                  calculate_dyn_climate_indices(*[expected[col] for col in columns], 90),
+                                  check_exact=True)
+
+
+def test_functions_loaders_match_baseline(camels_dir: Path):
+    pytest.importorskip('scipy')
+    from functions.functions import load_forcings, load_usgs
+
+    file_path = next((camels_dir / 'basin_mean_forcing').rglob('*.txt'))
+    expected, area = _load_forcings_baseline(file_path)
+    df, _ = load_forcings(camels_dir, BASIN, 'daymet')
+    pd.testing.assert_frame_equal(df, expected, check_exact=True, check_freq=False)
+
+    file_path = next((camels_dir / 'usgs_streamflow').rglob('*.txt'))
+    pd.testing.assert_series_equal(load_usgs(camels_dir, BASIN, area), _load_usgs_baseline(file_path, area),
+                                   check_exact=True, check_freq=False, check_names=False)
+
+
+def test_cache_entries_of_files_with_the_same_name(camels_dir: Path):
+    # e.g. nldas and nldas_extended use the same file names, the cached entries must not overwrite each other
+    file_path = next((camels_dir / 'basin_mean_forcing').rglob('*.txt'))
+    other_path = camels_dir / 'basin_mean_forcing' / 'daymet_extended' / '01' / file_path.name
+    other_path.parent.mkdir(parents=True)
+    other_path.write_text(file_path.read_text().replace('\t190.80\t', '\t200.00\t'))
+
+    cache_dir = camels_dir / 'cache'
+    for path in [file_path, other_path]:
+        read_camels_us_forcing_file(path, cache_dir=cache_dir)
+    assert len(list(cache_dir.glob('*.cache'))) == 2
+
+    df, _ = read_camels_us_forcing_file(file_path, cache_dir=cache_dir)
+    other, _ = read_camels_us_forcing_file(other_path, cache_dir=cache_dir)
+    assert (df['srad(W/m2)'] == 190.8).all() and (other['srad(W/m2)'] == 200.0).all()
+
+
+def test_manifest_is_not_stored_in_data_dir(camels_dir: Path):
+    cache_dir = camels_dir / 'cache'
+    get_camels_us_manifest(camels_dir, cache_dir=cache_dir)
+    assert len(list(cache_dir.glob('camels_manifest*'))) == 1
+    get_camels_us_manifest(camels_dir, revalidate=True)
+    assert not list(camels_dir.glob('camels_manifest*'))
+
+
+def test_manifest_detects_files_edited_in_place(camels_dir: Path):
+    # appending to a file does not change the modification time of its folder
+    cache_dir = camels_dir / 'cache'
+    file_path = next((camels_dir / 'basin_mean_forcing').rglob('*.txt'))
+    assert lookup_camels_us_file(camels_dir, BASIN, 'daymet', cache_dir=cache_dir)['end'] == pd.Timestamp('1981-12-31')
+
+    folder_stat = file_path.parent.stat()
+    with file_path.open('a') as fp:
+        fp.write('1982 01 01 12\t40000.00\t0.000\t190.80\t0.00\t1.00\t-6.13\t880.17\n')
+    os.utime(file_path.parent, ns=(folder_stat.st_atime_ns, folder_stat.st_mtime_ns))
+
+    entry = get_camels_us_manifest(camels_dir, cache_dir=cache_dir, revalidate=True)['forcings']['daymet'][BASIN]
+    assert entry['end'] == pd.Timestamp('1982-01-01') and entry['size'] == file_path.stat().st_size
+    df, _ = load_camels_us_forcings(camels_dir, BASIN, 'daymet', cache_dir=cache_dir)
+    assert df.index[-1] == pd.Timestamp('1982-01-01')
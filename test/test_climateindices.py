@@ -0,0 +1,102 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from functions.climateindices import (_numba_climate_indexes, calculate_dyn_climate_indices,
+                                      calculate_dyn_climate_indices_batch)
+
+# mean-type indices are taken from prefix sums by the kernels and from window means by the reference, which differ in
+# the last digits of the sums (relative to the sum of the whole series for windows with little precipitation), the
+# precipitation frequency and duration indices are counts and have to match exactly
+RTOL = 1e-6
+MEAN_INDICES = slice(0, 5)
+PREC_INDICES = slice(5, 9)
+
+
+def _random_features(rng: np.random.Generator, n_samples: int) -> np.ndarray:
+    # (prcp, tmax, tmin, pet) with dry days, wet spells of varying length and temperatures around zero
+    prcp = rng.gamma(0.4, 8, n_samples) * (rng.random(n_samples) > 0.5)
+    tmax = rng.normal(5, 8, n_samples)
+    return np.stack([prcp, tmax, tmax - rng.uniform(0, 10, n_samples), rng.uniform(0, 5, n_samples)], axis=1)
+
+
+def _tied_features(rng: np.random.Generator, n_samples: int) -> np.ndarray:
+    # precipitation on a few values, such that 5 * p_mean of many windows (nearly) equals a daily value, e.g. the windows
+    # of the repeated pattern (6.56, 0, 0, 0, 0) with p_mean 1.312
+    features = _random_features(rng, n_samples)
+    prcp = rng.choice([0.0, 0.41, 1.312, 6.56], size=n_samples, p=[0.5, 0.2, 0.2, 0.1])
+    prcp[:200] = np.tile([6.56, 0.0, 0.0, 0.0, 0.0], 40)
+    features[:, 0] = prcp
+    return features
+
+
+def _wet_features(rng: np.random.Generator, n_samples: int) -> np.ndarray:
+    # a wet period of 60 days without any dry day (prcp < 1) in the middle of the series
+    features = _random_features(rng, n_samples)
+    features[100:160, 0] = rng.uniform(1, 20, 60)
+    return features
+
+
+def _calculate(features: np.ndarray, window_length: int, **kwargs) -> pd.DataFrame:
+    dates = pd.date_range('2000-01-01', periods=len(features))
+    return calculate_dyn_climate_indices(*[pd.Series(features[:, j], index=dates) for j in range(4)], window_length,
+                                         **kwargs)
+
+
+@pytest.mark.parametrize('make_features', [_random_features, _tied_features, _wet_features])
+@pytest.mark.parametrize('window_length', [1, 2, 5, 30, 365])
+def test_kernels_match_reference(make_features, window_length: int):
+    features = make_features(np.random.default_rng(window_length), 500)
+    expected = _numba_climate_indexes(features, window_length)
+
+    result = _calculate(features, window_length).values
+    np.testing.assert_allclose(result[:, MEAN_INDICES], expected[:, MEAN_INDICES], rtol=RTOL, atol=1e-9)
+    np.testing.assert_array_equal(result[:, PREC_INDICES], expected[:, PREC_INDICES])
+
+    batch = calculate_dyn_climate_indices_batch(features[None], window_length)[0, min(window_length, 500) - 1:]
+    np.testing.assert_array_equal(batch, result)
+
+
+def test_windows_without_dry_days():
+    features = _wet_features(np.random.default_rng(0), 500)
+    expected = _numba_climate_indexes(features, 30)
+    result = _calculate(features, 30)
+
+    # the windows that lie in the wet period
+    wet = result.iloc[100:131]
+    assert (wet['low_prec_freq_dyn'] == 0).all() and wet['low_prec_dur_dyn'].isna().all()
+    np.testing.assert_array_equal(result.values[:, PREC_INDICES], expected[:, PREC_INDICES])
+
+
+def test_windows_with_missing_precipitation():
+    features = _random_features(np.random.default_rng(0), 500)
+    features[200, 0] = np.nan
+    expected = _numba_climate_indexes(features, 30)
+    result = _calculate(features, 30)
+
+    # the windows that contain the missing day, only the temperature and PET indices do not depend on precipitation
+    missing = result.iloc[171:201]
+    independent = ['pet_mean_dyn', 't_mean_dyn']
+    assert missing.drop(columns=independent).isna().all().all() and missing[independent].notna().all().all()
+    assert result.drop(index=missing.index).notna().all().all()
+    np.testing.assert_allclose(result.values[:, MEAN_INDICES], expected[:, MEAN_INDICES], rtol=RTOL, atol=1e-9)
+    np.testing.assert_array_equal(result.values[:, PREC_INDICES], expected[:, PREC_INDICES])
+
+
+@pytest.mark.parametrize('make_features', [_random_features, _tied_features])
+def test_entry_points_match_full_series(make_features):
+    # all entry points run the fused kernels of the same accumulators
+    features = make_features(np.random.default_rng(1), 500)
+    full = _calculate(features, 30)
+
+    dates = list(full.index[[400, 0, 250]])
+    pd.testing.assert_frame_equal(_calculate(features, 30, at_dates=dates), full.loc[dates], check_exact=True)
+    every = _calculate(features, 30, every=7)
+    pd.testing.assert_frame_equal(every, full.loc[every.index], check_exact=True, check_freq=False)
+
+    indices = ['high_prec_dur_dyn', 'p_mean_dyn', 'low_prec_freq_dyn']
+    pd.testing.assert_frame_equal(_calculate(features, 30, indices=indices), full[indices], check_exact=True)
+    sweep = _calculate(features, 30, indices=indices, high_prec_thresholds=[5], low_prec_thresholds=[1])
+    for index in indices:
+        column = index if index == 'p_mean_dyn' else f"{index}_{5 if index.startswith('high') else 1}"
+        pd.testing.assert_series_equal(sweep[column], full[index], check_exact=True, check_names=False)